@@ -0,0 +1,222 @@
+"""
+Creazione in blocco da JSON (endpoint /<entità>/bulk).
+
+Ogni elemento è validato con lo stesso schema *Create dell'endpoint singolo;
+poi, per tutto il blocco insieme, si controllano i riferimenti (prodotti,
+ingredienti, rider esistenti) e i nomi univoci con una query per tabella.
+Gli elementi validi sono inseriti con un'unica INSERT executemany ...
+RETURNING id, senza caricare né rinfrescare oggetti ORM, e le tabelle
+materializzate (food cost, rollup vendite, giacenze) sono aggiornate una
+volta per blocco.
+
+Modalità:
+- all_or_nothing: basta un elemento non valido perché non venga inserito nulla
+- best_effort: gli elementi non validi sono scartati e riportati con il loro
+  indice; se l'INSERT di blocco fallisce comunque per un vincolo del database
+  (es. inserimento concorrente), la transazione è annullata e gli elementi
+  vengono inseriti uno per uno: SQLite annulla solo lo statement in errore
+"""
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Type
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import crud, food_cost, models, rollups, schemas, stock
+from .utils import chunks, format_validation_error
+
+ALL_OR_NOTHING = "all_or_nothing"
+BEST_EFFORT = "best_effort"
+MODES = (ALL_OR_NOTHING, BEST_EFFORT)
+
+MAX_ITEMS = 10000
+
+
+class BulkSpec(NamedTuple):
+    model: type
+    schema: Type[BaseModel]
+    values: Callable[[BaseModel], dict]
+    # campo -> modello referenziato (deve esistere)
+    references: Dict[str, type]
+    # campo univoco (nel blocco e sul database), se c'è
+    unique: Optional[str]
+    # aggiornamento delle tabelle materializzate dopo l'insert (righe, id)
+    after_insert: Optional[Callable[[Session, List[dict], List[int]], None]]
+    # controlli sull'intero blocco: scarta da valid gli elementi non validi e restituisce gli errori
+    check: Optional[Callable[[Session, Dict[int, dict]], List[dict]]] = None
+
+
+def _existing(db: Session, column, values) -> set:
+    found = set()
+    for chunk in chunks({v for v in values if v is not None}):
+        found.update(db.execute(select(column).where(column.in_(chunk))).scalars())
+    return found
+
+
+# -----------------
+# SPECIFICHE PER ENTITÀ
+# -----------------
+def _after_ingredients(db: Session, rows: List[dict], ids: List[int]) -> None:
+    food_cost.on_ingredients_changed(db, ids)
+
+
+def _after_recipes(db: Session, rows: List[dict], ids: List[int]) -> None:
+    food_cost.recompute_products(db, {r["product_id"] for r in rows})
+
+
+def _check_recipes(db: Session, valid: Dict[int, dict]) -> List[dict]:
+    # i cicli vanno cercati anche tra le righe dello stesso blocco: il grafo cresce man mano
+    errors, graph = [], None
+    for index, values in list(valid.items()):
+        if values["component_product_id"] is None:
+            continue
+        graph = food_cost.component_graph(db) if graph is None else graph
+        try:
+            food_cost.check_component(graph, values["product_id"], values["component_product_id"])
+        except ValueError as exc:
+            errors.append({"index": index, "error": str(exc)})
+            del valid[index]
+            continue
+        graph[values["product_id"]].add(values["component_product_id"])
+    return errors
+
+
+def _after_orders(db: Session, rows: List[dict], ids: List[int]) -> None:
+    rollups.apply_orders(db, rows)
+
+
+def _after_movements(db: Session, rows: List[dict], ids: List[int]) -> None:
+    stock.apply_movements(db, rows)
+
+
+SPECS: Dict[str, BulkSpec] = {
+    "ingredients": BulkSpec(
+        models.Ingredient, schemas.IngredientCreate, lambda i: i.dict(),
+        {}, "name", _after_ingredients,
+    ),
+    "recipes": BulkSpec(
+        models.Recipe, schemas.RecipeCreate, lambda r: r.dict(),
+        {"product_id": models.Product, "ingredient_id": models.Ingredient, "component_product_id": models.Product},
+        None, _after_recipes, _check_recipes,
+    ),
+    "orders": BulkSpec(
+        models.Order, schemas.OrderCreate, crud.order_values,
+        {"product_id": models.Product, "rider_id": models.Rider}, None, _after_orders,
+    ),
+    "inventory": BulkSpec(
+        models.InventoryMovement, schemas.InventoryMovementCreate, crud.movement_values,
+        {"ingredient_id": models.Ingredient}, None, _after_movements,
+    ),
+    "products": BulkSpec(
+        models.Product, schemas.ProductCreate, lambda p: p.dict(),
+        {}, "name", None,
+    ),
+    "riders": BulkSpec(
+        models.Rider, schemas.RiderCreate, lambda r: r.dict(),
+        {}, "name", None,
+    ),
+}
+
+
+# -----------------
+# VALIDAZIONE E INSERT
+# -----------------
+def validate(db: Session, spec: BulkSpec, items: List[dict]):
+    """Restituisce ({indice: valori} validi, [{index, error}]) per il blocco."""
+    valid, errors = {}, []
+    for index, item in enumerate(items):
+        try:
+            valid[index] = spec.values(spec.schema.parse_obj(item))
+        except ValidationError as exc:
+            errors.append({"index": index, "error": format_validation_error(exc)})
+
+    for field, ref_model in spec.references.items():
+        found = _existing(db, ref_model.id, (v[field] for v in valid.values()))
+        for index, values in list(valid.items()):
+            if values[field] is not None and values[field] not in found:
+                errors.append({"index": index, "error": f"{field} {values[field]} inesistente"})
+                del valid[index]
+
+    if spec.unique:
+        column = getattr(spec.model, spec.unique)
+        taken = _existing(db, column, (v[spec.unique] for v in valid.values()))
+        seen = set()
+        for index, values in list(valid.items()):
+            key = values[spec.unique]
+            if key in taken or key in seen:
+                where = "già esistente" if key in taken else "duplicato nel blocco"
+                errors.append({"index": index, "error": f"{spec.unique} '{key}' {where}"})
+                del valid[index]
+            seen.add(key)
+
+    if spec.check:
+        errors.extend(spec.check(db, valid))
+
+    errors.sort(key=lambda e: e["index"])
+    return valid, errors
+
+
+def _insert(db: Session, spec: BulkSpec, rows: List[dict]) -> List[int]:
+    # INSERT Core sulla tabella: quello ORM spezza l'executemany a ogni cambio
+    # delle colonne a NULL (es. rider_id presente solo in parte degli ordini)
+    table = spec.model.__table__
+    stmt = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+    return list(db.execute(stmt, rows).scalars())
+
+
+def _insert_one_by_one(db: Session, spec: BulkSpec, valid: dict, errors: list) -> dict:
+    inserted = {}
+    for index, values in valid.items():
+        try:
+            inserted[index] = _insert(db, spec, [values])[0]
+        except IntegrityError as exc:
+            errors.append({"index": index, "error": str(exc.orig)})
+    return inserted
+
+
+def create_many(
+    db: Session, entity: str, items: List[dict], mode: str = ALL_OR_NOTHING, commit: bool = True,
+) -> dict:
+    """
+    Crea in un'unica transazione gli elementi di items (dict nel formato dello
+    schema *Create dell'entità). Restituisce ids allineati a items (None per gli
+    elementi scartati) ed errori per indice; in all_or_nothing con errori non
+    inserisce nulla.
+
+    Con commit=False il commit spetta al chiamante (es. insieme al checkpoint
+    di un job); un errore di vincolo annulla comunque la transazione corrente.
+    """
+    spec = SPECS[entity]
+    valid, errors = validate(db, spec, items)
+    ids: List[Optional[int]] = [None] * len(items)
+    result = {"mode": mode, "inserted": 0, "ids": ids, "errors": errors}
+    if errors and mode == ALL_OR_NOTHING:
+        return result
+
+    inserted = {}
+    try:
+        if valid:
+            try:
+                inserted = dict(zip(valid, _insert(db, spec, list(valid.values()))))
+            except IntegrityError as exc:
+                # parte del blocco può essere già stata scritta: si riparte da zero
+                db.rollback()
+                if mode == ALL_OR_NOTHING:
+                    errors.append({"index": None, "error": str(exc.orig)})
+                    return result
+                inserted = _insert_one_by_one(db, spec, valid, errors)
+                errors.sort(key=lambda e: e["index"])
+            if inserted and spec.after_insert:
+                spec.after_insert(db, [valid[i] for i in inserted], list(inserted.values()))
+        if commit:
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    for index, new_id in inserted.items():
+        ids[index] = new_id
+    result["inserted"] = len(inserted)
+    return result
@@ -0,0 +1,186 @@
+"""
+Autenticazione delle richieste.
+
+get_current_user è la dependency applicata a tutti gli endpoint protetti:
+verifica il JWT e controlla che l'utente esista ancora. Il risultato è
+salvato in una cache LRU per token, valida al massimo fino all'exp del token
+(e comunque non oltre TOKEN_CACHE_TTL), così i token usati spesso non
+ripetono né la verifica HMAC né la query sull'utente.
+
+get_tenant risolve il tenant della richiesta dal claim "tenant" del token
+(DEFAULT_TENANT per i token che non lo hanno e, con AUTH_REQUIRED=false,
+per le richieste senza token) e lo salva in request.state.tenant. La cache
+dei token resta indicizzata per token: il tenant è un claim firmato, quindi
+token di tenant diversi non condividono mai una voce.
+
+get_stream_tenant fa lo stesso per gli stream SSE: EventSource nel browser
+non può impostare l'header Authorization, quindi oltre all'header (per i
+client non browser) accetta il token dal cookie access_token oppure, nella
+URL, un ticket di create_stream_ticket: un JWT con scope "live" che scade
+dopo LIVE_TICKET_SECONDS, così nei log di accesso e nella cronologia del
+browser non finisce mai il token di accesso. I ticket non valgono come token
+di accesso sugli altri endpoint.
+
+revoke_token (usato da /auth/logout) invalida un token fino alla sua
+scadenza: lo segna tra i revocati del processo e lo salva nella tabella
+revoked_tokens del database principale, che get_current_user consulta a ogni
+cache miss. Il worker che riceve il logout rifiuta il token subito; gli altri
+worker (e l'app dopo un riavvio) appena il token esce dalla loro cache, cioè
+entro TOKEN_CACHE_TTL secondi.
+"""
+
+import hashlib
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+from fastapi import Cookie, Depends, HTTPException, Query, Request, status
+from fastapi.security import OAuth2PasswordBearer
+from jose import jwt, JWTError
+from sqlalchemy import delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from . import config
+from .cache import TTLCache
+from .. import models
+from ..database import AsyncSessionLocal
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
+
+# scope dei ticket per gli stream SSE (vedi get_stream_tenant)
+STREAM_SCOPE = "live"
+
+token_cache = TTLCache(maxsize=config.TOKEN_CACHE_SIZE, ttl=config.TOKEN_CACHE_TTL)
+# token revocati -> True, conservati solo fino alla loro scadenza naturale
+revoked_tokens = TTLCache(maxsize=config.TOKEN_CACHE_SIZE)
+
+
+class CurrentUser(NamedTuple):
+    id: int
+    email: str
+    tenant: str
+
+
+def _credentials_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid authentication credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+def decode_token(token: str) -> dict:
+    try:
+        return jwt.decode(token, config.SECRET_KEY, algorithms=[config.ALGORITHM])
+    except JWTError:
+        raise _credentials_error()
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> CurrentUser:
+    if revoked_tokens.get(token):
+        raise _credentials_error()
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+
+    payload = decode_token(token)
+    if payload.get("scope") is not None:
+        # i ticket degli stream non valgono come token di accesso
+        raise _credentials_error()
+    user = await _load_user(token, payload)
+    token_cache.set(token, user, expires_at=payload.get("exp"))
+    return user
+
+
+async def _load_user(token: str, payload: dict) -> CurrentUser:
+    """Utente del token già decodificato; 401 se non esiste più, è cambiato o il token è revocato."""
+    async with AsyncSessionLocal() as db:
+        db_user = await db.get(models.User, payload.get("id"))
+        revoked = await db.get(models.RevokedToken, _token_hash(token))
+    if revoked is not None:
+        revoked_tokens.set(token, True, expires_at=payload.get("exp"))
+        raise _credentials_error()
+    tenant = payload.get("tenant", config.DEFAULT_TENANT)
+    if db_user is None or db_user.email != payload.get("sub") or db_user.tenant != tenant:
+        raise _credentials_error()
+    return CurrentUser(id=db_user.id, email=db_user.email, tenant=tenant)
+
+
+def create_stream_ticket(user: CurrentUser) -> str:
+    """Ticket firmato, valido LIVE_TICKET_SECONDS e solo per aprire gli stream SSE."""
+    expire = datetime.utcnow() + timedelta(seconds=config.LIVE_TICKET_SECONDS)
+    claims = {
+        "sub": user.email, "id": user.id, "tenant": user.tenant,
+        "scope": STREAM_SCOPE, "exp": expire, "jti": uuid.uuid4().hex,
+    }
+    return jwt.encode(claims, config.SECRET_KEY, algorithm=config.ALGORITHM)
+
+
+async def verify_stream_ticket(ticket: str) -> CurrentUser:
+    if revoked_tokens.get(ticket):
+        raise _credentials_error()
+    payload = decode_token(ticket)
+    if payload.get("scope") != STREAM_SCOPE:
+        raise _credentials_error()
+    return await _load_user(ticket, payload)
+
+
+async def get_tenant(request: Request, token: Optional[str] = Depends(optional_oauth2_scheme)) -> str:
+    tenant = config.DEFAULT_TENANT
+    if token is not None:
+        tenant = (await get_current_user(token)).tenant
+    request.state.tenant = tenant
+    return tenant
+
+
+async def get_stream_tenant(
+    request: Request,
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    ticket: Optional[str] = Query(None, description="Ticket di /live/ticket, per i client che non possono inviare l'header Authorization (EventSource)"),
+    access_token: Optional[str] = Cookie(None, include_in_schema=False),
+) -> str:
+    if ticket is not None:
+        tenant = (await verify_stream_ticket(ticket)).tenant
+    elif token or access_token:
+        tenant = (await get_current_user(token or access_token)).tenant
+    elif config.AUTH_REQUIRED:
+        raise _credentials_error()
+    else:
+        tenant = config.DEFAULT_TENANT
+    request.state.tenant = tenant
+    return tenant
+
+
+async def require_admin(user: CurrentUser = Depends(get_current_user)) -> CurrentUser:
+    if user.email.lower() not in config.ADMIN_EMAILS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
+    return user
+
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+async def revoke_token(token: str) -> None:
+    """Invalida il token fino alla sua scadenza, in questo processo e nel database."""
+    token_cache.pop(token)
+    try:
+        claims = jwt.get_unverified_claims(token)
+    except JWTError:
+        return
+    exp = claims.get("exp")
+    if exp is not None and exp <= time.time():
+        return
+    revoked_tokens.set(token, True, expires_at=exp)
+    table = models.RevokedToken.__table__
+    async with AsyncSessionLocal() as db:
+        # le revoche scadute non servono più: il token è comunque rifiutato dall'exp
+        await db.execute(delete(table).where(table.c.expires_at < datetime.utcnow()))
+        await db.execute(sqlite_insert(table).on_conflict_do_nothing().values(
+            token_hash=_token_hash(token),
+            user_id=claims.get("id"),
+            expires_at=datetime.utcfromtimestamp(exp) if exp is not None else None,
+        ))
+        await db.commit()
@@ -0,0 +1,120 @@
+"""
+Impostazioni dell'applicazione, lette da variabili d'ambiente (o dal file .env).
+
+Database:
+- DATABASE_URL: URL SQLAlchemy del database principale (scritture e letture)
+- DATABASE_READ_URL: se impostato, engine separato in sola lettura usato dagli
+  endpoint dashboard/KPI (può puntare allo stesso file SQLite: in WAL i lettori
+  non bloccano lo scrittore e le letture non occupano il pool delle scritture)
+- DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_TIMEOUT: pool connessioni
+- SQLITE_*: PRAGMA applicati a ogni nuova connessione SQLite
+
+Multi-tenant (un database per ristorante):
+- DEFAULT_TENANT: tenant dei token senza claim "tenant" e delle richieste non
+  autenticate (AUTH_REQUIRED=false); i suoi dati stanno in DATABASE_URL, che
+  ospita anche gli utenti di tutti i tenant
+- TENANT_DATABASE_URL: URL del database degli altri tenant, con {tenant} come
+  segnaposto (default: un file SQLite per tenant in ./tenants/)
+- TENANT_ENGINE_CACHE_SIZE: massimo numero di tenant con engine e pool aperti (LRU)
+- TENANT_ENGINE_IDLE_SECONDS: dopo quanti secondi senza richieste gli engine
+  di un tenant vengono chiusi
+- TENANT_ADMIN_CONCURRENCY: query in parallelo (una per tenant) nei report admin
+- ADMIN_EMAILS: email separate da virgola degli utenti ammessi agli endpoint /admin
+
+Autenticazione:
+- SECRET_KEY, ACCESS_TOKEN_EXPIRE_MINUTES: firma e durata dei JWT
+- AUTH_REQUIRED: se true (default) tutti gli endpoint dati richiedono un token
+- TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL: cache dei token già verificati (voci, secondi)
+- BCRYPT_ROUNDS: costo bcrypt per i nuovi hash; gli hash con costo inferiore
+  vengono ricalcolati in modo trasparente al login
+- PASSWORD_HASH_CONCURRENCY: massimo numero di hash/verifiche bcrypt in
+  parallelo (thread dedicati), così un picco di login non satura il worker
+
+Cache:
+- RESPONSE_CACHE_SIZE: numero massimo di risposte dashboard in cache (LRU)
+
+Metriche:
+- METRICS_ENABLED: se true (default) misura ogni richiesta (latenza, query SQL),
+  aggiunge l'header Server-Timing ed espone /metrics in formato Prometheus
+
+Aggiornamenti in tempo reale (/live/updates):
+- LIVE_FLUSH_INTERVAL: secondi tra due aggiornamenti per tenant (le modifiche
+  nel frattempo, es. un import CSV, sono raccolte in un solo messaggio)
+- LIVE_QUEUE_SIZE: messaggi in coda per connessione; oltre, il client riceve
+  un evento "resync" invece dei messaggi persi
+- LIVE_HEARTBEAT_SECONDS: intervallo dei commenti keep-alive sullo stream
+- LIVE_RETRY_SECONDS: attesa suggerita al browser prima di riconnettersi
+- LIVE_TICKET_SECONDS: validità dei ticket di /live/ticket, da passare nella URL
+  dello stream al posto del token di accesso
+
+Import in background (/jobs):
+- IMPORT_JOB_WORKERS: job di import eseguiti in parallelo (thread dedicati, così
+  gli import non occupano i thread delle richieste interattive)
+- IMPORT_JOB_CHUNK_SIZE: righe per transazione; ogni blocco salva anche il checkpoint
+- IMPORT_JOB_DIR: cartella dei file caricati, in attesa di essere importati
+- IMPORT_JOB_POLL_SECONDS: ogni quanto i worker inattivi cercano job in coda
+  o interrotti (es. dopo un riavvio)
+- IMPORT_JOB_STALE_SECONDS: dopo quanti secondi senza checkpoint un job "running"
+  è considerato interrotto e viene ripreso da un altro worker
+
+Magazzino:
+- STOCK_SNAPSHOT_EVERY: ogni quanti movimenti di un ingrediente viene salvato
+  uno snapshot della giacenza (limita la scansione per le giacenze "as of")
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()  # carica .env in os.environ
+
+
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///./foodcost.db')
+DATABASE_READ_URL = os.getenv('DATABASE_READ_URL', '')
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '3600'))  # secondi
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))  # secondi
+
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_CACHE_SIZE = int(os.getenv('SQLITE_CACHE_SIZE', '-65536'))  # negativo = KiB (64 MiB)
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))  # byte
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000'))  # millisecondi
+SQLITE_TEMP_STORE = os.getenv('SQLITE_TEMP_STORE', 'MEMORY')
+
+DEFAULT_TENANT = os.getenv('DEFAULT_TENANT', 'default')
+TENANT_DATABASE_URL = os.getenv('TENANT_DATABASE_URL', 'sqlite:///./tenants/{tenant}.db')
+TENANT_ENGINE_CACHE_SIZE = int(os.getenv('TENANT_ENGINE_CACHE_SIZE', '32'))
+TENANT_ENGINE_IDLE_SECONDS = int(os.getenv('TENANT_ENGINE_IDLE_SECONDS', '600'))
+TENANT_ADMIN_CONCURRENCY = int(os.getenv('TENANT_ADMIN_CONCURRENCY', '8'))
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv('ADMIN_EMAILS', '').split(',') if e.strip()}
+
+SECRET_KEY = os.getenv('SECRET_KEY', 'supersecretkey')
+ALGORITHM = 'HS256'
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES', '60'))
+AUTH_REQUIRED = os.getenv('AUTH_REQUIRED', 'true').lower() in ('1', 'true', 'yes')
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', '300'))  # secondi
+
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+PASSWORD_HASH_CONCURRENCY = int(os.getenv('PASSWORD_HASH_CONCURRENCY', str(max((os.cpu_count() or 2) // 2, 1))))
+
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '256'))
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+LIVE_FLUSH_INTERVAL = float(os.getenv('LIVE_FLUSH_INTERVAL', '1.0'))  # secondi
+LIVE_QUEUE_SIZE = int(os.getenv('LIVE_QUEUE_SIZE', '100'))
+LIVE_HEARTBEAT_SECONDS = float(os.getenv('LIVE_HEARTBEAT_SECONDS', '15'))
+LIVE_RETRY_SECONDS = float(os.getenv('LIVE_RETRY_SECONDS', '3'))
+LIVE_TICKET_SECONDS = int(os.getenv('LIVE_TICKET_SECONDS', '60'))
+
+IMPORT_JOB_WORKERS = int(os.getenv('IMPORT_JOB_WORKERS', '2'))
+IMPORT_JOB_CHUNK_SIZE = int(os.getenv('IMPORT_JOB_CHUNK_SIZE', '1000'))
+IMPORT_JOB_DIR = os.getenv('IMPORT_JOB_DIR', './import_jobs')
+IMPORT_JOB_POLL_SECONDS = float(os.getenv('IMPORT_JOB_POLL_SECONDS', '5'))
+IMPORT_JOB_STALE_SECONDS = float(os.getenv('IMPORT_JOB_STALE_SECONDS', '300'))
+
+STOCK_SNAPSHOT_EVERY = int(os.getenv('STOCK_SNAPSHOT_EVERY', '500'))
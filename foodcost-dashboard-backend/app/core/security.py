@@ -1,13 +1,24 @@
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from anyio import CapacityLimiter, to_thread
 from jose import jwt
 
+from . import config
+
 # Secret e algoritmo (spostali in .env e leggi con python‐dotenv)
 SECRET_KEY = "your_super_secret_key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 1 giorno
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# min_rounds = costo corrente: needs_update segnala gli hash creati con un costo più basso
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=config.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=config.BCRYPT_ROUNDS,
+)
+_hash_limiter: Optional[CapacityLimiter] = None
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -15,6 +26,23 @@ def hash_password(password: str) -> str:
 def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
+def _limiter() -> CapacityLimiter:
+    global _hash_limiter
+    if _hash_limiter is None:
+        _hash_limiter = CapacityLimiter(config.PASSWORD_HASH_CONCURRENCY)
+    return _hash_limiter
+
+async def hash_password_async(password: str) -> str:
+    """bcrypt in un thread dedicato, con al più PASSWORD_HASH_CONCURRENCY hash in parallelo."""
+    return await to_thread.run_sync(pwd_context.hash, password, limiter=_limiter())
+
+async def verify_and_update_async(plain: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifica la password fuori dall'event loop. Restituisce (valida, nuovo_hash):
+    nuovo_hash è valorizzato se l'hash salvato usa un costo non più attuale.
+    """
+    return await to_thread.run_sync(pwd_context.verify_and_update, plain, hashed, limiter=_limiter())
+
 def create_access_token(subject: str) -> str:
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode = {"sub": subject, "exp": expire}
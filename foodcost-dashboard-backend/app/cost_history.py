@@ -0,0 +1,364 @@
+"""
+Storico dei costi ingrediente e food cost "as of".
+
+ingredient_cost_history è append-only: ogni volta che il costo di un
+ingrediente cambia (creazione, modifica, import, eliminazione: tutte passano
+da food_cost.on_ingredients_changed) si aggiunge una versione con il nuovo
+costo e valid_from = istante della modifica. Una versione vale nell'intervallo
+[valid_from, valid_from della versione successiva); la prima versione nota di
+un ingrediente vale dall'inizio (HISTORY_START), così gli ordini precedenti
+alla creazione dell'ingrediente o alla migrazione usano il primo costo noto.
+Un ingrediente eliminato riceve una versione con unit_cost NULL (costo 0,
+come nel food cost corrente). Gli ingredienti senza storico (es. inseriti
+direttamente nel database) usano il costo attuale.
+
+Il "costo as of T" di un ingrediente è l'ultima versione con valid_from <= T,
+letta sull'indice (ingredient_id, valid_from). Il food cost di un prodotto a
+un istante usa le ricette attuali (le ricette non sono versionate) e i costi
+in vigore, risolvendo i semilavorati in ordine topologico (RecipeCosts).
+
+Per i margini storici ogni ordine è valutato al costo in vigore quando è
+stato venduto, con un merge ordinato: gli istanti di cambio di costo del
+periodo dividono il tempo in segmenti a costi costanti, e SQLite aggrega gli
+ordini per (segmento, prodotto) con un join tra i segmenti (ordinati) e
+l'indice su orders.timestamp; poi si scorrono i segmenti in ordine applicando
+i cambi di costo e ricalcolando solo i prodotti toccati e i loro antenati.
+Il costo è quindi calcolato una volta per segmento e prodotto venduto, non
+una volta per ordine, e gli ordini non passano da Python. La serie temporale
+delle vendite usa lo stesso merge sulle righe dei rollup (food_costs_at_sale),
+leggendo gli ordini solo per le ore o i giorni in cui un costo è cambiato.
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import DateTime, Integer, func, literal, select, union_all
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from . import food_cost, models
+from .utils import chunks
+
+# validità della prima versione nota di ogni ingrediente
+HISTORY_START = datetime(1970, 1, 1)
+
+# intervalli tra cambi di costo per query (3 parametri ciascuno)
+_SEGMENT_CHUNK = 300
+
+
+# -----------------
+# SCRITTURA
+# -----------------
+def _latest_versions(
+    db: Session,
+    ingredient_ids: Optional[Iterable[int]] = None,
+    at: Optional[datetime] = None,
+) -> Dict[int, Optional[float]]:
+    """{ingredient_id: unit_cost} dell'ultima versione (con valid_from <= at, se indicato)."""
+    h = models.IngredientCostHistory
+    last = select(h.ingredient_id, func.max(h.valid_from).label("valid_from"))
+    if at is not None:
+        last = last.where(h.valid_from <= at)
+    filters = [None] if ingredient_ids is None else [h.ingredient_id.in_(c) for c in chunks(set(ingredient_ids))]
+    latest = {}
+    for condition in filters:
+        subquery = (last if condition is None else last.where(condition)).group_by(h.ingredient_id).subquery()
+        latest.update(
+            db.execute(
+                select(h.ingredient_id, h.unit_cost)
+                .join(subquery, (h.ingredient_id == subquery.c.ingredient_id) & (h.valid_from == subquery.c.valid_from))
+            ).all()
+        )
+    return latest
+
+
+def record_costs(db: Session, ingredient_ids: Iterable[int], at: Optional[datetime] = None) -> int:
+    """
+    Aggiunge una versione per gli ingredienti il cui costo attuale differisce
+    dall'ultima versione registrata (non fa commit). Restituisce quante.
+    """
+    db.flush()
+    ingredient_ids = {i for i in ingredient_ids if i is not None}
+    if not ingredient_ids:
+        return 0
+    at = at or datetime.utcnow()
+    current = {}
+    for chunk in chunks(ingredient_ids):
+        current.update(
+            db.execute(select(models.Ingredient.id, models.Ingredient.unit_cost).where(models.Ingredient.id.in_(chunk)))
+            .all()
+        )
+    latest = _latest_versions(db, ingredient_ids)
+    rows = []
+    for ingredient_id in sorted(ingredient_ids):
+        cost = current.get(ingredient_id)
+        if ingredient_id in latest:
+            if latest[ingredient_id] == cost:
+                continue
+            rows.append({"ingredient_id": ingredient_id, "unit_cost": cost, "valid_from": at})
+        elif ingredient_id in current:
+            rows.append({"ingredient_id": ingredient_id, "unit_cost": cost, "valid_from": HISTORY_START})
+    if rows:
+        db.execute(models.IngredientCostHistory.__table__.insert(), rows)
+    return len(rows)
+
+
+def backfill(conn: Connection) -> None:
+    """Prima versione (valida da HISTORY_START) per gli ingredienti senza storico."""
+    h = models.IngredientCostHistory.__table__
+    i = models.Ingredient.__table__
+    conn.execute(
+        h.insert().from_select(
+            ["ingredient_id", "unit_cost", "valid_from"],
+            select(i.c.id, i.c.unit_cost, literal(HISTORY_START, DateTime))
+            .where(~select(h.c.id).where(h.c.ingredient_id == i.c.id).exists()),
+        )
+    )
+
+
+# -----------------
+# LETTURE
+# -----------------
+def get_history(db: Session, ingredient_id: int) -> List[dict]:
+    """Versioni del costo di un ingrediente con il loro intervallo di validità."""
+    h = models.IngredientCostHistory
+    versions = db.execute(
+        select(h.unit_cost, h.valid_from)
+        .where(h.ingredient_id == ingredient_id)
+        .order_by(h.valid_from, h.id)
+    ).all()
+    return [
+        {
+            "unit_cost": cost,
+            "valid_from": valid_from,
+            "valid_to": versions[n + 1][1] if n + 1 < len(versions) else None,
+        }
+        for n, (cost, valid_from) in enumerate(versions)
+    ]
+
+
+def costs_as_of(db: Session, at: datetime) -> Dict[int, Optional[float]]:
+    """Costo in vigore all'istante at per ogni ingrediente (attuale o storico)."""
+    costs = dict(db.execute(select(models.Ingredient.id, models.Ingredient.unit_cost)).all())
+    costs.update(_latest_versions(db, at=at))
+    return costs
+
+
+class RecipeCosts:
+    """
+    Food cost unitario di tutti i prodotti con ricetta per un insieme di costi
+    ingrediente, con le ricette in memoria: a ogni cambio di costo si
+    ricalcolano solo i prodotti che usano gli ingredienti cambiati e i loro
+    antenati, in ordine topologico.
+    """
+
+    def __init__(self, db: Session):
+        r = models.Recipe
+        self.lines = defaultdict(list)  # prodotto -> [(ingrediente, quantità)]
+        self.users = defaultdict(set)  # ingrediente -> prodotti
+        for product, ingredient, quantity in db.execute(
+            select(r.product_id, r.ingredient_id, func.coalesce(r.quantity, 0.0))
+            .where(r.product_id.isnot(None), r.ingredient_id.isnot(None))
+        ):
+            self.lines[product].append((ingredient, quantity))
+            self.users[ingredient].add(product)
+        self.components = defaultdict(list)  # prodotto -> [(semilavorato, quantità)]
+        self.parents = defaultdict(set)  # semilavorato -> prodotti
+        edges = food_cost.component_edges(db)
+        for product, component, quantity in edges:
+            self.components[product].append((component, quantity))
+            self.parents[component].add(product)
+        nodes = set(self.lines) | set(self.components)
+        self.rank = {p: n for n, p in enumerate(food_cost.topological_order(nodes, ((p, c) for p, c, _ in edges)))}
+        self.unit_costs: Dict[int, Optional[float]] = {}
+        self.food_costs: Dict[int, float] = {}
+        self._dirty = set(nodes)
+
+    def set_unit_costs(self, costs: Dict[int, Optional[float]]) -> None:
+        for ingredient, cost in costs.items():
+            if ingredient not in self.unit_costs or self.unit_costs[ingredient] != cost:
+                self.unit_costs[ingredient] = cost
+                self._dirty.update(self.users.get(ingredient, ()))
+
+    def costs(self) -> Dict[int, float]:
+        if self._dirty:
+            dirty, stack = set(self._dirty), list(self._dirty)
+            while stack:
+                for parent in self.parents.get(stack.pop(), ()):
+                    if parent not in dirty:
+                        dirty.add(parent)
+                        stack.append(parent)
+            for product in sorted(dirty, key=self.rank.__getitem__):
+                total = sum(q * (self.unit_costs.get(i) or 0.0) for i, q in self.lines[product])
+                total += sum(q * self.food_costs.get(c, 0.0) for c, q in self.components[product])
+                self.food_costs[product] = total
+            self._dirty.clear()
+        return self.food_costs
+
+
+def food_costs_as_of(db: Session, at: datetime) -> List[tuple]:
+    """Righe (product_id, food_cost) con i costi ingrediente in vigore all'istante at."""
+    engine = RecipeCosts(db)
+    engine.set_unit_costs(costs_as_of(db, at))
+    return sorted(engine.costs().items())
+
+
+def _segment_totals(
+    db: Session,
+    segments: List[Tuple[datetime, datetime]],
+    product_id: Optional[int] = None,
+    rider_id: Optional[int] = None,
+) -> List[tuple]:
+    """
+    Righe (segmento, product_id, pezzi, incasso) degli ordini con
+    start <= timestamp < end per ogni segmento n = (start, end): un join tra i
+    segmenti (ordinati) e l'indice su orders.timestamp, cioè un range scan per
+    segmento. product_id e rider_id filtrano gli ordini come nei rollup.
+    """
+    o = models.Order
+    totals = []
+    for first in range(0, len(segments), _SEGMENT_CHUNK):
+        last = min(first + _SEGMENT_CHUNK, len(segments))
+        chunk = union_all(*(
+            select(
+                literal(n, Integer).label("n"),
+                literal(segments[n][0], DateTime).label("start"),
+                literal(segments[n][1], DateTime).label("end"),
+            )
+            for n in range(first, last)
+        )).cte("segments")
+        query = (
+            select(
+                chunk.c.n, o.product_id,
+                func.coalesce(func.sum(o.quantity), 0), func.coalesce(func.sum(o.price), 0.0),
+            )
+            .select_from(chunk)
+            .join(o, (o.timestamp >= chunk.c.start) & (o.timestamp < chunk.c.end))
+            .where(o.product_id.isnot(None))
+            .group_by(chunk.c.n, o.product_id)
+            .order_by(chunk.c.n)
+        )
+        if product_id is not None:
+            query = query.where(o.product_id == product_id)
+        if rider_id is not None:
+            query = query.where(o.rider_id == rider_id)
+        totals.extend(db.execute(query).all())
+    return totals
+
+
+def _changes(db: Session, after: datetime, until: datetime) -> List[tuple]:
+    """Cambi di costo (valid_from, ingrediente, costo) con after < valid_from <= until, in ordine di tempo."""
+    h = models.IngredientCostHistory
+    return db.execute(
+        select(h.valid_from, h.ingredient_id, h.unit_cost)
+        .where(h.valid_from > after, h.valid_from <= until)
+        .order_by(h.valid_from, h.id)
+    ).all()
+
+
+def get_product_margins(
+    db: Session,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+) -> List[tuple]:
+    """
+    Righe (product_id, total_price, total_qty, food_cost) per ogni prodotto
+    venduto in [date_from, date_to), dove food_cost è il costo unitario medio
+    ponderato sui pezzi, con ogni ordine valutato ai costi del momento di
+    vendita (gli ordini senza timestamp non hanno un momento e sono esclusi).
+    """
+    o = models.Order
+    query = select(func.min(o.timestamp), func.max(o.timestamp))
+    if date_from is not None:
+        query = query.where(o.timestamp >= date_from)
+    if date_to is not None:
+        query = query.where(o.timestamp < date_to)
+    first, last = db.execute(query).one()
+    if first is None:
+        return []
+
+    # cambi di costo dopo il primo ordine e fino all'ultimo
+    changes = _changes(db, first, last)
+    bounds = sorted({valid_from for valid_from, _, _ in changes})
+    # segmento n: [edges[n], edges[n + 1]), tra due istanti di cambio consecutivi
+    edges = [first] + bounds + [last + timedelta(microseconds=1)]
+
+    engine = RecipeCosts(db)
+    engine.set_unit_costs(costs_as_of(db, first))
+    totals = defaultdict(lambda: [0.0, 0.0, 0.0])  # prodotto -> [incasso, pezzi, costo]
+    applied = 0
+    for segment, product_id, quantity, price in _segment_totals(db, list(zip(edges, edges[1:]))):
+        # applica i cambi fino all'inizio del segmento (righe ordinate per segmento)
+        batch = {}
+        while applied < len(changes) and changes[applied][0] <= edges[segment]:
+            batch[changes[applied][1]] = changes[applied][2]
+            applied += 1
+        if batch:
+            engine.set_unit_costs(batch)
+        row = totals[product_id]
+        row[0] += price
+        row[1] += quantity
+        row[2] += quantity * engine.costs().get(product_id, 0.0)
+    return [
+        (product_id, price, quantity, cost / quantity if quantity else 0.0)
+        for product_id, (price, quantity, cost) in sorted(totals.items())
+    ]
+
+
+def food_costs_at_sale(
+    db: Session,
+    pieces: List[Tuple[datetime, datetime, int, int]],
+    product_id: Optional[int] = None,
+    rider_id: Optional[int] = None,
+) -> List[float]:
+    """
+    Food cost ai costi del momento di vendita per righe di rollup
+    (da, a, product_id, pezzi), nello stesso ordine delle righe. Una riga
+    senza cambi di costo dentro [da, a) è valutata tutta ai costi in vigore a
+    da; una riga attraversata da un cambio (al più una per cambio e tabella)
+    è ripartita tra gli istanti di cambio leggendo i suoi ordini con
+    _segment_totals, filtrati per product_id e rider_id come le righe. Poi,
+    come in get_product_margins, si scorrono righe e spezzoni in ordine di
+    tempo applicando i cambi di costo.
+    """
+    if not pieces:
+        return []
+    first = min(start for start, _, _, _ in pieces)
+    last = max(end for _, end, _, _ in pieces)
+    changes = _changes(db, first, last)
+    bounds = sorted({valid_from for valid_from, _, _ in changes})
+
+    events = []  # (istante, riga, prodotto, pezzi)
+    split = defaultdict(dict)  # (da, a) -> prodotto -> riga, per le righe attraversate da un cambio
+    for index, (start, end, pid, quantity) in enumerate(pieces):
+        if bisect_right(bounds, start) < bisect_left(bounds, end):
+            split[(start, end)][pid] = index
+        else:
+            events.append((start, index, pid, quantity))
+    segments, owners = [], []
+    for (start, end), rows in split.items():
+        edges = [start] + bounds[bisect_right(bounds, start):bisect_left(bounds, end)] + [end]
+        for lo, hi in zip(edges, edges[1:]):
+            segments.append((lo, hi))
+            owners.append(rows)
+    for segment, pid, quantity, _ in _segment_totals(db, segments, product_id, rider_id):
+        index = owners[segment].get(pid)
+        if index is not None:
+            events.append((segments[segment][0], index, pid, quantity))
+    events.sort(key=lambda event: event[0])
+
+    engine = RecipeCosts(db)
+    engine.set_unit_costs(costs_as_of(db, first))
+    costs = [0.0] * len(pieces)
+    applied = 0
+    for at, index, pid, quantity in events:
+        batch = {}
+        while applied < len(changes) and changes[applied][0] <= at:
+            batch[changes[applied][1]] = changes[applied][2]
+            applied += 1
+        if batch:
+            engine.set_unit_costs(batch)
+        costs[index] += quantity * engine.costs().get(pid, 0.0)
+    return costs
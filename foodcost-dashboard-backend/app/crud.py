@@ -1,7 +1,9 @@
+from sqlalchemy import func, insert, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
-from . import models, schemas
+from . import models, schemas, food_cost, pagination, rollups, search, stock
 from datetime import datetime
-from typing import Optional, List
+from typing import Iterable, Optional, List, Sequence
 
 
 # -----------------
@@ -10,6 +12,9 @@ from typing import Optional, List
 def create_ingredient(db: Session, ingredient: schemas.IngredientCreate):
     db_ingredient = models.Ingredient(**ingredient.dict())
     db.add(db_ingredient)
+    db.flush()
+    # eventuali ricette orfane che puntano a questo id tornano ad avere un costo
+    food_cost.on_ingredients_changed(db, [db_ingredient.id])
     db.commit()
     db.refresh(db_ingredient)
     return db_ingredient
@@ -17,6 +22,9 @@ def create_ingredient(db: Session, ingredient: schemas.IngredientCreate):
 def get_ingredient(db: Session, ingredient_id: int):
     return db.query(models.Ingredient).filter(models.Ingredient.id == ingredient_id).first()
 
+def get_ingredient_by_name(db: Session, name: str):
+    return db.query(models.Ingredient).filter(models.Ingredient.name == name).first()
+
 def get_ingredients(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Ingredient).offset(skip).limit(limit).all()
 
@@ -24,17 +32,56 @@ def delete_ingredient(db: Session, ingredient_id: int):
     obj = db.query(models.Ingredient).get(ingredient_id)
     if obj:
         db.delete(obj)
+        food_cost.on_ingredients_changed(db, [ingredient_id])
         db.commit()
 
 def update_ingredient(db: Session, ingredient_id: int, ingredient: schemas.IngredientCreate):
     obj = db.query(models.Ingredient).get(ingredient_id)
     if obj:
+        cost_changed = obj.unit_cost != ingredient.unit_cost
         obj.name = ingredient.name
         obj.unit_cost = ingredient.unit_cost
+        if cost_changed:
+            food_cost.on_ingredients_changed(db, [ingredient_id])
         db.commit()
         db.refresh(obj)
     return obj
 
+def get_ingredient_cost_index(db: Session):
+    """Indici {id: (name, unit_cost)} e {name: id} di tutti gli ingredienti, con una sola query."""
+    by_id, by_name = {}, {}
+    for ing_id, name, unit_cost in db.query(
+        models.Ingredient.id, models.Ingredient.name, models.Ingredient.unit_cost
+    ):
+        by_id[ing_id] = (name, unit_cost)
+        by_name[name] = ing_id
+    return by_id, by_name
+
+def bulk_upsert_ingredient_costs(db: Session, updates: dict, inserts: dict, commit: bool = True):
+    """
+    Applica in blocco i costi: updates {id: unit_cost} con UPDATE per chiave primaria,
+    inserts {name: unit_cost} con INSERT ... ON CONFLICT(name) DO UPDATE.
+    """
+    inserted_ids = []
+    if updates:
+        db.execute(
+            update(models.Ingredient),
+            [{"id": ing_id, "unit_cost": cost} for ing_id, cost in updates.items()],
+        )
+    if inserts:
+        stmt = sqlite_insert(models.Ingredient.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[models.Ingredient.name],
+            set_={"unit_cost": stmt.excluded.unit_cost},
+        )
+        inserted_ids = db.execute(
+            stmt.returning(models.Ingredient.__table__.c.id),
+            [{"name": name, "unit_cost": cost} for name, cost in inserts.items()],
+        ).scalars().all()
+    food_cost.on_ingredients_changed(db, list(updates) + inserted_ids)
+    if commit:
+        db.commit()
+
 # -----------------
 # PRODUCT CRUD
 # -----------------
@@ -52,9 +99,19 @@ def get_products(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Product).offset(skip).limit(limit).all()
 
 def delete_product(db: Session, product_id: int):
+    """
+    Elimina il prodotto con le sue righe ricetta e il suo food cost; ValueError
+    se è ancora usato come semilavorato (il costo dei piatti che lo usano
+    cambierebbe senza che nessuno lo abbia chiesto).
+    """
     obj = db.query(models.Product).get(product_id)
     if obj:
+        users = food_cost.ancestors(db, [product_id])
+        if users:
+            raise ValueError(f"prodotto usato come semilavorato dai prodotti {sorted(users)}")
+        db.query(models.Recipe).filter(models.Recipe.product_id == product_id).delete(synchronize_session=False)
         db.delete(obj)
+        food_cost.recompute_products(db, [product_id])
         db.commit()
 
 def update_product(db: Session, product_id: int, product: schemas.ProductCreate):
@@ -69,8 +126,12 @@ def update_product(db: Session, product_id: int, product: schemas.ProductCreate)
 # RECIPE CRUD
 # -----------------
 def create_recipe(db: Session, recipe: schemas.RecipeCreate):
+    """Crea una riga ricetta; ValueError se il semilavorato chiuderebbe un ciclo."""
+    if recipe.component_product_id is not None:
+        food_cost.check_component(food_cost.component_graph(db), recipe.product_id, recipe.component_product_id)
     db_recipe = models.Recipe(**recipe.dict())
     db.add(db_recipe)
+    food_cost.recompute_products(db, [db_recipe.product_id])
     db.commit()
     db.refresh(db_recipe)
     return db_recipe
@@ -82,21 +143,37 @@ def delete_recipe(db: Session, recipe_id: int):
     obj = db.query(models.Recipe).get(recipe_id)
     if obj:
         db.delete(obj)
+        food_cost.recompute_products(db, [obj.product_id])
         db.commit()
 
 # -----------------
 # ORDER CRUD
 # -----------------
-def create_order(db: Session, order: schemas.OrderCreate):
+def order_values(order: schemas.OrderCreate) -> dict:
     data = order.dict()
     if data.get("timestamp") is None:
         data["timestamp"] = datetime.utcnow()
-    db_order = models.Order(**data)
+    return data
+
+def create_order(db: Session, order: schemas.OrderCreate):
+    values = order_values(order)
+    db_order = models.Order(**values)
     db.add(db_order)
+    rollups.apply_orders(db, [values])
     db.commit()
     db.refresh(db_order)
     return db_order
 
+def bulk_create_orders(db: Session, orders: List[schemas.OrderCreate], commit: bool = True) -> int:
+    """Inserisce un blocco di ordini con un'unica INSERT executemany, senza refresh."""
+    rows = [order_values(o) for o in orders]
+    if rows:
+        db.execute(insert(models.Order), rows)
+        rollups.apply_orders(db, rows)
+    if commit:
+        db.commit()
+    return len(rows)
+
 def get_order(db: Session, order_id: int):
     return db.query(models.Order).filter(models.Order.id == order_id).first()
 
@@ -106,18 +183,24 @@ def get_orders(db: Session, skip: int = 0, limit: int = 100):
 def delete_order(db: Session, order_id: int):
     obj = db.query(models.Order).get(order_id)
     if obj:
+        rollups.apply_orders(db, [rollups.order_values(obj)], sign=-1)
         db.delete(obj)
         db.commit()
 
 # -----------------
 # INVENTORY MOVEMENT CRUD
 # -----------------
-def create_inventory_movement(db: Session, movement: schemas.InventoryMovementCreate):
+def movement_values(movement: schemas.InventoryMovementCreate) -> dict:
     data = movement.dict()
     if data.get("timestamp") is None:
         data["timestamp"] = datetime.utcnow()
+    return data
+
+def create_inventory_movement(db: Session, movement: schemas.InventoryMovementCreate):
+    data = movement_values(movement)
     db_movement = models.InventoryMovement(**data)
     db.add(db_movement)
+    stock.apply_movements(db, [data])
     db.commit()
     db.refresh(db_movement)
     return db_movement
@@ -128,6 +211,7 @@ def get_inventory_movements(db: Session, skip: int = 0, limit: int = 100):
 def delete_inventory_movement(db: Session, movement_id: int):
     obj = db.query(models.InventoryMovement).get(movement_id)
     if obj:
+        stock.apply_movements(db, [stock.movement_values(obj)], sign=-1)
         db.delete(obj)
         db.commit()
 
@@ -162,18 +246,58 @@ def update_rider(db: Session, rider_id: int, rider: schemas.RiderCreate):
         db.refresh(obj)
     return obj
 
+def get_rider_performance(
+    db: Session,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    rider_ids: Optional[Iterable[int]] = None,
+):
+    """
+    Statistiche consegne per rider con un solo GROUP BY su orders.rider_id,
+    in join esterno con riders (anche i rider senza consegne compaiono).
+    Con rider_ids solo per quei rider. Come le altre letture per periodo,
+    l'intervallo è [date_from, date_to).
+    """
+    stats = db.query(
+        models.Order.rider_id,
+        func.count(models.Order.id).label("deliveries"),
+        func.sum(models.Order.price).label("total_revenue"),
+        func.sum(models.Order.quantity).label("items_delivered"),
+        func.min(models.Order.timestamp).label("first_order"),
+        func.max(models.Order.timestamp).label("last_order"),
+    ).filter(models.Order.rider_id.isnot(None))
+    if date_from:
+        stats = stats.filter(models.Order.timestamp >= date_from)
+    if date_to:
+        stats = stats.filter(models.Order.timestamp < date_to)
+    if rider_ids is not None:
+        rider_ids = sorted(set(rider_ids))
+        stats = stats.filter(models.Order.rider_id.in_(rider_ids))
+    stats = stats.group_by(models.Order.rider_id).subquery()
+    query = db.query(
+        models.Rider.id,
+        models.Rider.name,
+        models.Rider.delivery_time,
+        func.coalesce(stats.c.deliveries, 0),
+        func.coalesce(stats.c.total_revenue, 0.0),
+        func.coalesce(stats.c.items_delivered, 0),
+        stats.c.first_order,
+        stats.c.last_order,
+    ).outerjoin(stats, stats.c.rider_id == models.Rider.id)
+    if rider_ids is not None:
+        query = query.filter(models.Rider.id.in_(rider_ids))
+    return query.order_by(models.Rider.id).all()
+
 
 
 # --- Ordini filtrati ---
-def get_orders_filtered(
+def orders_filtered_query(
     db: Session,
     date_from: Optional[datetime] = None,
     date_to:   Optional[datetime] = None,
     product_id: Optional[int] = None,
-    rider_id: Optional[int] = None,
-    skip: int = 0,
-    limit: int = 100
-) -> List[models.Order]:
+    rider_id: Optional[int] = None
+):
     query = db.query(models.Order)
     if date_from:
         query = query.filter(models.Order.timestamp >= date_from)
@@ -183,8 +307,39 @@ def get_orders_filtered(
         query = query.filter(models.Order.product_id == product_id)
     if rider_id is not None:
         query = query.filter(models.Order.rider_id == rider_id)
+    return query
+
+def get_orders_filtered(
+    db: Session,
+    date_from: Optional[datetime] = None,
+    date_to:   Optional[datetime] = None,
+    product_id: Optional[int] = None,
+    rider_id: Optional[int] = None,
+    skip: int = 0,
+    limit: int = 100
+) -> List[models.Order]:
+    query = orders_filtered_query(db, date_from, date_to, product_id, rider_id)
     return query.order_by(models.Order.timestamp).offset(skip).limit(limit).all()
 
+# --- Movimenti magazzino filtrati ---
+def inventory_movements_filtered_query(
+    db: Session,
+    date_from: Optional[datetime] = None,
+    date_to:   Optional[datetime] = None,
+    ingredient_id: Optional[int] = None,
+    movement_type: Optional[models.MovementType] = None
+):
+    query = db.query(models.InventoryMovement)
+    if date_from:
+        query = query.filter(models.InventoryMovement.timestamp >= date_from)
+    if date_to:
+        query = query.filter(models.InventoryMovement.timestamp <= date_to)
+    if ingredient_id is not None:
+        query = query.filter(models.InventoryMovement.ingredient_id == ingredient_id)
+    if movement_type:
+        query = query.filter(models.InventoryMovement.movement_type == movement_type)
+    return query
+
 # --- Ingredienti filtrati ---
 def get_ingredients_filtered(
     db: Session,
@@ -196,7 +351,7 @@ def get_ingredients_filtered(
 ) -> List[models.Ingredient]:
     query = db.query(models.Ingredient)
     if name_contains:
-        query = query.filter(models.Ingredient.name.ilike(f"%{name_contains}%"))
+        query = query.filter(*search.name_filter(db, models.Ingredient, name_contains))
     if cost_min is not None:
         query = query.filter(models.Ingredient.unit_cost >= cost_min)
     if cost_max is not None:
@@ -208,3 +363,21 @@ def get_ingredients_filtered(
 # Recupera tutte le ricette
 def get_all_recipes(db: Session, skip: int = 0, limit: int = 1000):
     return db.query(models.Recipe).offset(skip).limit(limit).all()
+
+# --- Paginazione keyset: ordini e movimenti su (timestamp, id), il resto su id ---
+_KEYSET_COLUMNS = {
+    models.Order: ("timestamp", "id"),
+    models.InventoryMovement: ("timestamp", "id"),
+}
+
+def get_keyset_page(
+    db: Session, model, cursor: Optional[str] = None, limit: int = 100, columns: Optional[Sequence[str]] = None,
+):
+    """Pagina di oggetti ORM, o di tuple con le sole columns (che devono includere le chiavi)."""
+    keys = [getattr(model, name) for name in _KEYSET_COLUMNS.get(model, ("id",))]
+    query = db.query(*(getattr(model, c) for c in columns)) if columns else db.query(model)
+    return pagination.keyset_page(query, keys, cursor, limit)
+
+def get_column_rows(db: Session, model, columns: Sequence[str], skip: int = 0, limit: int = 100):
+    """Come get_orders/get_inventory_movements, ma tuple di colonne invece di oggetti ORM."""
+    return db.query(*(getattr(model, c) for c in columns)).offset(skip).limit(limit).all()
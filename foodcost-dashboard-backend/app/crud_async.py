@@ -0,0 +1,110 @@
+"""
+Versioni async delle funzioni crud, per gli endpoint async (import CSV e dashboard).
+
+Ogni funzione esegue la corrispondente funzione sincrona con
+AsyncSession.run_sync: la logica (compreso l'aggiornamento delle tabelle
+materializzate) resta in un solo punto, ma ogni round-trip al database viene
+atteso sul driver aiosqlite invece di bloccare l'event loop di uvicorn.
+"""
+
+from datetime import datetime
+from typing import BinaryIO, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, schemas, importers, cost_history, food_cost, rollups, stock, variance
+
+
+# -----------------
+# CREAZIONI (usate dagli import CSV)
+# -----------------
+async def create_ingredient(db: AsyncSession, ingredient: schemas.IngredientCreate):
+    return await db.run_sync(crud.create_ingredient, ingredient)
+
+async def get_ingredient(db: AsyncSession, ingredient_id: int):
+    return await db.run_sync(crud.get_ingredient, ingredient_id)
+
+async def get_ingredient_by_name(db: AsyncSession, name: str):
+    return await db.run_sync(crud.get_ingredient_by_name, name)
+
+async def update_ingredient(db: AsyncSession, ingredient_id: int, ingredient: schemas.IngredientCreate):
+    return await db.run_sync(crud.update_ingredient, ingredient_id, ingredient)
+
+async def create_product(db: AsyncSession, product: schemas.ProductCreate):
+    return await db.run_sync(crud.create_product, product)
+
+async def create_recipe(db: AsyncSession, recipe: schemas.RecipeCreate):
+    return await db.run_sync(crud.create_recipe, recipe)
+
+async def create_order(db: AsyncSession, order: schemas.OrderCreate):
+    return await db.run_sync(crud.create_order, order)
+
+async def create_inventory_movement(db: AsyncSession, movement: schemas.InventoryMovementCreate):
+    return await db.run_sync(crud.create_inventory_movement, movement)
+
+async def create_rider(db: AsyncSession, rider: schemas.RiderCreate):
+    return await db.run_sync(crud.create_rider, rider)
+
+
+# -----------------
+# IMPORT BULK
+# -----------------
+async def import_orders(db: AsyncSession, fileobj: BinaryIO, chunk_size: int, commit_every: int) -> dict:
+    return await db.run_sync(importers.import_orders, fileobj, chunk_size, commit_every)
+
+async def import_ingredient_costs(db: AsyncSession, fileobj: BinaryIO) -> dict:
+    return await db.run_sync(importers.import_ingredient_costs, fileobj)
+
+
+# -----------------
+# DASHBOARD
+# -----------------
+async def get_food_costs(db: AsyncSession):
+    return await db.run_sync(food_cost.get_food_costs)
+
+async def get_food_costs_as_of(db: AsyncSession, as_of: datetime):
+    return await db.run_sync(cost_history.food_costs_as_of, as_of)
+
+async def get_product_margins(
+    db: AsyncSession,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+):
+    return await db.run_sync(food_cost.get_product_margins, date_from, date_to)
+
+async def get_product_margins_at_sale(
+    db: AsyncSession,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+):
+    return await db.run_sync(cost_history.get_product_margins, date_from, date_to)
+
+async def get_rider_performance(
+    db: AsyncSession,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None
+):
+    return await db.run_sync(crud.get_rider_performance, date_from, date_to)
+
+async def get_sales_timeseries(
+    db: AsyncSession,
+    granularity: str = "day",
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    product_id: Optional[int] = None,
+    rider_id: Optional[int] = None,
+    cost_basis: str = "sale"
+):
+    return await db.run_sync(
+        rollups.get_sales_timeseries, granularity, date_from, date_to, product_id, rider_id, cost_basis
+    )
+
+async def get_consumption_variance(
+    db: AsyncSession,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None
+):
+    return await db.run_sync(variance.get_consumption_variance, date_from, date_to)
+
+async def get_stock(db: AsyncSession, as_of: Optional[datetime] = None, ingredient_id: Optional[int] = None):
+    return await db.run_sync(stock.get_stock, as_of, ingredient_id)
@@ -1,11 +1,91 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-DATABASE_URL = "sqlite:///./foodcost.db"
+from .core import config
 
-engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
-)
+DATABASE_URL = config.DATABASE_URL
+
+
+def _sqlite_pragmas(read_only: bool):
+    pragmas = [
+        f"journal_mode={config.SQLITE_JOURNAL_MODE}",
+        f"synchronous={config.SQLITE_SYNCHRONOUS}",
+        f"cache_size={config.SQLITE_CACHE_SIZE}",
+        f"mmap_size={config.SQLITE_MMAP_SIZE}",
+        f"busy_timeout={config.SQLITE_BUSY_TIMEOUT}",
+        f"temp_store={config.SQLITE_TEMP_STORE}",
+    ]
+    if read_only:
+        pragmas.append("query_only=ON")
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(f"PRAGMA {pragma}")
+        cursor.close()
+    return on_connect
+
+
+def _pool_kwargs(url) -> dict:
+    is_sqlite = url.get_backend_name() == "sqlite"
+    # i database SQLite in memoria usano un pool dedicato, senza parametri di dimensione
+    if is_sqlite and url.database in (None, "", ":memory:"):
+        return {}
+    return dict(
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_recycle=config.DB_POOL_RECYCLE,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_pre_ping=not is_sqlite,
+    )
+
+
+def make_engine(url: str, read_only: bool = False):
+    """Engine configurato da settings: pool e, per SQLite, PRAGMA applicati a ogni connessione."""
+    url = make_url(url)
+    kwargs = _pool_kwargs(url)
+    is_sqlite = url.get_backend_name() == "sqlite"
+    if is_sqlite:
+        kwargs["connect_args"] = {"check_same_thread": False}
+    engine = create_engine(url, **kwargs)
+    if is_sqlite:
+        event.listen(engine, "connect", _sqlite_pragmas(read_only))
+    return engine
+
+
+def make_async_engine(url: str, read_only: bool = False):
+    """Come make_engine, ma async: per SQLite usa il driver aiosqlite sullo stesso file."""
+    url = make_url(url)
+    is_sqlite = url.get_backend_name() == "sqlite"
+    if is_sqlite:
+        url = url.set(drivername="sqlite+aiosqlite")
+    engine = create_async_engine(url, **_pool_kwargs(url))
+    if is_sqlite:
+        event.listen(engine.sync_engine, "connect", _sqlite_pragmas(read_only))
+    return engine
+
+
+engine = make_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Engine opzionale in sola lettura per dashboard/KPI (default: lo stesso delle scritture)
+if config.DATABASE_READ_URL:
+    read_engine = make_engine(config.DATABASE_READ_URL, read_only=True)
+    ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+else:
+    read_engine = engine
+    ReadSessionLocal = SessionLocal
+
+# Engine async (aiosqlite) per gli endpoint async: import CSV e dashboard
+async_engine = make_async_engine(DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+if config.DATABASE_READ_URL:
+    async_read_engine = make_async_engine(config.DATABASE_READ_URL, read_only=True)
+    AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
+else:
+    async_read_engine = async_engine
+    AsyncReadSessionLocal = AsyncSessionLocal
+
 Base = declarative_base()
@@ -0,0 +1,129 @@
+"""
+Export in streaming di ordini e movimenti di magazzino, in CSV o NDJSON.
+
+Le righe sono lette come semplici tuple di colonne con yield_per (niente
+oggetti ORM né modelli Pydantic) e scritte a blocchi nella risposta, con
+gzip opzionale: la memoria usata resta costante anche su milioni di righe.
+
+Il generatore apre una propria sessione e la chiude a fine stream, perché la
+risposta viene consumata dopo l'uscita dall'handler.
+"""
+
+import csv
+import enum
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import Callable, Iterator, Sequence
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Query, Session
+
+from . import models
+
+BATCH_SIZE = 1000
+
+ORDER_COLUMNS = ("id", "timestamp", "product_id", "quantity", "rider_id", "price")
+INVENTORY_COLUMNS = ("id", "ingredient_id", "quantity", "movement_type", "timestamp")
+
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def _value(v):
+    if isinstance(v, datetime):
+        return v.isoformat()
+    if isinstance(v, enum.Enum):
+        return v.value
+    return v
+
+
+def _encode_csv(columns: Sequence[str], batches: Iterator[list]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows([_value(v) for v in row] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _encode_ndjson(columns: Sequence[str], batches: Iterator[list]) -> Iterator[str]:
+    for rows in batches:
+        yield "".join(
+            json.dumps(dict(zip(columns, (_value(v) for v in row)))) + "\n" for row in rows
+        )
+
+
+def _gzip(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)  # 31 = formato gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_rows(
+    session_factory: Callable[[], Session],
+    build_query: Callable[[Session], Query],
+    model,
+    columns: Sequence[str],
+    fmt: str,
+    gzip: bool = False,
+) -> Iterator[bytes]:
+    db = session_factory()
+    try:
+        query = (
+            build_query(db)
+            .with_entities(*(getattr(model, c) for c in columns))
+            .order_by(model.timestamp, model.id)
+            .execution_options(yield_per=BATCH_SIZE)
+        )
+        batches = _batches(query)
+        encode = _encode_csv if fmt == "csv" else _encode_ndjson
+        chunks = (text.encode("utf-8") for text in encode(columns, batches))
+        yield from _gzip(chunks) if gzip else chunks
+    finally:
+        db.close()
+
+
+def _batches(query: Query) -> Iterator[list]:
+    batch = []
+    for row in query:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def export_response(
+    name: str,
+    session_factory: Callable[[], Session],
+    build_query: Callable[[Session], Query],
+    model,
+    columns: Sequence[str],
+    fmt: str = "csv",
+    gzip: bool = False,
+) -> StreamingResponse:
+    filename = f"{name}.{fmt}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        stream_rows(session_factory, build_query, model, columns, fmt, gzip),
+        media_type="application/gzip" if gzip else MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def export_orders(session_factory, build_query, fmt="csv", gzip=False) -> StreamingResponse:
+    return export_response("orders", session_factory, build_query, models.Order, ORDER_COLUMNS, fmt, gzip)
+
+
+def export_inventory(session_factory, build_query, fmt="csv", gzip=False) -> StreamingResponse:
+    return export_response(
+        "inventory_movements", session_factory, build_query, models.InventoryMovement, INVENTORY_COLUMNS, fmt, gzip
+    )
@@ -0,0 +1,290 @@
+"""
+Food cost materializzato per prodotto.
+
+La tabella product_food_cost contiene, per ogni prodotto con almeno una riga
+ricetta, il costo di una unità: la somma di quantità x costo unitario degli
+ingredienti più quantità x food cost dei semilavorati (righe ricetta con
+component_product_id: impasti, salse, fondi usati da più piatti). Viene
+aggiornata in modo incrementale dalle funzioni di scrittura in crud (ricette e
+ingredienti), così gli endpoint dashboard fanno una semplice lettura indicizzata.
+
+Le ricette formano un DAG prodotto -> componenti (i cicli sono rifiutati alla
+scrittura, vedi check_component). Quando cambia un ingrediente o una ricetta
+si ricalcolano solo i prodotti toccati e i loro antenati (una CTE ricorsiva
+sull'indice inverso componente -> prodotti), in ordine topologico dai
+componenti verso i piatti: ogni nodo è calcolato una volta sola e i
+componenti fuori dall'insieme ricalcolato sono letti dalla tabella.
+
+Le funzioni di aggiornamento non fanno commit: lavorano nella transazione di
+chi le chiama.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from . import cost_history, models
+from .utils import chunks
+
+
+def _cost_query(db: Session):
+    """Costo delle sole righe ingrediente: (product_id, costo) per prodotto con almeno una riga ricetta."""
+    line_cost = models.Recipe.quantity * func.coalesce(models.Ingredient.unit_cost, 0)
+    return (
+        db.query(models.Recipe.product_id, func.coalesce(func.sum(line_cost), 0.0))
+        .outerjoin(models.Ingredient, models.Ingredient.id == models.Recipe.ingredient_id)
+        .filter(models.Recipe.product_id.isnot(None))
+        .group_by(models.Recipe.product_id)
+    )
+
+
+# -----------------
+# DAG DEI SEMILAVORATI
+# -----------------
+def component_edges(db: Session, product_ids: Optional[Iterable[int]] = None) -> List[Tuple[int, int, float]]:
+    """Righe (product_id, component_product_id, quantity) delle ricette con semilavorati."""
+    r = models.Recipe
+    query = select(r.product_id, r.component_product_id, func.coalesce(r.quantity, 0.0)).where(
+        r.product_id.isnot(None), r.component_product_id.isnot(None)
+    )
+    if product_ids is None:
+        return [tuple(row) for row in db.execute(query)]
+    edges = []
+    for chunk in chunks(set(product_ids)):
+        edges.extend(tuple(row) for row in db.execute(query.where(r.product_id.in_(chunk))))
+    return edges
+
+
+def ancestors(db: Session, product_ids: Iterable[int]) -> set:
+    """Prodotti che usano, direttamente o tramite altri semilavorati, uno dei prodotti indicati."""
+    r = models.Recipe
+    found = set()
+    for chunk in chunks(set(product_ids)):
+        anc = (
+            select(r.product_id.label("product_id"))
+            .where(r.component_product_id.in_(chunk))
+            .cte("ancestors", recursive=True)
+        )
+        # UNION (non UNION ALL): termina anche se nel database ci fosse un ciclo
+        anc = anc.union(
+            select(r.product_id).join(anc, r.component_product_id == anc.c.product_id)
+        )
+        found.update(pid for pid in db.execute(select(anc.c.product_id)).scalars() if pid is not None)
+    return found
+
+
+def topological_order(nodes: Iterable[int], edges: Iterable[Tuple[int, int]]) -> List[int]:
+    """
+    Nodi ordinati con ogni componente prima dei prodotti che lo usano
+    (edges: coppie (prodotto, componente)). ValueError se c'è un ciclo.
+    """
+    nodes = set(nodes)
+    pending = {n: 0 for n in nodes}  # componenti non ancora ordinati, per prodotto
+    users = defaultdict(list)
+    for product, component in set(edges):
+        if product in nodes and component in nodes:
+            pending[product] += 1
+            users[component].append(product)
+    ready = sorted(n for n, count in pending.items() if count == 0)
+    order = []
+    while ready:
+        node = ready.pop()
+        order.append(node)
+        for product in users[node]:
+            pending[product] -= 1
+            if pending[product] == 0:
+                ready.append(product)
+    if len(order) != len(nodes):
+        raise ValueError(f"ciclo tra i semilavorati dei prodotti {sorted(n for n, c in pending.items() if c)}")
+    return order
+
+
+def component_graph(db: Session) -> Dict[int, Set[int]]:
+    """Grafo prodotto -> semilavorati usati, dalle ricette."""
+    graph: Dict[int, Set[int]] = defaultdict(set)
+    for product, component, _ in component_edges(db):
+        graph[product].add(component)
+    return graph
+
+
+def check_component(graph: Dict[int, Set[int]], product_id: int, component_product_id: int) -> None:
+    """
+    ValueError se la riga product_id -> component_product_id chiuderebbe un ciclo
+    nel grafo (component_graph), cioè se il componente usa già, anche
+    indirettamente, il prodotto.
+    """
+    if product_id == component_product_id:
+        raise ValueError(f"il prodotto {product_id} non può essere componente di sé stesso")
+    # visita dei componenti a partire dal nuovo componente: se si arriva al prodotto c'è un ciclo
+    stack, seen = [component_product_id], set()
+    while stack:
+        node = stack.pop()
+        if node == product_id:
+            raise ValueError(
+                f"ciclo: il prodotto {component_product_id} usa già il prodotto {product_id} "
+                "come semilavorato"
+            )
+        if node not in seen:
+            seen.add(node)
+            stack.extend(graph[node])
+
+
+def _stored_costs(db: Session, product_ids: Iterable[int]) -> Dict[int, float]:
+    costs = {}
+    for chunk in chunks(set(product_ids)):
+        costs.update(
+            db.query(models.ProductFoodCost.product_id, models.ProductFoodCost.food_cost)
+            .filter(models.ProductFoodCost.product_id.in_(chunk))
+        )
+    return costs
+
+
+def compute_costs(db: Session, product_ids: Optional[Iterable[int]] = None) -> Dict[int, float]:
+    """
+    Food cost unitario dei prodotti indicati (default: tutti quelli con ricetta)
+    che hanno almeno una riga ricetta. I semilavorati fuori dall'insieme sono
+    letti da product_food_cost; quelli nell'insieme sono calcolati prima dei
+    prodotti che li usano e riusati (memoizzati) da tutti.
+    """
+    if product_ids is None:
+        direct = dict(_cost_query(db))
+        edges = component_edges(db)
+        nodes = set(direct) | {p for p, _, _ in edges}
+    else:
+        nodes = set(product_ids)
+        direct = {}
+        for chunk in chunks(nodes):
+            direct.update(_cost_query(db).filter(models.Recipe.product_id.in_(chunk)))
+        edges = component_edges(db, nodes)
+    components = defaultdict(list)
+    for product, component, quantity in edges:
+        components[product].append((component, quantity))
+    outside = _stored_costs(db, {c for _, c, _ in edges if c not in nodes})
+
+    costs: Dict[int, float] = {}
+    for pid in topological_order(nodes, ((p, c) for p, c, _ in edges)):
+        if pid not in direct and pid not in components:
+            continue  # nessuna riga ricetta: niente food cost
+        total = direct.get(pid, 0.0)
+        for component, quantity in components[pid]:
+            unit = costs.get(component) if component in nodes else outside.get(component)
+            total += quantity * (unit or 0.0)
+        costs[pid] = total
+    return costs
+
+
+def products_using_ingredients(db: Session, ingredient_ids: Iterable[int]) -> set:
+    """Prodotti che usano almeno uno degli ingredienti (indice ix_recipes_ingredient_product)."""
+    products = set()
+    for chunk in chunks(ingredient_ids):
+        products.update(
+            pid for (pid,) in db.query(models.Recipe.product_id)
+            .filter(models.Recipe.ingredient_id.in_(chunk))
+            .distinct()
+            if pid is not None
+        )
+    return products
+
+
+def recompute_products(db: Session, product_ids: Iterable[int]) -> None:
+    """Ricalcola e salva il food cost dei prodotti indicati e dei prodotti che li usano come semilavorati."""
+    db.flush()
+    product_ids = {pid for pid in product_ids if pid is not None}
+    if not product_ids:
+        return
+    affected = product_ids | ancestors(db, product_ids)
+    costs = compute_costs(db, affected)
+    missing = affected - costs.keys()
+    for chunk in chunks(missing):
+        db.query(models.ProductFoodCost).filter(
+            models.ProductFoodCost.product_id.in_(chunk)
+        ).delete(synchronize_session=False)
+    if costs:
+        stmt = sqlite_insert(models.ProductFoodCost.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[models.ProductFoodCost.product_id],
+            set_={"food_cost": stmt.excluded.food_cost},
+        )
+        db.execute(stmt, [{"product_id": pid, "food_cost": fc} for pid, fc in costs.items()])
+
+
+def on_ingredients_changed(db: Session, ingredient_ids: Iterable[int]) -> None:
+    """Da chiamare dopo creazione, modifica costo o eliminazione di ingredienti."""
+    ingredient_ids = set(ingredient_ids)
+    cost_history.record_costs(db, ingredient_ids)
+    recompute_products(db, products_using_ingredients(db, ingredient_ids))
+
+
+def rebuild(db: Session) -> int:
+    """Ricostruisce da zero l'intera tabella (non fa commit). Restituisce il numero di prodotti."""
+    db.query(models.ProductFoodCost).delete(synchronize_session=False)
+    costs = compute_costs(db)
+    if costs:
+        db.execute(
+            models.ProductFoodCost.__table__.insert(),
+            [{"product_id": pid, "food_cost": fc} for pid, fc in costs.items()],
+        )
+    return len(costs)
+
+
+def ensure_built(db: Session) -> None:
+    """Popola la tabella al primo avvio su un database che ha già ricette."""
+    if db.query(models.ProductFoodCost).first() is None and db.query(models.Recipe).first() is not None:
+        rebuild(db)
+        db.commit()
+
+
+def check_consistency(db: Session, tolerance: float = 1e-6) -> List[dict]:
+    """Confronta la tabella con un ricalcolo da zero; restituisce le differenze trovate."""
+    expected = compute_costs(db)
+    stored = dict(db.query(models.ProductFoodCost.product_id, models.ProductFoodCost.food_cost))
+    mismatches = []
+    for pid in sorted(expected.keys() | stored.keys()):
+        exp, got = expected.get(pid), stored.get(pid)
+        if exp is None or got is None or abs(exp - got) > tolerance:
+            mismatches.append({"product_id": pid, "stored": got, "expected": exp})
+    return mismatches
+
+
+# -----------------
+# LETTURE DASHBOARD
+# -----------------
+def get_food_costs(db: Session):
+    return (
+        db.query(models.ProductFoodCost.product_id, models.ProductFoodCost.food_cost)
+        .order_by(models.ProductFoodCost.product_id)
+        .all()
+    )
+
+
+def get_product_margins(
+    db: Session,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    product_ids: Optional[Iterable[int]] = None,
+):
+    """
+    Righe (product_id, total_price, total_qty, food_cost) per ogni prodotto
+    venduto in [date_from, date_to) (o solo per product_ids), con il food cost
+    attuale (per il costo al momento della vendita vedi cost_history.get_product_margins).
+    """
+    query = (
+        db.query(
+            models.Order.product_id,
+            func.sum(models.Order.price).label("total_price"),
+            func.sum(models.Order.quantity).label("total_qty"),
+            func.coalesce(models.ProductFoodCost.food_cost, 0.0).label("food_cost"),
+        )
+        .outerjoin(models.ProductFoodCost, models.ProductFoodCost.product_id == models.Order.product_id)
+    )
+    if date_from is not None:
+        query = query.filter(models.Order.timestamp >= date_from)
+    if date_to is not None:
+        query = query.filter(models.Order.timestamp < date_to)
+    if product_ids is not None:
+        query = query.filter(models.Order.product_id.in_(sorted(set(product_ids))))
+    return query.group_by(models.Order.product_id, models.ProductFoodCost.food_cost).all()
@@ -0,0 +1,154 @@
+"""
+Import CSV in streaming.
+
+L'upload viene letto in modo incrementale (riga per riga), le righe sono
+validate a blocchi con gli stessi schemi Pydantic degli endpoint singoli e
+ogni blocco viene inserito con una INSERT bulk. Le righe non valide non
+interrompono l'import: vengono scartate e riportate con il numero di riga.
+"""
+
+import csv
+import time
+from typing import BinaryIO, Callable, Iterator, List, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import crud, schemas
+from .utils import csv_rows
+
+DEFAULT_CHUNK_SIZE = 1000
+# Oltre questa soglia gli errori vengono solo contati, non riportati
+MAX_REPORTED_ERRORS = 1000
+
+
+def _iter_chunks(
+    reader: csv.DictReader,
+    parse: Callable[[dict], object],
+    chunk_size: int,
+) -> Iterator[Tuple[List[object], List[dict]]]:
+    """Restituisce blocchi (righe valide, errori) di al più chunk_size righe lette."""
+    valid, errors = [], []
+    for row in reader:
+        try:
+            valid.append(parse(row))
+        except KeyError as exc:
+            errors.append({"line": reader.line_num, "error": f"colonna mancante: {exc.args[0]}"})
+        except (TypeError, ValueError) as exc:
+            errors.append({"line": reader.line_num, "error": str(exc)})
+        if len(valid) + len(errors) >= chunk_size:
+            yield valid, errors
+            valid, errors = [], []
+    if valid or errors:
+        yield valid, errors
+
+
+# -----------------
+# ORDINI
+# -----------------
+def parse_order_row(row: dict) -> schemas.OrderCreate:
+    """Stessa conversione di /orders/import-csv/: product_id, quantity, price, rider_id, timestamp."""
+    return schemas.OrderCreate(
+        product_id=int(row['product_id']),
+        quantity=int(row['quantity']),
+        price=float(row['price']),
+        rider_id=int(row['rider_id']) if row.get('rider_id') else None,
+        timestamp=row.get('timestamp') or None
+    )
+
+
+def import_orders(
+    db: Session,
+    fileobj: BinaryIO,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    commit_every: int = 0,
+) -> dict:
+    """
+    Importa ordini da CSV a blocchi.
+
+    Con commit_every=0 l'intero file è importato in un'unica transazione;
+    altrimenti si fa commit ogni volta che sono state inserite almeno
+    commit_every righe (le righe già committate restano anche in caso di errore).
+    """
+    started = time.perf_counter()
+    reader = csv_rows(fileobj)
+    summary = {"total_rows": 0, "inserted": 0, "rejected": 0, "errors": []}
+    uncommitted = 0
+    try:
+        for orders, errors in _iter_chunks(reader, parse_order_row, chunk_size):
+            summary["total_rows"] += len(orders) + len(errors)
+            summary["rejected"] += len(errors)
+            room = MAX_REPORTED_ERRORS - len(summary["errors"])
+            summary["errors"].extend(errors[:max(room, 0)])
+
+            inserted = crud.bulk_create_orders(db, orders, commit=False)
+            summary["inserted"] += inserted
+            uncommitted += inserted
+            if commit_every and uncommitted >= commit_every:
+                db.commit()
+                uncommitted = 0
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    summary["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+# -----------------
+# COSTI INGREDIENTI
+# -----------------
+def import_ingredient_costs(db: Session, fileobj: BinaryIO) -> dict:
+    """
+    Upsert dei costi ingredienti da CSV (id opzionale, name, unit_cost).
+
+    Gli ingredienti esistenti sono indicizzati una sola volta per id e per nome;
+    insiemi di insert e update sono calcolati in memoria (a parità di riga vince
+    l'ultima del file) e applicati in blocco in un'unica transazione.
+    """
+    started = time.perf_counter()
+    reader = csv_rows(fileobj)
+    by_id, by_name = crud.get_ingredient_cost_index(db)
+    summary = {"total_rows": 0, "rejected": 0, "errors": []}
+    updates, inserts = {}, {}
+
+    def reject(message):
+        summary["rejected"] += 1
+        if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+            summary["errors"].append({"line": reader.line_num, "error": message})
+
+    for row in reader:
+        summary["total_rows"] += 1
+        try:
+            cost = float(row['unit_cost'])
+            ing_id = int(row['id']) if row.get('id') else None
+            if ing_id not in by_id:
+                ing_id = by_name.get(row['name'])
+            name = by_id[ing_id][0] if ing_id is not None else row['name']
+            ing_in = schemas.IngredientCreate(name=name, unit_cost=cost)
+        except KeyError as exc:
+            reject(f"colonna mancante: {exc.args[0]}")
+            continue
+        except (TypeError, ValueError) as exc:
+            reject(str(exc))
+            continue
+        if ing_id is not None:
+            updates[ing_id] = ing_in.unit_cost
+        elif ing_in.name:
+            inserts[ing_in.name] = ing_in.unit_cost
+        else:
+            reject("nome ingrediente vuoto")
+
+    changed = {i: cost for i, cost in updates.items() if by_id[i][1] != cost}
+    try:
+        crud.bulk_upsert_ingredient_costs(db, changed, inserts, commit=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    summary.update(
+        inserted=len(inserts),
+        updated=len(changed),
+        unchanged=len(updates) - len(changed),
+        elapsed_seconds=round(time.perf_counter() - started, 3),
+    )
+    return summary
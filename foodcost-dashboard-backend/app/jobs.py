@@ -0,0 +1,489 @@
+"""
+Import CSV in background (endpoint /jobs).
+
+Gli endpoint /<entità>/import-csv/ importano l'intero file dentro la
+richiesta: con file grandi scadono i timeout del proxy e una connessione
+caduta lascia l'import a metà senza traccia. Qui l'upload viene salvato in
+IMPORT_JOB_DIR/<tenant>/ e registrato come job nella tabella import_jobs del
+database del tenant; la richiesta risponde subito con l'id del job.
+
+La tabella è la coda: IMPORT_JOB_WORKERS thread dedicati prendono i job in
+stato "queued" (o "running" senza checkpoint da IMPORT_JOB_STALE_SECONDS,
+cioè interrotti da un riavvio o da un worker morto) con un UPDATE
+condizionato, quindi anche con più processi un job è eseguito da un solo
+worker. Il numero fisso di worker limita gli import concorrenti: non
+occupano i thread delle richieste e ogni transazione dura un solo blocco.
+
+Il file è importato a blocchi di IMPORT_JOB_CHUNK_SIZE righe, con la stessa
+validazione di /<entità>/bulk in best_effort (i costi ingrediente con
+l'upsert di /ingredients/import-costs-csv/upsert/). Ogni blocco è committato
+insieme al checkpoint del job (righe elaborate, conteggi, errori): un job
+ripreso salta le righe già elaborate, senza duplicarle né perderle. Il
+checkpoint è condizionato al tentativo che ha preso il job, così un worker
+che ha perso il job non scrive più nulla.
+
+La cancellazione di un job in coda è immediata; per un job in esecuzione
+viene controllata prima di ogni blocco: le righe dei blocchi già committati
+restano, come con commit_every negli import in streaming.
+"""
+
+import itertools
+import os
+import queue
+import shutil
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import BinaryIO, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import bulk, crud, importers, models, schemas, tenancy
+from .core import config
+from .utils import chunks, csv_rows, format_validation_error
+
+Job = models.ImportJob
+Status = models.JobStatus
+
+TERMINAL = (Status.SUCCEEDED, Status.FAILED, Status.CANCELLED)
+
+
+class JobKind(NamedTuple):
+    # riga CSV -> valori (KeyError/TypeError/ValueError = riga scartata)
+    parse: Callable[[dict], dict]
+    # blocco di valori -> (inseriti, aggiornati, [{index, error}]), senza commit
+    write: Callable[[Session, List[dict]], Tuple[int, int, List[dict]]]
+
+
+# -----------------
+# TIPI DI IMPORT
+# -----------------
+def _optional_int(value) -> Optional[int]:
+    return int(value) if value else None
+
+
+def _parse_order(row: dict) -> dict:
+    return {
+        "product_id": int(row["product_id"]),
+        "quantity": int(row["quantity"]),
+        "price": float(row["price"]),
+        "rider_id": _optional_int(row.get("rider_id")),
+        "timestamp": row.get("timestamp") or None,
+    }
+
+
+def _parse_recipe(row: dict) -> dict:
+    return {
+        "product_id": int(row["product_id"]),
+        "ingredient_id": _optional_int(row.get("ingredient_id")),
+        "component_product_id": _optional_int(row.get("component_product_id")),
+        "quantity": float(row["quantity"]),
+    }
+
+
+def _parse_movement(row: dict) -> dict:
+    return {
+        "ingredient_id": int(row["ingredient_id"]),
+        "quantity": float(row["quantity"]),
+        "movement_type": row["movement_type"],
+        "timestamp": row.get("timestamp") or None,
+    }
+
+
+def _parse_rider(row: dict) -> dict:
+    delivery_time = row.get("delivery_time")
+    return {"name": row["name"], "delivery_time": float(delivery_time) if delivery_time else None}
+
+
+def _parse_ingredient_cost(row: dict) -> dict:
+    return {"id": _optional_int(row.get("id")), "name": row["name"], "unit_cost": float(row["unit_cost"])}
+
+
+def _bulk_writer(entity: str):
+    def write(db: Session, items: List[dict]):
+        result = bulk.create_many(db, entity, items, bulk.BEST_EFFORT, commit=False)
+        return result["inserted"], 0, result["errors"]
+    return write
+
+
+def _write_ingredient_costs(db: Session, items: List[dict]):
+    """Upsert dei costi del blocco: come importers.import_ingredient_costs, con l'indice dei soli nomi/id del blocco."""
+    ing = models.Ingredient
+    by_id, by_name = {}, {}
+    ids = sorted({i["id"] for i in items if i["id"] is not None})
+    names = sorted({i["name"] for i in items})
+    for column, values in ((ing.id, ids), (ing.name, names)):
+        for chunk in chunks(values):
+            for ing_id, name, unit_cost in db.execute(select(ing.id, ing.name, ing.unit_cost).where(column.in_(chunk))):
+                by_id[ing_id] = (name, unit_cost)
+                by_name[name] = ing_id
+
+    updates, inserts, errors = {}, {}, []
+    for index, item in enumerate(items):
+        ing_id = item["id"] if item["id"] in by_id else by_name.get(item["name"])
+        name = by_id[ing_id][0] if ing_id is not None else item["name"]
+        try:
+            ing_in = schemas.IngredientCreate(name=name, unit_cost=item["unit_cost"])
+        except ValidationError as exc:
+            errors.append({"index": index, "error": format_validation_error(exc)})
+            continue
+        if ing_id is not None:
+            updates[ing_id] = ing_in.unit_cost
+        elif ing_in.name:
+            inserts[ing_in.name] = ing_in.unit_cost
+        else:
+            errors.append({"index": index, "error": "nome ingrediente vuoto"})
+
+    changed = {i: cost for i, cost in updates.items() if by_id[i][1] != cost}
+    crud.bulk_upsert_ingredient_costs(db, changed, inserts, commit=False)
+    return len(inserts), len(changed), errors
+
+
+KINDS: Dict[str, JobKind] = {
+    "orders": JobKind(_parse_order, _bulk_writer("orders")),
+    "ingredient-costs": JobKind(_parse_ingredient_cost, _write_ingredient_costs),
+    "products": JobKind(lambda row: {"name": row["name"]}, _bulk_writer("products")),
+    "recipes": JobKind(_parse_recipe, _bulk_writer("recipes")),
+    "inventory": JobKind(_parse_movement, _bulk_writer("inventory")),
+    "riders": JobKind(_parse_rider, _bulk_writer("riders")),
+}
+
+
+# -----------------
+# CODA
+# -----------------
+def _job_dir(tenant: str) -> str:
+    return os.path.join(config.IMPORT_JOB_DIR, tenancy.validate_tenant(tenant))
+
+
+def _remove_file(tenant: str, job) -> None:
+    try:
+        os.remove(os.path.join(_job_dir(tenant), job.path))
+    except FileNotFoundError:
+        pass
+
+
+def submit(shard: tenancy.Shard, kind: str, fileobj: BinaryIO, filename: Optional[str] = None):
+    """Salva l'upload, registra il job in coda e lo passa ai worker (I/O bloccante)."""
+    if kind not in KINDS:
+        raise ValueError(f"tipo di import non valido: {kind}; ammessi {list(KINDS)}")
+    directory = _job_dir(shard.tenant)
+    os.makedirs(directory, exist_ok=True)
+    name = f"{uuid.uuid4().hex}.csv"
+    with open(os.path.join(directory, name), "wb") as out:
+        shutil.copyfileobj(fileobj, out, 1024 * 1024)
+        size = out.tell()
+    with shard.session() as db:
+        job = Job(kind=kind, status=Status.QUEUED, filename=filename, path=name, total_bytes=size, errors=[])
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+    runner.enqueue(shard.tenant, job.id)
+    return job
+
+
+def get_job(db: Session, job_id: int):
+    return db.get(Job, job_id)
+
+
+def list_jobs(db: Session, status: Optional[Status] = None, limit: int = 50):
+    query = select(Job).order_by(Job.id.desc()).limit(limit)
+    if status is not None:
+        query = query.where(Job.status == status)
+    return db.execute(query).scalars().all()
+
+
+def cancel(db: Session, tenant: str, job_id: int):
+    """
+    Annulla un job: se è in coda subito, se è in esecuzione al prossimo blocco.
+    Restituisce il job (None se non esiste); ValueError se è già terminato.
+    """
+    job = db.get(Job, job_id)
+    if job is None:
+        return None
+    if job.status in TERMINAL:
+        raise ValueError(f"job {job_id} già terminato ({job.status.value})")
+    now = datetime.utcnow()
+    cancelled = db.execute(
+        update(Job).where(Job.id == job_id, Job.status == Status.QUEUED)
+        .values(status=Status.CANCELLED, cancel_requested=True, finished_at=now)
+    ).rowcount
+    if not cancelled:
+        db.execute(update(Job).where(Job.id == job_id).values(cancel_requested=True))
+    db.commit()
+    db.refresh(job)
+    if cancelled:
+        _remove_file(tenant, job)
+    return job
+
+
+def describe(job) -> dict:
+    """Il job con avanzamento e tempi calcolati (schemas.ImportJob)."""
+    data = {c.name: getattr(job, c.name) for c in Job.__table__.columns}
+    if job.status == Status.SUCCEEDED:
+        data["progress"] = 1.0
+    else:
+        data["progress"] = round(min(job.bytes_done / job.total_bytes, 1.0), 4) if job.total_bytes else 0.0
+    elapsed = None
+    if job.started_at is not None:
+        elapsed = ((job.finished_at or datetime.utcnow()) - job.started_at).total_seconds()
+    data["elapsed_seconds"] = round(elapsed, 3) if elapsed is not None else None
+    data["rows_per_second"] = round(job.rows_done / elapsed, 1) if elapsed else None
+    return data
+
+
+def _claimable():
+    stale = datetime.utcnow() - timedelta(seconds=config.IMPORT_JOB_STALE_SECONDS)
+    return or_(
+        Job.status == Status.QUEUED,
+        and_(Job.status == Status.RUNNING, or_(Job.heartbeat_at.is_(None), Job.heartbeat_at < stale)),
+    )
+
+
+def _claim(db: Session, job_id: int) -> Optional[int]:
+    """Prende il job se è libero; restituisce il numero del tentativo (None se l'ha preso un altro)."""
+    now = datetime.utcnow()
+    attempt = db.execute(
+        update(Job).where(Job.id == job_id, _claimable())
+        .values(
+            status=Status.RUNNING, attempts=Job.attempts + 1, heartbeat_at=now,
+            started_at=func.coalesce(Job.started_at, now),
+        )
+        .returning(Job.attempts)
+    ).scalar()
+    db.commit()
+    return attempt
+
+
+# -----------------
+# ESECUZIONE
+# -----------------
+class _CountingReader:
+    """File binario che conta i byte letti (avanzamento del job)."""
+
+    def __init__(self, raw: BinaryIO):
+        self.raw = raw
+        self.count = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.raw.read(size)
+        self.count += len(data)
+        return data
+
+
+class _Released(Exception):
+    """Il runner si sta fermando: il job torna in coda e riprende dal checkpoint."""
+
+
+class _LeaseLost(Exception):
+    """Il job è stato preso da un altro worker (checkpoint scaduto)."""
+
+
+def _chunks(reader, parse: Callable[[dict], dict], chunk_size: int):
+    """Blocchi (righe lette, [(riga, valori)], [{line, error}]) di al più chunk_size righe."""
+    items, errors, read = [], [], 0
+    for row in reader:
+        read += 1
+        try:
+            items.append((reader.line_num, parse(row)))
+        except KeyError as exc:
+            errors.append({"line": reader.line_num, "error": f"colonna mancante: {exc.args[0]}"})
+        except (TypeError, ValueError) as exc:
+            errors.append({"line": reader.line_num, "error": str(exc)})
+        if read >= chunk_size:
+            yield read, items, errors
+            items, errors, read = [], [], 0
+    if read:
+        yield read, items, errors
+
+
+def _finish(db: Session, tenant: str, job_id: int, attempt: int, status: Status, **values) -> None:
+    db.rollback()
+    finished = db.execute(
+        update(Job).where(Job.id == job_id, Job.attempts == attempt)
+        .values(status=status, heartbeat_at=None, **values)
+    ).rowcount
+    db.commit()
+    if finished and status in TERMINAL:
+        _remove_file(tenant, db.get(Job, job_id))
+
+
+def run(tenant: str, job_id: int, stopping: Optional[threading.Event] = None) -> Optional[Status]:
+    """Esegue (o riprende dal checkpoint) un job; restituisce lo stato finale, None se non preso."""
+    shard = tenancy.registry.get(tenant)
+    with shard.session() as db:
+        attempt = _claim(db, job_id)
+        if attempt is None:
+            return None
+        job = db.get(Job, job_id)
+        progress = {
+            "rows_done": job.rows_done, "inserted": job.inserted, "updated": job.updated,
+            "rejected": job.rejected, "errors": list(job.errors or []),
+        }
+        try:
+            kind = KINDS[job.kind]
+            with open(os.path.join(_job_dir(tenant), job.path), "rb") as raw:
+                counted = _CountingReader(raw)
+                reader = csv_rows(counted)
+                # ripresa: le righe fino al checkpoint sono già nel database
+                for _ in itertools.islice(reader, job.rows_done):
+                    pass
+                for read, items, errors in _chunks(reader, kind.parse, config.IMPORT_JOB_CHUNK_SIZE):
+                    if stopping is not None and stopping.is_set():
+                        raise _Released()
+                    if db.execute(select(Job.cancel_requested).where(Job.id == job_id)).scalar():
+                        _finish(db, tenant, job_id, attempt, Status.CANCELLED, finished_at=datetime.utcnow())
+                        return Status.CANCELLED
+                    inserted, updated, write_errors = 0, 0, []
+                    if items:
+                        inserted, updated, write_errors = kind.write(db, [values for _, values in items])
+                    errors.extend({"line": items[e["index"]][0], "error": e["error"]} for e in write_errors)
+                    errors.sort(key=lambda e: e["line"])
+                    room = importers.MAX_REPORTED_ERRORS - len(progress["errors"])
+                    progress["errors"].extend(errors[:max(room, 0)])
+                    progress["rows_done"] += read
+                    progress["inserted"] += inserted
+                    progress["updated"] += updated
+                    progress["rejected"] += len(errors)
+                    # checkpoint nella stessa transazione delle righe del blocco
+                    saved = db.execute(
+                        update(Job).where(Job.id == job_id, Job.attempts == attempt)
+                        .values(bytes_done=counted.count, heartbeat_at=datetime.utcnow(), **progress)
+                    ).rowcount
+                    if not saved:
+                        raise _LeaseLost()
+                    db.commit()
+            _finish(
+                db, tenant, job_id, attempt, Status.SUCCEEDED,
+                bytes_done=job.total_bytes, finished_at=datetime.utcnow(),
+            )
+            return Status.SUCCEEDED
+        except _Released:
+            _finish(db, tenant, job_id, attempt, Status.QUEUED)
+            return Status.QUEUED
+        except _LeaseLost:
+            db.rollback()
+            return None
+        except Exception as exc:
+            _finish(db, tenant, job_id, attempt, Status.FAILED, error=str(exc)[:1000], finished_at=datetime.utcnow())
+            return Status.FAILED
+
+
+class JobRunner:
+    """Pool di worker: coda in memoria per i job appena inviati, la tabella per quelli da riprendere."""
+
+    def __init__(self, workers: int, poll_seconds: float):
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self._queue: "queue.Queue[Optional[Tuple[str, int]]]" = queue.Queue()
+        self._queued: Set[Tuple[str, int]] = set()
+        self._running: Set[Tuple[str, int]] = set()
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self.finished: Dict[str, int] = {}
+
+    def start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            self._threads = [
+                threading.Thread(target=self._work, name=f"import-job-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+        for thread in self._threads:
+            thread.start()
+        # al primo giro i worker cercano i job rimasti in coda o interrotti
+        self._queue.put(("", 0))
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Ferma i worker: i job in esecuzione tornano in coda al prossimo blocco."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        self._stopping.set()
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout)
+
+    def enqueue(self, tenant: str, job_id: int) -> None:
+        with self._lock:
+            if (tenant, job_id) in self._queued:
+                return
+            self._queued.add((tenant, job_id))
+        self._queue.put((tenant, job_id))
+        self.start()
+
+    def scan(self) -> int:
+        """Accoda i job in coda o interrotti dei tenant con file in attesa; restituisce quanti."""
+        if not self._scan_lock.acquire(blocking=False):
+            return 0  # un altro worker sta già cercando
+        found = 0
+        try:
+            tenants = os.listdir(config.IMPORT_JOB_DIR) if os.path.isdir(config.IMPORT_JOB_DIR) else []
+            for tenant in tenants:
+                if not tenancy.TENANT_PATTERN.match(tenant) or not os.listdir(_job_dir(tenant)):
+                    continue
+                shard = tenancy.registry.get(tenant)
+                with shard.session() as db:
+                    ids = db.execute(select(Job.id).where(_claimable()).order_by(Job.id)).scalars().all()
+                for job_id in ids:
+                    if (tenant, job_id) not in self._running:
+                        self.enqueue(tenant, job_id)
+                        found += 1
+        finally:
+            self._scan_lock.release()
+        return found
+
+    def _work(self) -> None:
+        # ogni worker esce al proprio None: un worker fermo a metà job non lascia
+        # in coda un None che fermerebbe un worker del giro successivo
+        while True:
+            try:
+                item = self._queue.get(timeout=self.poll_seconds)
+            except queue.Empty:
+                item = ("", 0)
+            if item is None:
+                break
+            tenant, job_id = item
+            if self._stopping.is_set():
+                # il job resta "queued" nella tabella: lo riprende il prossimo avvio
+                with self._lock:
+                    self._queued.discard(item)
+                continue
+            if not tenant:
+                try:
+                    self.scan()
+                except Exception:
+                    pass  # database di un tenant non raggiungibile: si riprova al prossimo giro
+                continue
+            with self._lock:
+                self._queued.discard(item)
+                self._running.add(item)
+            try:
+                status = run(tenant, job_id, self._stopping)
+            except Exception:
+                status = None  # tenant non apribile: il job resta in coda per il prossimo giro
+            finally:
+                with self._lock:
+                    self._running.discard(item)
+            if status in TERMINAL:
+                with self._lock:
+                    self.finished[status.value] = self.finished.get(status.value, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "alive": sum(t.is_alive() for t in self._threads),
+                "queued": len(self._queued),
+                "running": [{"tenant": t, "job_id": j} for t, j in sorted(self._running)],
+                "finished": dict(self.finished),
+            }
+
+
+runner = JobRunner(config.IMPORT_JOB_WORKERS, config.IMPORT_JOB_POLL_SECONDS)
@@ -0,0 +1,60 @@
+"""
+Risposte JSON veloci per le liste grandi (ordini, movimenti, risultati degli import).
+
+Con response_model e orm_mode FastAPI costruisce un oggetto ORM per riga, lo
+valida con Pydantic e lo riserializza con il modulo json: su pagine da 10k
+righe è quasi tutto il tempo di CPU della richiesta. Qui le righe sono
+selezionate come tuple di colonne (come negli export) e serializzate con
+orjson direttamente in una Response, che FastAPI restituisce senza passare
+dal response_model (usato solo per la documentazione).
+
+Il JSON è lo stesso degli endpoint con response_model: campi nell'ordine
+dello schema, datetime ISO 8601, enum come valore. Con layout=columnar la
+lista diventa un oggetto colonna -> valori ({"id": [...], "price": [...]}),
+che i grafici usano direttamente ed è più compatto.
+"""
+
+from typing import List, Literal, Optional, Sequence, Tuple, Type
+
+import orjson
+from fastapi import Query
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+ROWS = "rows"
+COLUMNAR = "columnar"
+Layout = Literal["rows", "columnar"]
+
+LAYOUT_QUERY = Query(ROWS, description="rows: lista di oggetti; columnar: oggetto colonna -> lista di valori")
+
+
+def columns(schema: Type[BaseModel]) -> Tuple[str, ...]:
+    """Campi dello schema di risposta, nell'ordine in cui Pydantic li serializza."""
+    return tuple(schema.__fields__)
+
+
+def from_objects(objects: Sequence, names: Sequence[str]) -> List[tuple]:
+    """Tuple di colonne da oggetti ORM già caricati (es. quelli creati da un import)."""
+    return [tuple(getattr(obj, name) for name in names) for obj in objects]
+
+
+def shape(names: Sequence[str], rows: Sequence[tuple], layout: str = ROWS):
+    if layout == COLUMNAR:
+        if not rows:
+            return {name: [] for name in names}
+        return dict(zip(names, map(list, zip(*rows))))
+    return [dict(zip(names, row)) for row in rows]
+
+
+def response(
+    names: Sequence[str],
+    rows: Sequence[tuple],
+    layout: str = ROWS,
+    paged: bool = False,
+    next_cursor: Optional[str] = None,
+) -> Response:
+    """Response JSON delle righe; con paged=True nel formato {items, next_cursor} delle pagine keyset."""
+    data = shape(names, rows, layout)
+    if paged:
+        data = {"items": data, "next_cursor": next_cursor}
+    return Response(content=orjson.dumps(data), media_type="application/json")
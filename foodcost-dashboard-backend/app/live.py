@@ -0,0 +1,306 @@
+"""
+Aggiornamenti in tempo reale della dashboard (Server-Sent Events).
+
+Invece di interrogare di continuo gli endpoint KPI, il frontend apre
+/live/updates e riceve solo i delta: margine dei prodotti toccati, consegne
+dei rider coinvolti, giacenze cambiate e soglie di magazzino superate.
+
+Le modifiche sono raccolte come in response_cache, senza codice dedicato
+nelle funzioni di scrittura: after_flush legge gli oggetti ORM scritti,
+do_orm_execute i parametri degli INSERT/upsert (bulk, import, tabelle
+materializzate), e al commit gli id toccati (prodotti, rider, ingredienti)
+passano all'hub; un rollback li scarta. Se un tenant non ha connessioni
+aperte non si raccoglie niente, quindi senza client il costo è nullo.
+
+L'hub accumula gli id e un flusher pubblica al più un aggiornamento ogni
+LIVE_FLUSH_INTERVAL secondi per tenant: un import CSV da migliaia di righe
+diventa un solo messaggio con l'insieme dei prodotti toccati, calcolato
+con una query per tipo di dato (in un thread, fuori dall'event loop).
+
+Ogni connessione ha una coda di al massimo LIVE_QUEUE_SIZE messaggi: un
+client lento non rallenta gli altri né fa crescere la memoria; se la sua
+coda si riempie, i messaggi in attesa sono sostituiti da un solo evento
+"resync" e il client ricarica gli endpoint completi.
+
+Come response_cache l'hub è del singolo processo: con più worker ogni
+client riceve solo le scritture fatte dal worker a cui è connesso.
+"""
+
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set
+
+from anyio import to_thread
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from . import crud, food_cost, models, tenancy
+from .core import config
+
+TOPICS = ("products", "riders", "stock")
+
+# tabella -> (topic, colonna con l'id)
+_WATCHED = {
+    "orders": (("products", "product_id"), ("riders", "rider_id")),
+    "sales_rollup_daily": (("products", "product_id"), ("riders", "rider_id")),
+    "recipes": (("products", "product_id"),),
+    "product_food_cost": (("products", "product_id"),),
+    "inventory_movements": (("stock", "ingredient_id"),),
+    "ingredient_stock": (("stock", "ingredient_id"),),
+}
+
+
+class Subscriber:
+    """Una connessione SSE: topic richiesti, soglia di magazzino e coda limitata."""
+
+    def __init__(self, tenant: str, topics: Iterable[str], stock_threshold: Optional[float], queue_size: int):
+        self.tenant = tenant
+        self.topics = set(topics)
+        self.stock_threshold = stock_threshold
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.below: Set[int] = set()  # ingredienti sotto soglia già segnalati
+        self.resyncs = 0
+
+    def offer(self, name: str, data: dict) -> None:
+        """Accoda senza attendere; a coda piena la svuota e chiede un resync."""
+        try:
+            self.queue.put_nowait((name, data))
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(("resync", {}))
+            self.resyncs += 1
+
+    def message(self, update: dict) -> Optional[dict]:
+        """La parte di update che interessa alla connessione, con le soglie superate."""
+        data = {key: rows for key, rows in update.items() if key in self.topics and rows}
+        if "products" in self.topics and update.get("food_costs"):
+            data["food_costs"] = update["food_costs"]
+        if self.stock_threshold is not None and update.get("stock"):
+            alerts = []
+            for row in update["stock"]:
+                below = row["quantity"] < self.stock_threshold
+                if below != (row["ingredient_id"] in self.below):
+                    (self.below.add if below else self.below.discard)(row["ingredient_id"])
+                    alerts.append(dict(row, threshold=self.stock_threshold, below=below))
+            if alerts:
+                data["stock_alerts"] = alerts
+        return data or None
+
+
+class LiveHub:
+    def __init__(self, interval: float, queue_size: int):
+        self.interval = interval
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Dict[str, Set[int]]] = {}
+        self._subscribers: Dict[str, Set[Subscriber]] = defaultdict(set)
+        self._flusher: Optional[asyncio.Task] = None
+        self.published = 0
+        self.errors = 0
+
+    def listening(self, tenant: str) -> bool:
+        return bool(self._subscribers.get(tenant))
+
+    def mark(self, tenant: str, changes: Dict[str, Set[int]]) -> None:
+        """Aggiunge id modificati (chiamato al commit, da qualsiasi thread)."""
+        with self._lock:
+            if not self._subscribers.get(tenant):
+                return
+            pending = self._pending.setdefault(tenant, {})
+            for topic, ids in changes.items():
+                pending.setdefault(topic, set()).update(ids)
+
+    def subscribe(
+        self, tenant: str, topics: Iterable[str] = TOPICS, stock_threshold: Optional[float] = None,
+    ) -> Subscriber:
+        """Nuova connessione (dall'event loop): avvia il flusher se non è attivo."""
+        subscriber = Subscriber(tenant, topics, stock_threshold, self.queue_size)
+        with self._lock:
+            self._subscribers[tenant].add(subscriber)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._run())
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.tenant)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[subscriber.tenant]
+                    self._pending.pop(subscriber.tenant, None)
+
+    async def _run(self) -> None:
+        while self._subscribers:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Calcola e pubblica un aggiornamento per ogni tenant con modifiche in attesa."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for tenant, changes in pending.items():
+            try:
+                update = await to_thread.run_sync(compute_update, tenant, changes)
+            except Exception:
+                self.errors += 1  # un errore di un tenant non ferma gli altri né il flusher
+                continue
+            for subscriber in list(self._subscribers.get(tenant, ())):
+                data = subscriber.message(update)
+                if data is not None:
+                    subscriber.offer("update", data)
+                    self.published += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            subscribers = [s for group in self._subscribers.values() for s in group]
+        return {
+            "subscribers": len(subscribers),
+            "tenants": len({s.tenant for s in subscribers}),
+            "published": self.published,
+            "resyncs": sum(s.resyncs for s in subscribers),
+            "errors": self.errors,
+        }
+
+
+hub = LiveHub(config.LIVE_FLUSH_INTERVAL, config.LIVE_QUEUE_SIZE)
+
+
+# -----------------
+# RACCOLTA DELLE MODIFICHE
+# -----------------
+def _tenant(session: Session) -> str:
+    return session.info.get("tenant", config.DEFAULT_TENANT)
+
+
+def _collect(session: Session, table: str, rows: Iterable) -> None:
+    watched = _WATCHED.get(table)
+    if watched is None:
+        return
+    changes = session.info.setdefault("live_changes", {})
+    for row in rows:
+        for topic, column in watched:
+            value = row.get(column) if isinstance(row, dict) else getattr(row, column, None)
+            if value:  # None, e 0 = "nessuno" nei rollup
+                changes.setdefault(topic, set()).add(value)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flush(session, flush_context):
+    if not hub.listening(_tenant(session)):
+        return
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        _collect(session, getattr(obj, "__tablename__", None), [obj])
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_execute(state):
+    if not (state.is_insert or state.is_update) or not hub.listening(_tenant(state.session)):
+        return
+    table = getattr(getattr(state.statement, "table", None), "name", None)
+    parameters = state.parameters
+    if isinstance(parameters, dict):
+        parameters = [parameters]
+    if table in _WATCHED and parameters:
+        _collect(state.session, table, parameters)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_on_commit(session):
+    changes = session.info.pop("live_changes", None)
+    if changes:
+        hub.mark(_tenant(session), changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("live_changes", None)
+
+
+# -----------------
+# DELTA
+# -----------------
+def _margins(db: Session, product_ids: Set[int]) -> List[dict]:
+    result = []
+    for product_id, total_price, total_qty, fc in food_cost.get_product_margins(db, product_ids=product_ids):
+        avg_price = total_price / total_qty if total_qty else 0
+        result.append({
+            "product_id": product_id,
+            "avg_price": round(avg_price, 2),
+            "food_cost": round(fc, 2),
+            "margin": round(avg_price - fc, 2),
+        })
+    return result
+
+
+def compute_update(tenant: str, changes: Dict[str, Set[int]]) -> dict:
+    """
+    Valori correnti delle sole chiavi modificate: margini (food cost attuale,
+    come cost_basis=current) e food cost dei prodotti, totali dei rider,
+    giacenze degli ingredienti.
+    """
+    shard = tenancy.registry.get(tenant)
+    update = {}
+    with shard.read_session() as db:
+        products = changes.get("products")
+        if products:
+            update["products"] = _margins(db, products)
+            update["food_costs"] = [
+                {"product_id": product_id, "food_cost": round(cost, 2)}
+                for product_id, cost in db.execute(
+                    select(models.ProductFoodCost.product_id, models.ProductFoodCost.food_cost)
+                    .where(models.ProductFoodCost.product_id.in_(sorted(products)))
+                )
+            ]
+        riders = changes.get("riders")
+        if riders:
+            update["riders"] = [
+                {
+                    "rider_id": rider_id,
+                    "name": name,
+                    "deliveries": count,
+                    "total_revenue": round(revenue, 2),
+                    "items_delivered": items,
+                }
+                for rider_id, name, _, count, revenue, items, _, _ in crud.get_rider_performance(db, rider_ids=riders)
+            ]
+        ingredients = changes.get("stock")
+        if ingredients:
+            update["stock"] = [
+                {"ingredient_id": ingredient_id, "quantity": round(quantity, 3)}
+                for ingredient_id, quantity in db.execute(
+                    select(models.IngredientStock.ingredient_id, models.IngredientStock.quantity)
+                    .where(models.IngredientStock.ingredient_id.in_(sorted(ingredients)))
+                    .order_by(models.IngredientStock.ingredient_id)
+                )
+            ]
+    return update
+
+
+# -----------------
+# STREAM SSE
+# -----------------
+def _event(name: str, data: dict, event_id: Optional[int] = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {name}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def stream(subscriber: Subscriber) -> AsyncIterator[str]:
+    """Eventi SSE della connessione, con un commento di keep-alive ogni LIVE_HEARTBEAT_SECONDS."""
+    try:
+        yield f"retry: {int(config.LIVE_RETRY_SECONDS * 1000)}\n\n"
+        yield _event("ready", {"topics": sorted(subscriber.topics), "interval": hub.interval})
+        sequence = 0
+        while True:
+            try:
+                name, data = await asyncio.wait_for(subscriber.queue.get(), config.LIVE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            sequence += 1
+            yield _event(name, data, sequence)
+    finally:
+        hub.unsubscribe(subscriber)
@@ -9,40 +9,55 @@ Gestione CRUD, import/export CSV e dashboard analytics per:
 - Magazzino
 - Rider
 
-Tutto pronto per sviluppo locale e futura estensione multi-tenant/cloud.
+Multi-tenant: ogni ristorante ha il proprio database, scelto dal claim
+"tenant" del token (vedi tenancy.py); gli utenti stanno nel database principale.
 """
 
 import os
 import csv
+import asyncio
+import uuid
+from contextlib import asynccontextmanager
 from io import StringIO
 from datetime import datetime, timedelta
+from typing import Any, Literal, Optional, Union
 
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, status
+from fastapi import FastAPI, APIRouter, Body, Depends, HTTPException, Path, Request, UploadFile, File, Query, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.security import OAuth2PasswordRequestForm
+from anyio import CapacityLimiter, to_thread
 from sqlalchemy.orm import Session
-from jose import jwt, JWTError
-from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import AsyncSession
+from jose import jwt
+from pydantic import ValidationError
 
 # importa la sessione e i metadata dal tuo database.py
-from .database import SessionLocal, engine, Base
+from .database import (
+    SessionLocal, AsyncSessionLocal, engine, read_engine, async_engine, async_read_engine,
+)
 
 # importa i tuoi modelli SQLAlchemy e i tuoi schemi Pydantic
-from . import models, crud, schemas
-
-from dotenv import load_dotenv
-import os
+from . import models, crud, crud_async, schemas, importers, exporters, bulk, cost_history, food_cost, jobs, listing, live, migrations, metrics, response_cache, search, tenancy, utils
+from .core import auth, config, security
 
-load_dotenv()  # carica .env in os.environ
+# conteggio query e tempo SQL per richiesta (Server-Timing e /metrics)
+metrics.instrument(engine, read_engine, async_engine, async_read_engine)
 
-SECRET_KEY = os.getenv('SECRET_KEY', 'fallback_insecure_key')
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES', '60'))
+# crea/aggiorna lo schema (tabelle, indici) applicando le migrazioni pendenti
+migrations.upgrade(engine)
+with SessionLocal() as _db:
+    food_cost.ensure_built(_db)
 
-# crea tutte le tabelle (incl. users, ingredients, products, ecc.)
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # worker degli import in background: riprendono i job in coda o interrotti
+    jobs.runner.start()
+    yield
+    await to_thread.run_sync(jobs.runner.stop)
 
 # inizializza FastAPI e CORS
-app = FastAPI(title="Food Cost Dashboard API", version="0.1")
+app = FastAPI(title="Food Cost Dashboard API", version="0.1", lifespan=lifespan)
 origins = ["http://localhost:5173"]
 app.add_middleware(
     CORSMiddleware,
@@ -50,40 +65,74 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+# aggiunto per ultimo, quindi il più esterno: misura anche CORS e gli errori
+if config.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
 
 # --- Dependency per ottenere la sessione DB per ogni richiesta ---
-def get_db():
-    db = SessionLocal()
+# Le sessioni dati sono aperte sul database del tenant della richiesta
+async def open_shard(tenant: str) -> tenancy.Shard:
+    shard = tenancy.registry.peek(tenant)
+    if shard is None:
+        # primo accesso al tenant: engine e migrazioni fuori dall'event loop
+        shard = await to_thread.run_sync(tenancy.registry.get, tenant)
+    else:
+        tenancy.registry.evict()
+    await tenancy.registry.dispose_retired()
+    return shard
+
+async def get_shard(tenant: str = Depends(auth.get_tenant)) -> tenancy.Shard:
+    return await open_shard(tenant)
+
+def get_db(shard: tenancy.Shard = Depends(get_shard)):
+    db = shard.session()
     try:
         yield db
     finally:
         db.close()
 
-# --- Impostazioni sicurezza / JWT ---
-SECRET_KEY = os.getenv('SECRET_KEY', 'supersecretkey')
-ALGORITHM = 'HS256'
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES', '60'))
+# Dependency async (aiosqlite) per gli endpoint async: import CSV e dashboard
+async def get_async_db(shard: tenancy.Shard = Depends(get_shard)):
+    async with shard.async_session() as db:
+        yield db
+
+async def get_async_read_db(shard: tenancy.Shard = Depends(get_shard)):
+    async with shard.async_read_session() as db:
+        yield db
+
+# Utenti e login: sempre sul database principale, qualunque sia il tenant
+async def get_control_db():
+    async with AsyncSessionLocal() as db:
+        yield db
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
+# --- Impostazioni sicurezza / JWT (da .env, vedi core/config.py) ---
+SECRET_KEY = config.SECRET_KEY
+ALGORITHM = config.ALGORITHM
+ACCESS_TOKEN_EXPIRE_MINUTES = config.ACCESS_TOKEN_EXPIRE_MINUTES
 
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
-def verify_password(plain_pw: str, hashed_pw: str) -> bool:
-    return pwd_context.verify(plain_pw, hashed_pw)
-
-def authenticate_user(db: Session, email: str, password: str):
-    user = get_user_by_email(db, email)
-    if not user or not verify_password(password, user.hashed_password):
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    user = await db.run_sync(get_user_by_email, email)
+    if not user:
         return None
+    valid, new_hash = await security.verify_and_update_async(password, user.hashed_password)
+    if not valid:
+        return None
+    if new_hash:
+        # hash creato con un costo bcrypt superato: lo aggiorna al costo corrente
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    # jti: due login nello stesso secondo danno token distinti, revocabili uno per uno
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 # ------ AUTH ENDPOINTS ------
@@ -92,59 +141,79 @@ def create_access_token(data: dict):
     response_model=schemas.TokenResponse,
     status_code=status.HTTP_201_CREATED
 )
-def register(
+async def register(
     data: schemas.RegisterRequest,
-    db: Session = Depends(get_db)
+    token: Optional[str] = Depends(auth.optional_oauth2_scheme),
+    db: AsyncSession = Depends(get_control_db)
 ):
-    if get_user_by_email(db, data.email):
+    tenant = data.tenant or config.DEFAULT_TENANT
+    if tenant != config.DEFAULT_TENANT and config.AUTH_REQUIRED:
+        # solo un admin può creare utenti di un ristorante specifico
+        if token is None:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
+        await auth.require_admin(await auth.get_current_user(token))
+    if await db.run_sync(get_user_by_email, data.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     # crea e salva utente
-    hashed = pwd_context.hash(data.password)
-    user = models.User(email=data.email, hashed_password=hashed)
+    hashed = await security.hash_password_async(data.password)
+    user = models.User(email=data.email, hashed_password=hashed, tenant=tenant)
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
 
-    token = create_access_token({"sub": user.email, "id": user.id})
+    token = create_access_token({"sub": user.email, "id": user.id, "tenant": user.tenant})
     return {"access_token": token, "token_type": "bearer"}
 
 @app.post(
     "/auth/login",
     response_model=schemas.TokenResponse
 )
-def login(
+async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_control_db)
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    token = create_access_token({"sub": user.email, "id": user.id})
+    token = create_access_token({"sub": user.email, "id": user.id, "tenant": user.tenant})
     return {"access_token": token, "token_type": "bearer"}
 
 @app.get(
     "/users/me",
     response_model=schemas.UserInDB
 )
-def read_users_me(
-    token: str = Depends(oauth2_scheme)
+async def read_users_me(
+    user: auth.CurrentUser = Depends(auth.get_current_user)
 ):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return {"id": payload.get("id"), "email": payload.get("sub")}
-    except JWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+    return user._asdict()
+
+@app.post("/auth/logout", status_code=204)
+async def logout(
+    token: str = Depends(auth.oauth2_scheme),
+    user: auth.CurrentUser = Depends(auth.get_current_user)
+):
+    """Revoca il token corrente fino alla sua scadenza (su tutti i worker, vedi core.auth)."""
+    await auth.revoke_token(token)
+    return
+
+@app.get("/auth/token-cache/stats", dependencies=[Depends(auth.get_current_user)])
+def token_cache_stats():
+    """Statistiche della cache dei token verificati (hit rate, dimensione, evizioni)."""
+    return auth.token_cache.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def prometheus_metrics():
+    """Metriche in formato testo Prometheus: latenze per route e status, query SQL per richiesta."""
+    if not config.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 #############################  FINE LOGIN/REGISTRAZIONE UTENTI #############################
 
@@ -162,12 +231,10 @@ def read_users_me(
 
 
 ##############################################################################
-# Crea tutte le tabelle al primo avvio (sviluppo)
-models.Base.metadata.create_all(bind=engine)
 
-# Dependency: crea una sessione DB per ogni request
-def get_db():
-    db = SessionLocal()
+# Dependency: sessione in sola lettura per gli endpoint dashboard/KPI
+def get_read_db(shard: tenancy.Shard = Depends(get_shard)):
+    db = shard.read_session()
     try:
         yield db
     finally:
@@ -177,19 +244,62 @@ def get_db():
 # CRUD ENDPOINTS - GESTIONE DATI DI BASE
 # =========================================
 
+# Tutti gli endpoint dati stanno su questo router: richiedono un token valido
+# (salvo AUTH_REQUIRED=false, per sviluppo locale)
+protected = APIRouter(dependencies=[Depends(auth.get_current_user)] if config.AUTH_REQUIRED else [])
+
+# Le liste accettano skip/limit (OFFSET, come sempre) oppure `cursor` per la
+# paginazione keyset: passare cursor vuoto per la prima pagina e poi il
+# next_cursor ricevuto; la risposta diventa {items, next_cursor}.
+CURSOR_QUERY = Query(None, description="Cursore keyset (vuoto = prima pagina); se presente la risposta è {items, next_cursor}")
+SKIP_QUERY = Query(0, ge=0, description="Righe da saltare (OFFSET)")
+LIMIT_QUERY = Query(100, ge=1, le=10000, description="Righe per pagina (1-10000)")
+
+# Ordini, movimenti e risultati degli import (liste anche da 10k righe) sono
+# serializzati da app.listing: tuple di colonne + orjson, senza oggetti ORM né
+# validazione Pydantic; layout=columnar restituisce {colonna: [valori]}.
+ORDER_FIELDS = listing.columns(schemas.Order)
+MOVEMENT_FIELDS = listing.columns(schemas.InventoryMovement)
+INGREDIENT_FIELDS = listing.columns(schemas.Ingredient)
+PRODUCT_FIELDS = listing.columns(schemas.Product)
+RECIPE_FIELDS = listing.columns(schemas.Recipe)
+RIDER_FIELDS = listing.columns(schemas.Rider)
+
+def keyset_page(db: Session, model, cursor: str, limit: int, columns=None):
+    try:
+        items, next_cursor = crud.get_keyset_page(db, model, cursor=cursor, limit=limit, columns=columns)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return {"items": items, "next_cursor": next_cursor}
+
 # ---- INGREDIENTI ----
 
-@app.post("/ingredients/", response_model=schemas.Ingredient)
+@protected.post("/ingredients/", response_model=schemas.Ingredient)
 def create_ingredient(ingredient: schemas.IngredientCreate, db: Session = Depends(get_db)):
     """Crea un nuovo ingrediente."""
     return crud.create_ingredient(db, ingredient)
 
-@app.get("/ingredients/", response_model=list[schemas.Ingredient])
-def read_ingredients(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@protected.get("/ingredients/", response_model=Union[list[schemas.Ingredient], schemas.IngredientPage])
+def read_ingredients(skip: int = SKIP_QUERY, limit: int = LIMIT_QUERY, cursor: Optional[str] = CURSOR_QUERY, db: Session = Depends(get_db)):
     """Restituisce tutti gli ingredienti, paginati."""
+    if cursor is not None:
+        return keyset_page(db, models.Ingredient, cursor, limit)
     return crud.get_ingredients(db, skip=skip, limit=limit)
 
-@app.get("/ingredients/{ingredient_id}", response_model=schemas.Ingredient)
+@protected.get("/ingredients/search", response_model=list[schemas.IngredientSearchHit])
+def search_ingredients(
+    q: str = Query(..., min_length=1, max_length=100, description="Testo da cercare nel nome"),
+    cost_min: Optional[float] = None,
+    cost_max: Optional[float] = None,
+    fuzzy: bool = Query(True, description="Includi nomi simili (refusi) se i risultati esatti non bastano"),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db),
+):
+    """Cerca ingredienti per nome (prefisso, sottostringa, refusi), ordinati per rilevanza."""
+    rows = search.search_ingredients(db, q, cost_min=cost_min, cost_max=cost_max, limit=limit, fuzzy=fuzzy)
+    return [{"id": i, "name": name, "unit_cost": cost, "score": score} for i, name, cost, score in rows]
+
+@protected.get("/ingredients/{ingredient_id}", response_model=schemas.Ingredient)
 def read_ingredient(ingredient_id: int, db: Session = Depends(get_db)):
     """Restituisce un singolo ingrediente per ID."""
     db_ing = crud.get_ingredient(db, ingredient_id)
@@ -197,7 +307,7 @@ def read_ingredient(ingredient_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Ingredient not found")
     return db_ing
 
-@app.put("/ingredients/{ingredient_id}", response_model=schemas.Ingredient)
+@protected.put("/ingredients/{ingredient_id}", response_model=schemas.Ingredient)
 def update_ingredient(ingredient_id: int, ingredient: schemas.IngredientCreate, db: Session = Depends(get_db)):
     """Aggiorna un ingrediente esistente (nome/costo)."""
     db_ing = crud.update_ingredient(db, ingredient_id, ingredient)
@@ -205,7 +315,15 @@ def update_ingredient(ingredient_id: int, ingredient: schemas.IngredientCreate,
         raise HTTPException(status_code=404, detail="Ingredient not found")
     return db_ing
 
-@app.delete("/ingredients/{ingredient_id}", status_code=204)
+@protected.get("/ingredients/{ingredient_id}/cost-history", response_model=list[schemas.IngredientCostVersion])
+def read_ingredient_cost_history(ingredient_id: int, db: Session = Depends(get_read_db)):
+    """Versioni del costo unitario dell'ingrediente, dalla più vecchia, con intervallo di validità."""
+    history = cost_history.get_history(db, ingredient_id)
+    if not history:
+        raise HTTPException(status_code=404, detail="Ingredient not found")
+    return history
+
+@protected.delete("/ingredients/{ingredient_id}", status_code=204)
 def delete_ingredient(ingredient_id: int, db: Session = Depends(get_db)):
     """Elimina un ingrediente per ID."""
     crud.delete_ingredient(db, ingredient_id)
@@ -213,17 +331,34 @@ def delete_ingredient(ingredient_id: int, db: Session = Depends(get_db)):
 
 # ---- PRODOTTI ----
 
-@app.post("/products/", response_model=schemas.Product)
+@protected.post("/products/", response_model=schemas.Product)
 def create_product(product: schemas.ProductCreate, db: Session = Depends(get_db)):
     """Crea un nuovo prodotto (piatto/voce menu)."""
     return crud.create_product(db, product)
 
-@app.get("/products/", response_model=list[schemas.Product])
-def read_products(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@protected.get("/products/", response_model=Union[list[schemas.Product], schemas.ProductPage])
+def read_products(skip: int = SKIP_QUERY, limit: int = LIMIT_QUERY, cursor: Optional[str] = CURSOR_QUERY, db: Session = Depends(get_db)):
     """Restituisce tutti i prodotti (paginati)."""
+    if cursor is not None:
+        return keyset_page(db, models.Product, cursor, limit)
     return crud.get_products(db, skip=skip, limit=limit)
 
-@app.get("/products/{product_id}", response_model=schemas.Product)
+@protected.get("/products/search", response_model=list[schemas.ProductSearchHit])
+def search_products(
+    q: str = Query(..., min_length=1, max_length=100, description="Testo da cercare nel nome"),
+    food_cost_min: Optional[float] = None,
+    food_cost_max: Optional[float] = None,
+    fuzzy: bool = Query(True, description="Includi nomi simili (refusi) se i risultati esatti non bastano"),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db),
+):
+    """Cerca prodotti per nome (prefisso, sottostringa, refusi), ordinati per rilevanza."""
+    rows = search.search_products(
+        db, q, food_cost_min=food_cost_min, food_cost_max=food_cost_max, limit=limit, fuzzy=fuzzy
+    )
+    return [{"id": i, "name": name, "food_cost": round(cost, 2), "score": score} for i, name, cost, score in rows]
+
+@protected.get("/products/{product_id}", response_model=schemas.Product)
 def read_product(product_id: int, db: Session = Depends(get_db)):
     """Restituisce un singolo prodotto per ID."""
     db_prod = crud.get_product(db, product_id)
@@ -231,7 +366,7 @@ def read_product(product_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Product not found")
     return db_prod
 
-@app.put("/products/{product_id}", response_model=schemas.Product)
+@protected.put("/products/{product_id}", response_model=schemas.Product)
 def update_product(product_id: int, product: schemas.ProductCreate, db: Session = Depends(get_db)):
     """Aggiorna nome di un prodotto."""
     db_prod = crud.update_product(db, product_id, product)
@@ -239,25 +374,33 @@ def update_product(product_id: int, product: schemas.ProductCreate, db: Session
         raise HTTPException(status_code=404, detail="Product not found")
     return db_prod
 
-@app.delete("/products/{product_id}", status_code=204)
+@protected.delete("/products/{product_id}", status_code=204)
 def delete_product(product_id: int, db: Session = Depends(get_db)):
-    """Elimina un prodotto."""
-    crud.delete_product(db, product_id)
+    """Elimina un prodotto e la sua ricetta (400 se è usato come semilavorato da altri prodotti)."""
+    try:
+        crud.delete_product(db, product_id)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
     return
 
 # ---- RICETTE ----
 
-@app.post("/recipes/", response_model=schemas.Recipe)
+@protected.post("/recipes/", response_model=schemas.Recipe)
 def create_recipe(recipe: schemas.RecipeCreate, db: Session = Depends(get_db)):
-    """Aggiungi una riga ricetta (ingredienti e quantità per prodotto)."""
-    return crud.create_recipe(db, recipe)
+    """Aggiungi una riga ricetta: ingrediente o semilavorato (altro prodotto) e quantità per prodotto."""
+    try:
+        return crud.create_recipe(db, recipe)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
-@app.get("/recipes/", response_model=list[schemas.Recipe])
-def read_recipes(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@protected.get("/recipes/", response_model=Union[list[schemas.Recipe], schemas.RecipePage])
+def read_recipes(skip: int = SKIP_QUERY, limit: int = LIMIT_QUERY, cursor: Optional[str] = CURSOR_QUERY, db: Session = Depends(get_db)):
     """Tutte le righe ricetta (ingredienti usati nei prodotti)."""
-    return crud.get_recipes(db, skip=skip, limit=limit)
+    if cursor is not None:
+        return keyset_page(db, models.Recipe, cursor, limit)
+    return crud.get_all_recipes(db, skip=skip, limit=limit)
 
-@app.delete("/recipes/{recipe_id}", status_code=204)
+@protected.delete("/recipes/{recipe_id}", status_code=204)
 def delete_recipe(recipe_id: int, db: Session = Depends(get_db)):
     """Elimina una riga ricetta."""
     crud.delete_recipe(db, recipe_id)
@@ -265,17 +408,43 @@ def delete_recipe(recipe_id: int, db: Session = Depends(get_db)):
 
 # ---- ORDINI ----
 
-@app.post("/orders/", response_model=schemas.Order)
+@protected.post("/orders/", response_model=schemas.Order)
 def create_order(order: schemas.OrderCreate, db: Session = Depends(get_db)):
     """Crea un nuovo ordine (vendita prodotto, opzionalmente rider)."""
     return crud.create_order(db, order)
 
-@app.get("/orders/", response_model=list[schemas.Order])
-def read_orders(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@protected.get("/orders/", response_model=Union[list[schemas.Order], schemas.OrderPage])
+def read_orders(
+    skip: int = SKIP_QUERY,
+    limit: int = LIMIT_QUERY,
+    cursor: Optional[str] = CURSOR_QUERY,
+    layout: listing.Layout = listing.LAYOUT_QUERY,
+    db: Session = Depends(get_db),
+):
     """Tutti gli ordini (vendite), paginati."""
-    return crud.get_orders(db, skip=skip, limit=limit)
-
-@app.get("/orders/{order_id}", response_model=schemas.Order)
+    if cursor is not None:
+        page = keyset_page(db, models.Order, cursor, limit, ORDER_FIELDS)
+        return listing.response(ORDER_FIELDS, page["items"], layout, paged=True, next_cursor=page["next_cursor"])
+    return listing.response(ORDER_FIELDS, crud.get_column_rows(db, models.Order, ORDER_FIELDS, skip, limit), layout)
+
+@protected.get("/orders/export")
+def export_orders(
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    product_id: Optional[int] = None,
+    rider_id: Optional[int] = None,
+    format: Literal["csv", "ndjson"] = "csv",
+    gzip: bool = False,
+    shard: tenancy.Shard = Depends(get_shard)
+):
+    """Export in streaming degli ordini filtrati (CSV o NDJSON, gzip opzionale)."""
+    return exporters.export_orders(
+        shard.read_session,
+        lambda db: crud.orders_filtered_query(db, date_from, date_to, product_id, rider_id),
+        format, gzip
+    )
+
+@protected.get("/orders/{order_id}", response_model=schemas.Order)
 def read_order(order_id: int, db: Session = Depends(get_db)):
     """Ordine singolo per ID."""
     db_ord = crud.get_order(db, order_id)
@@ -283,7 +452,7 @@ def read_order(order_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Order not found")
     return db_ord
 
-@app.delete("/orders/{order_id}", status_code=204)
+@protected.delete("/orders/{order_id}", status_code=204)
 def delete_order(order_id: int, db: Session = Depends(get_db)):
     """Elimina un ordine."""
     crud.delete_order(db, order_id)
@@ -291,17 +460,59 @@ def delete_order(order_id: int, db: Session = Depends(get_db)):
 
 # ---- MAGAZZINO (CARICHI/SCARICHI) ----
 
-@app.post("/inventory/", response_model=schemas.InventoryMovement)
+@protected.post("/inventory/", response_model=schemas.InventoryMovement)
 def create_inventory_movement(mov: schemas.InventoryMovementCreate, db: Session = Depends(get_db)):
     """Aggiungi movimento di magazzino (carico/scarico ingrediente)."""
     return crud.create_inventory_movement(db, mov)
 
-@app.get("/inventory/", response_model=list[schemas.InventoryMovement])
-def read_inventory_movements(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@protected.get("/inventory/", response_model=Union[list[schemas.InventoryMovement], schemas.InventoryMovementPage])
+def read_inventory_movements(
+    skip: int = SKIP_QUERY,
+    limit: int = LIMIT_QUERY,
+    cursor: Optional[str] = CURSOR_QUERY,
+    layout: listing.Layout = listing.LAYOUT_QUERY,
+    db: Session = Depends(get_db),
+):
     """Lista movimenti di magazzino."""
-    return crud.get_inventory_movements(db, skip=skip, limit=limit)
+    model = models.InventoryMovement
+    if cursor is not None:
+        page = keyset_page(db, model, cursor, limit, MOVEMENT_FIELDS)
+        return listing.response(MOVEMENT_FIELDS, page["items"], layout, paged=True, next_cursor=page["next_cursor"])
+    return listing.response(MOVEMENT_FIELDS, crud.get_column_rows(db, model, MOVEMENT_FIELDS, skip, limit), layout)
+
+@protected.get("/inventory/export")
+def export_inventory_movements(
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    ingredient_id: Optional[int] = None,
+    movement_type: Optional[models.MovementType] = None,
+    format: Literal["csv", "ndjson"] = "csv",
+    gzip: bool = False,
+    shard: tenancy.Shard = Depends(get_shard)
+):
+    """Export in streaming dei movimenti di magazzino filtrati (CSV o NDJSON, gzip opzionale)."""
+    return exporters.export_inventory(
+        shard.read_session,
+        lambda db: crud.inventory_movements_filtered_query(db, date_from, date_to, ingredient_id, movement_type),
+        format, gzip
+    )
+
+@protected.get("/inventory/stock", response_model=list[schemas.IngredientStock])
+async def read_stock(
+    as_of: Optional[datetime] = None,
+    ingredient_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """
+    Giacenza per ingrediente (carichi - scarichi): corrente, oppure all'istante
+    as_of, calcolata dall'ultimo snapshot precedente più i movimenti successivi.
+    """
+    return [
+        {"ingredient_id": ing, "quantity": round(qty, 3)}
+        for ing, qty in await crud_async.get_stock(db, as_of=as_of, ingredient_id=ingredient_id)
+    ]
 
-@app.delete("/inventory/{movement_id}", status_code=204)
+@protected.delete("/inventory/{movement_id}", status_code=204)
 def delete_inventory_movement(movement_id: int, db: Session = Depends(get_db)):
     """Elimina movimento magazzino."""
     crud.delete_inventory_movement(db, movement_id)
@@ -309,17 +520,19 @@ def delete_inventory_movement(movement_id: int, db: Session = Depends(get_db)):
 
 # ---- RIDER ----
 
-@app.post("/riders/", response_model=schemas.Rider)
+@protected.post("/riders/", response_model=schemas.Rider)
 def create_rider(rider: schemas.RiderCreate, db: Session = Depends(get_db)):
     """Crea nuovo rider (fattorino/consegna)."""
     return crud.create_rider(db, rider)
 
-@app.get("/riders/", response_model=list[schemas.Rider])
-def read_riders(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@protected.get("/riders/", response_model=Union[list[schemas.Rider], schemas.RiderPage])
+def read_riders(skip: int = SKIP_QUERY, limit: int = LIMIT_QUERY, cursor: Optional[str] = CURSOR_QUERY, db: Session = Depends(get_db)):
     """Tutti i rider registrati."""
+    if cursor is not None:
+        return keyset_page(db, models.Rider, cursor, limit)
     return crud.get_riders(db, skip=skip, limit=limit)
 
-@app.get("/riders/{rider_id}", response_model=schemas.Rider)
+@protected.get("/riders/{rider_id}", response_model=schemas.Rider)
 def read_rider(rider_id: int, db: Session = Depends(get_db)):
     """Singolo rider per ID."""
     db_r = crud.get_rider(db, rider_id)
@@ -327,7 +540,7 @@ def read_rider(rider_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Rider not found")
     return db_r
 
-@app.put("/riders/{rider_id}", response_model=schemas.Rider)
+@protected.put("/riders/{rider_id}", response_model=schemas.Rider)
 def update_rider(rider_id: int, rider: schemas.RiderCreate, db: Session = Depends(get_db)):
     """Aggiorna nome/tempo medio consegna di un rider."""
     db_r = crud.update_rider(db, rider_id, rider)
@@ -335,18 +548,82 @@ def update_rider(rider_id: int, rider: schemas.RiderCreate, db: Session = Depend
         raise HTTPException(status_code=404, detail="Rider not found")
     return db_r
 
-@app.delete("/riders/{rider_id}", status_code=204)
+@protected.delete("/riders/{rider_id}", status_code=204)
 def delete_rider(rider_id: int, db: Session = Depends(get_db)):
     """Elimina un rider."""
     crud.delete_rider(db, rider_id)
     return
 
+# =========================================
+# CREAZIONE IN BLOCCO (JSON)
+# =========================================
+
+# Ogni endpoint accetta un array di oggetti nel formato del corrispondente
+# schema *Create e li inserisce in un'unica transazione, restituendo solo gli
+# id (allineati all'array) e gli errori per indice.
+# mode=all_or_nothing: con un solo errore non si inserisce nulla (422);
+# mode=best_effort: si inseriscono gli elementi validi e si riportano gli altri.
+BULK_MODE_QUERY = Query(bulk.ALL_OR_NOTHING, description="all_or_nothing oppure best_effort")
+
+def bulk_create(db: Session, entity: str, items: list, mode: str):
+    if len(items) > bulk.MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Massimo {bulk.MAX_ITEMS} elementi per richiesta")
+    result = bulk.create_many(db, entity, items, mode)
+    if result["errors"] and mode == bulk.ALL_OR_NOTHING:
+        raise HTTPException(status_code=422, detail=result["errors"])
+    return result
+
+@protected.post("/ingredients/bulk", response_model=schemas.BulkResult)
+def bulk_create_ingredients(
+    items: list[dict[str, Any]] = Body(..., description="Array di IngredientCreate"),
+    mode: Literal["all_or_nothing", "best_effort"] = BULK_MODE_QUERY,
+    db: Session = Depends(get_db)
+):
+    """Crea più ingredienti in un'unica transazione (nomi univoci)."""
+    return bulk_create(db, "ingredients", items, mode)
+
+@protected.post("/recipes/bulk", response_model=schemas.BulkResult)
+def bulk_create_recipes(
+    items: list[dict[str, Any]] = Body(..., description="Array di RecipeCreate"),
+    mode: Literal["all_or_nothing", "best_effort"] = BULK_MODE_QUERY,
+    db: Session = Depends(get_db)
+):
+    """Crea più righe ricetta in un'unica transazione (prodotti e ingredienti devono esistere)."""
+    return bulk_create(db, "recipes", items, mode)
+
+@protected.post("/orders/bulk", response_model=schemas.BulkResult)
+def bulk_create_orders(
+    items: list[dict[str, Any]] = Body(..., description="Array di OrderCreate"),
+    mode: Literal["all_or_nothing", "best_effort"] = BULK_MODE_QUERY,
+    db: Session = Depends(get_db)
+):
+    """Crea più ordini in un'unica transazione (prodotti e rider devono esistere)."""
+    return bulk_create(db, "orders", items, mode)
+
+@protected.post("/inventory/bulk", response_model=schemas.BulkResult)
+def bulk_create_inventory_movements(
+    items: list[dict[str, Any]] = Body(..., description="Array di InventoryMovementCreate"),
+    mode: Literal["all_or_nothing", "best_effort"] = BULK_MODE_QUERY,
+    db: Session = Depends(get_db)
+):
+    """Crea più movimenti di magazzino in un'unica transazione (gli ingredienti devono esistere)."""
+    return bulk_create(db, "inventory", items, mode)
+
+@protected.post("/riders/bulk", response_model=schemas.BulkResult)
+def bulk_create_riders(
+    items: list[dict[str, Any]] = Body(..., description="Array di RiderCreate"),
+    mode: Literal["all_or_nothing", "best_effort"] = BULK_MODE_QUERY,
+    db: Session = Depends(get_db)
+):
+    """Crea più rider in un'unica transazione (nomi univoci)."""
+    return bulk_create(db, "riders", items, mode)
+
 # =========================================
 # ENDPOINTS IMPORT CSV
 # =========================================
 
-@app.post("/orders/import-csv/", response_model=list[schemas.Order])
-async def import_orders_csv(file: UploadFile = File(...), db: Session = Depends(get_db)):
+@protected.post("/orders/import-csv/", response_model=list[schemas.Order])
+async def import_orders_csv(file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db)):
     """Importa ordini da file CSV con colonne: product_id, quantity, price, rider_id, timestamp."""
     content = await file.read()
     reader = csv.DictReader(StringIO(content.decode('utf-8')))
@@ -360,77 +637,118 @@ async def import_orders_csv(file: UploadFile = File(...), db: Session = Depends(
             'timestamp': row.get('timestamp') or None
         }
         order_in = schemas.OrderCreate(**data)
-        obj = crud.create_order(db, order_in)
+        obj = await crud_async.create_order(db, order_in)
         created.append(obj)
-    return created
+    return listing.response(ORDER_FIELDS, listing.from_objects(created, ORDER_FIELDS))
+
+@protected.post("/orders/import-csv/stream/", response_model=schemas.ImportSummary)
+async def import_orders_csv_stream(
+    file: UploadFile = File(...),
+    chunk_size: int = Query(importers.DEFAULT_CHUNK_SIZE, ge=1, le=50000),
+    commit_every: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Import ordini in streaming (stesse colonne di /orders/import-csv/):
+    - lettura incrementale del file e validazione a blocchi di chunk_size righe
+    - insert bulk in un'unica transazione (commit_every=0) o con commit ogni N righe
+    - risposta sintetica: conteggi, righe scartate con numero di riga, tempo impiegato
+    """
+    return await crud_async.import_orders(db, file.file, chunk_size, commit_every)
 
-@app.post("/ingredients/import-costs-csv/", response_model=list[schemas.Ingredient])
-async def import_ingredient_costs_csv(file: UploadFile = File(...), db: Session = Depends(get_db)):
+@protected.post("/ingredients/import-costs-csv/", response_model=list[schemas.Ingredient])
+async def import_ingredient_costs_csv(file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db)):
     """Importa costi ingredienti da CSV: id (opz.), name, unit_cost."""
     content = await file.read()
     reader = csv.DictReader(StringIO(content.decode('utf-8')))
     results = []
     for row in reader:
-        ing = crud.get_ingredient(db, int(row['id'])) if row.get('id') else \
-              db.query(models.Ingredient).filter(models.Ingredient.name == row['name']).first()
+        ing = await crud_async.get_ingredient(db, int(row['id'])) if row.get('id') else \
+              await crud_async.get_ingredient_by_name(db, row['name'])
         cost = float(row['unit_cost'])
         if ing:
             ing_upd = schemas.IngredientCreate(name=ing.name, unit_cost=cost)
-            updated = crud.update_ingredient(db, ing.id, ing_upd)
+            updated = await crud_async.update_ingredient(db, ing.id, ing_upd)
             results.append(updated)
         else:
             new_ing = schemas.IngredientCreate(name=row['name'], unit_cost=cost)
-            created = crud.create_ingredient(db, new_ing)
+            created = await crud_async.create_ingredient(db, new_ing)
             results.append(created)
-    return results
+    return listing.response(INGREDIENT_FIELDS, listing.from_objects(results, INGREDIENT_FIELDS))
 
-@app.post("/products/import-csv/", response_model=list[schemas.Product])
-async def import_products_csv(file: UploadFile = File(...), db: Session = Depends(get_db)):
+@protected.post("/ingredients/import-costs-csv/upsert/", response_model=schemas.UpsertSummary)
+async def import_ingredient_costs_csv_upsert(file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db)):
+    """
+    Upsert costi ingredienti da CSV (id opz., name, unit_cost) in un'unica transazione:
+    restituisce i conteggi di ingredienti inseriti, aggiornati e invariati.
+    """
+    return await crud_async.import_ingredient_costs(db, file.file)
+
+@protected.post("/products/import-csv/", response_model=list[schemas.Product])
+async def import_products_csv(file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db)):
     """Importa prodotti da CSV (colonna name)."""
     content = await file.read()
     reader = csv.DictReader(StringIO(content.decode('utf-8')))
     created = []
     for row in reader:
         prod_in = schemas.ProductCreate(name=row['name'])
-        obj = crud.create_product(db, prod_in)
+        obj = await crud_async.create_product(db, prod_in)
         created.append(obj)
-    return created
+    return listing.response(PRODUCT_FIELDS, listing.from_objects(created, PRODUCT_FIELDS))
 
-@app.post("/recipes/import-csv/", response_model=list[schemas.Recipe])
-async def import_recipes_csv(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    """Importa ricette da CSV (colonne: product_id, ingredient_id, quantity)."""
+@protected.post("/recipes/import-csv/", response_model=list[schemas.Recipe])
+async def import_recipes_csv(file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db)):
+    """Importa ricette da CSV (colonne: product_id, ingredient_id o component_product_id, quantity)."""
     content = await file.read()
     reader = csv.DictReader(StringIO(content.decode('utf-8')))
     created = []
-    for row in reader:
+    for line, row in enumerate(reader, start=2):
         rec_in = schemas.RecipeCreate(
             product_id=int(row['product_id']),
-            ingredient_id=int(row['ingredient_id']),
+            ingredient_id=int(row['ingredient_id']) if row.get('ingredient_id') else None,
+            component_product_id=int(row['component_product_id']) if row.get('component_product_id') else None,
             quantity=float(row['quantity'])
         )
-        obj = crud.create_recipe(db, rec_in)
+        try:
+            obj = await crud_async.create_recipe(db, rec_in)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=f"riga {line}: {exc}")
         created.append(obj)
-    return created
+    return listing.response(RECIPE_FIELDS, listing.from_objects(created, RECIPE_FIELDS))
 
-@app.post("/inventory/import-csv/", response_model=list[schemas.InventoryMovement])
-async def import_inventory_csv(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    """Importa movimenti magazzino da CSV (ingredient_id, quantity, movement_type, timestamp)."""
+@protected.post("/inventory/import-csv/", response_model=list[schemas.InventoryMovement])
+async def import_inventory_csv(file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db)):
+    """
+    Importa movimenti magazzino da CSV (ingredient_id, quantity, movement_type, timestamp).
+    Le righe sono validate tutte prima di scrivere: con una riga non valida
+    (es. movement_type diverso da carico/scarico) risponde 400 con il numero
+    di riga e non importa nulla.
+    """
     content = await file.read()
     reader = csv.DictReader(StringIO(content.decode('utf-8')))
+    movements = []
+    for line, row in enumerate(reader, start=2):
+        try:
+            movements.append(schemas.InventoryMovementCreate(
+                ingredient_id=int(row['ingredient_id']),
+                quantity=float(row['quantity']),
+                movement_type=row['movement_type'],
+                timestamp=row.get('timestamp') or None
+            ))
+        except ValidationError as exc:
+            raise HTTPException(status_code=400, detail=f"riga {line}: {utils.format_validation_error(exc)}")
+        except KeyError as exc:
+            raise HTTPException(status_code=400, detail=f"riga {line}: colonna {exc} mancante")
+        except (TypeError, ValueError) as exc:
+            raise HTTPException(status_code=400, detail=f"riga {line}: {exc}")
     created = []
-    for row in reader:
-        mov_in = schemas.InventoryMovementCreate(
-            ingredient_id=int(row['ingredient_id']),
-            quantity=float(row['quantity']),
-            movement_type=row['movement_type'],
-            timestamp=row.get('timestamp') or None
-        )
-        obj = crud.create_inventory_movement(db, mov_in)
+    for mov_in in movements:
+        obj = await crud_async.create_inventory_movement(db, mov_in)
         created.append(obj)
-    return created
+    return listing.response(MOVEMENT_FIELDS, listing.from_objects(created, MOVEMENT_FIELDS))
 
-@app.post("/riders/import-csv/", response_model=list[schemas.Rider])
-async def import_riders_csv(file: UploadFile = File(...), db: Session = Depends(get_db)):
+@protected.post("/riders/import-csv/", response_model=list[schemas.Rider])
+async def import_riders_csv(file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db)):
     """Importa rider da CSV (colonne: name, delivery_time)."""
     content = await file.read()
     reader = csv.DictReader(StringIO(content.decode('utf-8')))
@@ -440,80 +758,315 @@ async def import_riders_csv(file: UploadFile = File(...), db: Session = Depends(
             name=row['name'],
             delivery_time=float(row['delivery_time']) if row.get('delivery_time') else None
         )
-        obj = crud.create_rider(db, rider_in)
+        obj = await crud_async.create_rider(db, rider_in)
         created.append(obj)
-    return created
+    return listing.response(RIDER_FIELDS, listing.from_objects(created, RIDER_FIELDS))
+
+# =========================================
+# IMPORT CSV IN BACKGROUND (JOB)
+# =========================================
+
+# Stesse colonne degli endpoint import-csv, ma la richiesta risponde subito
+# con l'id del job; avanzamento ed errori su /jobs/{id} (vedi app.jobs).
+JOB_KIND = Path(..., description="Tipo di import: " + ", ".join(jobs.KINDS))
+
+@protected.post("/jobs/import/{kind}", response_model=schemas.ImportJob, status_code=202)
+async def submit_import_job(
+    kind: str = JOB_KIND,
+    file: UploadFile = File(...),
+    shard: tenancy.Shard = Depends(get_shard),
+):
+    """Mette in coda l'import di un CSV; i worker lo eseguono a blocchi con checkpoint."""
+    if kind not in jobs.KINDS:
+        raise HTTPException(status_code=404, detail=f"tipo di import non valido: {kind}; ammessi {list(jobs.KINDS)}")
+    job = await to_thread.run_sync(jobs.submit, shard, kind, file.file, file.filename)
+    return jobs.describe(job)
+
+@protected.get("/jobs/", response_model=list[schemas.ImportJob])
+def read_jobs(
+    status: Optional[models.JobStatus] = None,
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db),
+):
+    """Job di import del tenant, dal più recente."""
+    return [jobs.describe(job) for job in jobs.list_jobs(db, status, limit)]
+
+@protected.get("/jobs/stats")
+def job_runner_stats():
+    """Worker del processo: attivi, job in coda e in esecuzione, job terminati per stato."""
+    return jobs.runner.stats()
+
+@protected.get("/jobs/{job_id}", response_model=schemas.ImportJob)
+def read_job(job_id: int, db: Session = Depends(get_db)):
+    job = jobs.get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    return jobs.describe(job)
+
+@protected.post("/jobs/{job_id}/cancel", response_model=schemas.ImportJob, status_code=202)
+def cancel_job(job_id: int, db: Session = Depends(get_db), shard: tenancy.Shard = Depends(get_shard)):
+    """Annulla il job: subito se è in coda, altrimenti prima del prossimo blocco (i blocchi già importati restano)."""
+    try:
+        job = jobs.cancel(db, shard.tenant, job_id)
+    except ValueError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    return jobs.describe(job)
 
 # =========================================
 # DASHBOARD / KPI / AGGREGATI
 # =========================================
 
-@app.get("/products/food-cost/", response_model=list[schemas.ProductFoodCost], summary="Food cost per prodotto")
-def read_food_costs(db: Session = Depends(get_db)):
+# Le risposte sono in cache finché non cambiano le tabelle da cui dipendono
+# (vedi response_cache): ETag + If-None-Match -> 304 senza query né serializzazione.
+FOOD_COST_TABLES = ("recipes", "ingredients", "product_food_cost", "ingredient_cost_history")
+SALES_TABLES = ("orders", "sales_rollup_hourly", "sales_rollup_daily") + FOOD_COST_TABLES
+
+@protected.get("/products/food-cost/", response_model=list[schemas.ProductFoodCost], summary="Food cost per prodotto")
+async def read_food_costs(
+    request: Request,
+    as_of: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_read_db),
+):
     """
-    Calcola il food cost per ciascun prodotto:
-    somma costo ingredienti della ricetta per prodotto.
+    Food cost per ciascun prodotto (somma costo ingredienti della ricetta),
+    letto dalla tabella materializzata product_food_cost; con as_of calcolato
+    con i costi ingrediente in vigore a quell'istante (storico dei costi).
     """
-    recipes = crud.get_all_recipes(db)
-    ingredients = crud.get_ingredients(db, skip=0, limit=1000)
-    cost_map = {ing.id: ing.unit_cost for ing in ingredients}
-    prod_costs = defaultdict(float)
-    for r in recipes:
-        prod_costs[r.product_id] += cost_map.get(r.ingredient_id, 0) * r.quantity
-    return [{"product_id": pid, "food_cost": round(cost, 2)} for pid, cost in prod_costs.items()]
-
-@app.get("/products/margine-lordo/", response_model=list[schemas.ProductMargin], summary="Margine lordo per prodotto")
-def read_product_margin(db: Session = Depends(get_db)):
+    async def compute():
+        if as_of is not None:
+            rows = await crud_async.get_food_costs_as_of(db, as_of)
+        else:
+            rows = await crud_async.get_food_costs(db)
+        return [{"product_id": pid, "food_cost": round(cost, 2)} for pid, cost in rows]
+    return await response_cache.respond(request, FOOD_COST_TABLES, compute)
+
+@protected.get("/products/margine-lordo/", response_model=list[schemas.ProductMargin], summary="Margine lordo per prodotto")
+async def read_product_margin(
+    request: Request,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    cost_basis: Literal["sale", "current"] = "sale",
+    db: AsyncSession = Depends(get_async_read_db),
+):
     """
-    Calcola il margine lordo per prodotto:
+    Calcola il margine lordo per prodotto (opzionalmente nel periodo date_from/date_to):
     - prezzo medio di vendita (da ordini)
-    - food cost (da ricetta)
+    - food cost medio per pezzo: ogni ordine è valutato ai costi ingrediente
+      in vigore quando è stato venduto (cost_basis=sale) oppure ai costi
+      attuali (cost_basis=current, lettura della tabella materializzata)
     - margine = prezzo medio - food cost
     """
-    stats = db.query(
-        models.Order.product_id,
-        func.sum(models.Order.price).label("total_price"),
-        func.sum(models.Order.quantity).label("total_qty")
-    ).group_by(models.Order.product_id).all()
-    ingredients = crud.get_ingredients(db, skip=0, limit=1000)
-    recipes = crud.get_all_recipes(db, skip=0, limit=1000)
-    cost_map = {ing.id: ing.unit_cost for ing in ingredients}
-    prod_costs = defaultdict(float)
-    for r in recipes:
-        prod_costs[r.product_id] += cost_map.get(r.ingredient_id, 0) * r.quantity
-    result = []
-    for prod_id, total_price, total_qty in stats:
-        avg_price = total_price / total_qty if total_qty else 0
-        fc = prod_costs.get(prod_id, 0)
-        margin = avg_price - fc
-        result.append({
-            "product_id": prod_id,
-            "avg_price": round(avg_price, 2),
-            "food_cost": round(fc, 2),
-            "margin": round(margin, 2)
-        })
-    return result
-
-@app.get("/riders/performance/", summary="Performance rider")
-def rider_performance(db: Session = Depends(get_db)):
+    async def compute():
+        if cost_basis == "sale":
+            rows = await crud_async.get_product_margins_at_sale(db, date_from=date_from, date_to=date_to)
+        else:
+            rows = await crud_async.get_product_margins(db, date_from=date_from, date_to=date_to)
+        result = []
+        for prod_id, total_price, total_qty, fc in rows:
+            avg_price = total_price / total_qty if total_qty else 0
+            margin = avg_price - fc
+            result.append({
+                "product_id": prod_id,
+                "avg_price": round(avg_price, 2),
+                "food_cost": round(fc, 2),
+                "margin": round(margin, 2)
+            })
+        return result
+    return await response_cache.respond(request, SALES_TABLES, compute)
+
+@protected.get("/riders/performance/", response_model=list[schemas.RiderPerformance], summary="Performance rider")
+async def rider_performance(
+    request: Request,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_read_db)
+):
     """
-    Statistiche per rider:
-    - numero consegne effettuate
+    Statistiche per rider (opzionalmente nel periodo [date_from, date_to)):
+    - numero consegne effettuate, incasso totale e pezzi consegnati
+    - ordini al giorno (sui giorni del periodo richiesto o tra prima e ultima consegna)
     - tempo medio consegna (da campo delivery_time)
     """
-    riders = crud.get_riders(db, skip=0, limit=1000)
-    orders = crud.get_orders(db, skip=0, limit=100000)
-    perf_map = {}
-    for rider in riders:
-        deliveries = [o for o in orders if o.rider_id == rider.id]
-        count = len(deliveries)
-        avg_time = rider.delivery_time if rider.delivery_time is not None else 0
-        perf_map[rider.id] = {
-            "rider_id": rider.id,
-            "name": rider.name,
-            "avg_time": round(avg_time, 2),
-            "deliveries": count
-        }
-    return list(perf_map.values())
+    async def compute():
+        result = []
+        for rider_id, name, delivery_time, count, revenue, items, first, last in \
+                await crud_async.get_rider_performance(db, date_from=date_from, date_to=date_to):
+            orders_per_day = 0.0
+            if count:
+                start = (date_from or first).date()
+                # date_to è escluso: l'ultimo giorno è quello dell'istante precedente
+                end = (date_to - timedelta(microseconds=1)).date() if date_to else last.date()
+                orders_per_day = count / max((end - start).days + 1, 1)
+            avg_time = delivery_time if delivery_time is not None else 0
+            result.append({
+                "rider_id": rider_id,
+                "name": name,
+                "avg_time": round(avg_time, 2),
+                "deliveries": count,
+                "total_revenue": round(revenue, 2),
+                "items_delivered": items,
+                "orders_per_day": round(orders_per_day, 2)
+            })
+        return result
+    return await response_cache.respond(request, ("orders", "riders"), compute)
+
+@protected.get("/dashboard/sales-timeseries", response_model=list[schemas.SalesPoint], summary="Serie temporale vendite")
+async def sales_timeseries(
+    request: Request,
+    granularity: Literal["hour", "day", "week"] = "day",
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    product_id: Optional[int] = None,
+    rider_id: Optional[int] = None,
+    cost_basis: Literal["sale", "current"] = "sale",
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """
+    Ordini, pezzi, incasso e food cost per prodotto e per ora/giorno/settimana
+    nell'intervallo [date_from, date_to), letti dai rollup pre-aggregati:
+    giornaliero per i giorni interi, orario per ore singole e spezzoni di giornata;
+    le frazioni d'ora agli estremi non allineati sono lette dagli ordini.
+    Il food cost usa i costi ingrediente in vigore al momento della vendita
+    (cost_basis=sale, come /products/margine-lordo/) oppure quelli attuali
+    (cost_basis=current).
+    """
+    async def compute():
+        rows = await crud_async.get_sales_timeseries(
+            db, granularity, date_from, date_to, product_id, rider_id, cost_basis
+        )
+        for row in rows:
+            row["revenue"] = round(row["revenue"], 2)
+            row["food_cost"] = round(row["food_cost"], 2)
+        return rows
+    return await response_cache.respond(request, SALES_TABLES, compute)
+
+@protected.get("/dashboard/consumption-variance", response_model=list[schemas.ConsumptionVariance], summary="Scostamento consumi")
+async def consumption_variance(
+    request: Request,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """
+    Consumo teorico (pezzi venduti x ricette) contro consumo reale (scarichi di
+    magazzino) per ingrediente nell'intervallo [date_from, date_to):
+    scostamento assoluto, percentuale e impatto economico al costo attuale.
+    Gli ingredienti con il maggiore eccesso di consumo sono in cima.
+    """
+    async def compute():
+        rows = await crud_async.get_consumption_variance(db, date_from, date_to)
+        for row in rows:
+            for key in ("theoretical", "actual", "variance", "cost_impact"):
+                row[key] = round(row[key], 3)
+            if row["variance_pct"] is not None:
+                row["variance_pct"] = round(row["variance_pct"], 2)
+        return rows
+    return await response_cache.respond(request, SALES_TABLES + ("inventory_movements",), compute)
+
+@protected.get("/dashboard/cache/stats")
+def response_cache_stats():
+    """Statistiche della cache delle risposte dashboard (hit rate, dimensione, evizioni, 304)."""
+    return response_cache.stats()
+
+# =========================================
+# AGGIORNAMENTI IN TEMPO REALE (SSE)
+# =========================================
+
+# Lo stream non sta sul router protected: si autentica da solo con
+# get_stream_tenant (header, cookie access_token o ticket di /live/ticket)
+live_stream = APIRouter()
+
+@live_stream.post("/live/ticket", response_model=schemas.StreamTicket, summary="Ticket per lo stream live")
+async def live_ticket(user: auth.CurrentUser = Depends(auth.get_current_user)):
+    """
+    Ticket a breve scadenza da passare come ?ticket= a /live/updates da
+    EventSource, che non può inviare l'header Authorization. Vale solo per
+    aprire lo stream: alla riconnessione dopo la scadenza serve un ticket nuovo.
+    """
+    return {"ticket": auth.create_stream_ticket(user), "expires_in": config.LIVE_TICKET_SECONDS}
+
+@live_stream.get("/live/updates", summary="Aggiornamenti dashboard in tempo reale (SSE)")
+async def live_updates(
+    topics: str = Query(",".join(live.TOPICS), description="Topic separati da virgola: products, riders, stock"),
+    stock_threshold: Optional[float] = Query(None, description="Segnala gli ingredienti che scendono sotto (o risalgono sopra) questa giacenza"),
+    tenant: str = Depends(auth.get_stream_tenant),
+):
+    """
+    Stream text/event-stream con un evento "update" al massimo ogni
+    LIVE_FLUSH_INTERVAL secondi, con i soli valori cambiati: margini e food
+    cost dei prodotti toccati (products), totali dei rider (riders), giacenze
+    e soglie superate (stock). "resync" chiede al client di ricaricare gli
+    endpoint completi.
+
+    Il token si passa nell'header Authorization oppure, dal browser (EventSource
+    non imposta header), nel cookie access_token o come ?ticket= ottenuto da
+    POST /live/ticket: il token di accesso non va mai nella URL.
+    """
+    requested = {t.strip() for t in topics.split(",") if t.strip()}
+    unknown = requested - set(live.TOPICS)
+    if unknown or not requested:
+        raise HTTPException(status_code=400, detail=f"topic non validi: {sorted(unknown)}; ammessi {list(live.TOPICS)}")
+    shard = await open_shard(tenant)
+    subscriber = live.hub.subscribe(shard.tenant, requested, stock_threshold)
+    return StreamingResponse(
+        live.stream(subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@protected.get("/live/stats")
+def live_stats():
+    """Connessioni aperte, aggiornamenti pubblicati e resync dello stream live."""
+    return live.hub.stats()
+
+app.include_router(protected)
+app.include_router(live_stream)
+
+# =========================================
+# ADMIN - REPORT SU TUTTI I TENANT
+# =========================================
+
+admin = APIRouter(prefix="/admin", dependencies=[Depends(auth.require_admin)] if config.AUTH_REQUIRED else [])
+
+@admin.get("/tenants/summary", summary="Riepilogo per ristorante")
+async def tenants_summary(
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_control_db)
+):
+    """
+    Ordini, incasso e anagrafiche di ogni tenant nell'intervallo [date_from, date_to),
+    con le query dei diversi database eseguite in parallelo (al massimo
+    TENANT_ADMIN_CONCURRENCY alla volta) e i totali complessivi.
+    Un tenant in errore non blocca gli altri: compare in errors.
+    """
+    tenants = await db.run_sync(tenancy.known_tenants)
+    limiter = CapacityLimiter(config.TENANT_ADMIN_CONCURRENCY)
+
+    async def summary(tenant):
+        try:
+            return await to_thread.run_sync(tenancy.tenant_summary, tenant, date_from, date_to, limiter=limiter)
+        except Exception as exc:
+            return {"tenant": tenant, "error": str(exc)}
+
+    results = await asyncio.gather(*(summary(t) for t in tenants))
+    rows = [r for r in results if "error" not in r]
+    return {
+        "tenants": rows,
+        "errors": [r for r in results if "error" in r],
+        "totals": {
+            key: sum(r[key] for r in rows)
+            for key in ("orders", "revenue", "products", "ingredients", "riders")
+        },
+    }
+
+@admin.get("/tenants/engines")
+def tenant_engines():
+    """Tenant con engine aperti nell'LRU, aperture ed evizioni."""
+    return tenancy.registry.stats()
+
+app.include_router(admin)
 
 # Fine file
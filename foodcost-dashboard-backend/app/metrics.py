@@ -0,0 +1,216 @@
+"""
+Metriche delle richieste HTTP e delle query SQL, in formato testo Prometheus.
+
+MetricsMiddleware è un middleware ASGI puro (niente BaseHTTPMiddleware, che
+bufferizza le risposte in streaming): per ogni richiesta misura la durata
+fino all'ultimo byte del body e la registra in un istogramma per metodo,
+template della route (es. /orders/{order_id}, non l'URL: cardinalità
+limitata) e status.
+
+Le query sono contate con gli eventi before/after_cursor_execute sugli
+engine di database.py (sync e async, scritture e letture). Il conteggio va
+nelle statistiche della richiesta corrente, tenute in una ContextVar: il
+contesto viene copiato nei thread degli endpoint sync e nei greenlet di
+SQLAlchemy async, quindi le query di qualsiasi endpoint finiscono nella
+richiesta giusta. Le query fuori da una richiesta (avvio, migrazioni, CLI)
+vanno in un contatore a parte.
+
+Ogni risposta ha un header Server-Timing con tempo totale, tempo e numero di
+query SQL fino all'invio degli header: un endpoint N+1 (una query per riga)
+si riconosce subito dal browser. /metrics espone istogrammi di durata e di
+query per richiesta e il tempo SQL totale per route.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+# route non trovata (404): un'etichetta unica invece dell'URL richiesto
+UNMATCHED = "<unmatched>"
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    """Istogramma cumulativo per etichette, come il tipo histogram di Prometheus."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.series: Dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            # conteggi per bucket (+Inf in coda), somma, numero di osservazioni
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+
+_lock = threading.Lock()
+request_duration = Histogram(DURATION_BUCKETS)
+request_queries = Histogram(QUERY_BUCKETS)
+db_seconds: Dict[tuple, float] = defaultdict(float)
+queries_outside_requests = 0
+
+
+# -----------------
+# SQL
+# -----------------
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    global queries_outside_requests
+    started = conn.info["query_started"].pop()
+    stats = _current.get()
+    if stats is None:
+        queries_outside_requests += 1
+        return
+    stats.queries += 1
+    stats.db_seconds += time.perf_counter() - started
+
+
+def _handle_error(exception_context):
+    # la query fallita non arriva ad after_cursor_execute: toglie il suo inizio
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_started"):
+        conn.info["query_started"].pop()
+
+
+def instrument(*engines) -> None:
+    """Aggancia il conteggio delle query agli engine (sync, o .sync_engine degli async)."""
+    for engine in set(engines):
+        engine = getattr(engine, "sync_engine", engine)
+        if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+            continue
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+# -----------------
+# MIDDLEWARE
+# -----------------
+def _route_template(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED
+
+
+def _server_timing(total: float, stats: RequestStats) -> bytes:
+    return (
+        f'app;dur={total * 1000:.1f}, '
+        f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.queries} queries"'
+    ).encode("latin-1")
+
+
+def record(method: str, route: str, status: int, seconds: float, stats: RequestStats) -> None:
+    with _lock:
+        request_duration.observe((method, route, str(status)), seconds)
+        request_queries.observe((method, route), stats.queries)
+        db_seconds[(method, route)] += stats.db_seconds
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", _server_timing(time.perf_counter() - started, stats)))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            record(scope["method"], _route_template(scope), status, time.perf_counter() - started, stats)
+            _current.reset(token)
+
+
+# -----------------
+# ESPOSIZIONE
+# -----------------
+def _labels(names: Sequence[str], values: Sequence[str], extra: Tuple[str, str] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_bound(bound: float) -> str:
+    return repr(float(bound))
+
+
+def _histogram_lines(name: str, help_text: str, histogram: Histogram, label_names: Sequence[str]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for labels, (counts, total, count) in sorted(histogram.series.items()):
+        cumulative = 0
+        for bound, n in zip((*histogram.buckets, None), counts):
+            cumulative += n
+            le = "+Inf" if bound is None else _format_bound(bound)
+            lines.append(f"{name}_bucket{_labels(label_names, labels, ('le', le))} {cumulative}")
+        lines.append(f"{name}_sum{_labels(label_names, labels)} {total}")
+        lines.append(f"{name}_count{_labels(label_names, labels)} {count}")
+    return lines
+
+
+def render() -> str:
+    """Tutte le metriche in formato testo Prometheus (text/plain; version=0.0.4)."""
+    with _lock:
+        lines = _histogram_lines(
+            "http_request_duration_seconds", "Durata delle richieste HTTP fino all'ultimo byte della risposta.",
+            request_duration, ("method", "route", "status"),
+        )
+        lines += _histogram_lines(
+            "http_request_db_queries", "Query SQL eseguite per richiesta.",
+            request_queries, ("method", "route"),
+        )
+        lines += [
+            "# HELP http_request_db_seconds_total Tempo speso in query SQL, per route.",
+            "# TYPE http_request_db_seconds_total counter",
+        ]
+        lines += [
+            f"http_request_db_seconds_total{_labels(('method', 'route'), labels)} {seconds}"
+            for labels, seconds in sorted(db_seconds.items())
+        ]
+        lines += [
+            "# HELP db_queries_outside_requests_total Query SQL eseguite fuori da una richiesta HTTP.",
+            "# TYPE db_queries_outside_requests_total counter",
+            f"db_queries_outside_requests_total {queries_outside_requests}",
+        ]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,187 @@
+"""
+Migrazioni di schema versionate.
+
+I file SQLite esistenti vengono aggiornati sul posto: la tabella
+schema_migrations registra le versioni già applicate e upgrade() esegue, in
+ordine e ognuna nella propria transazione, solo quelle mancanti.
+
+Create_all crea le tabelle nuove ma non tocca quelle esistenti (indici e
+colonne aggiunti dopo vanno quindi portati da una migrazione). Le migrazioni
+devono essere idempotenti, perché su un database nuovo create_all ha già
+creato lo schema corrente.
+"""
+
+from datetime import datetime
+from typing import Callable, List, NamedTuple, Optional
+
+from sqlalchemy import MetaData, bindparam, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateTable
+
+from .core import config
+from .database import Base
+from . import cost_history, models, rollups, search, stock
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[Connection], None]
+
+
+def _create_indexes(conn: Connection, *tables) -> None:
+    for table in tables:
+        # gli indici su colonne aggiunte da migrazioni successive li crea quella migrazione
+        existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+        for index in table.indexes:
+            if all(c.name in existing for c in index.columns):
+                index.create(conn, checkfirst=True)
+
+
+# -----------------
+# MIGRAZIONI
+# -----------------
+def _initial_schema(conn: Connection) -> None:
+    Base.metadata.create_all(bind=conn)
+
+
+def _analytical_indexes(conn: Connection) -> None:
+    # indici composti scelti per i filtri/aggregati della dashboard:
+    # (product_id, timestamp) e (rider_id, timestamp) su orders,
+    # (ingredient_id, timestamp) sui movimenti, product/ingredient sulle ricette
+    _create_indexes(
+        conn,
+        models.Order.__table__,
+        models.Recipe.__table__,
+        models.InventoryMovement.__table__,
+    )
+    conn.execute(text("ANALYZE"))
+
+
+def _sales_rollups(conn: Connection) -> None:
+    # le tabelle sono già create da create_all: qui si popolano dagli ordini esistenti
+    rollups.rebuild(conn)
+
+
+def _movement_type_enum(conn: Connection) -> None:
+    # movement_type era testo libero: si normalizza e si rifiuta ciò che non è carico/scarico
+    conn.execute(text(
+        "UPDATE inventory_movements SET movement_type = lower(trim(movement_type)) "
+        "WHERE movement_type IS NOT NULL"
+    ))
+    allowed = [m.value for m in models.MovementType]
+    invalid = conn.execute(
+        text(
+            "SELECT id FROM inventory_movements "
+            "WHERE movement_type IS NOT NULL AND movement_type NOT IN :allowed LIMIT 20"
+        ).bindparams(bindparam("allowed", expanding=True)),
+        {"allowed": allowed},
+    ).scalars().all()
+    if invalid:
+        raise RuntimeError(
+            f"movement_type non valido per i movimenti {invalid}: "
+            f"valori ammessi {allowed}. Correggili e rilancia la migrazione."
+        )
+    stock.rebuild(conn)
+
+
+def _users_tenant(conn: Connection) -> None:
+    # gli utenti esistenti appartengono al tenant di default (i dati già in questo database)
+    columns = {c["name"] for c in inspect(conn).get_columns("users")}
+    if "tenant" not in columns:
+        default = config.DEFAULT_TENANT.replace("'", "''")  # DDL: niente parametri
+        conn.execute(text(f"ALTER TABLE users ADD COLUMN tenant VARCHAR NOT NULL DEFAULT '{default}'"))
+    _create_indexes(conn, models.User.__table__)
+
+
+def _recipe_components(conn: Connection) -> None:
+    columns = {c["name"] for c in inspect(conn).get_columns("recipes")}
+    if "component_product_id" not in columns:
+        conn.execute(text("ALTER TABLE recipes ADD COLUMN component_product_id INTEGER REFERENCES products (id)"))
+    _create_indexes(conn, models.Recipe.__table__)
+
+
+def _ingredient_cost_history(conn: Connection) -> None:
+    # tabella creata da create_all: prima versione dei costi attuali, valida da sempre
+    cost_history.backfill(conn)
+
+
+def _name_search(conn: Connection) -> None:
+    # indici FTS5 trigram sui nomi, con i trigger che li tengono allineati;
+    # senza FTS5 trigram la ricerca resta sul LIKE (vedi app.search)
+    search.create_indexes(conn)
+
+
+def _import_jobs(conn: Connection) -> None:
+    # tabella creata da create_all (coda degli import in background, vedi app.jobs)
+    _create_indexes(conn, models.ImportJob.__table__)
+
+
+def _revoked_tokens(conn: Connection) -> None:
+    # tabella creata da create_all (revoche dei token condivise tra i worker, vedi core.auth)
+    _create_indexes(conn, models.RevokedToken.__table__)
+
+
+def _movement_type_check(conn: Connection) -> None:
+    # la migrazione 4 normalizza i dati ma SQLite non aggiunge vincoli a una
+    # tabella esistente: la si ricostruisce (copia e rinomina) con il CHECK
+    # dell'enum, come la crea create_all sui database nuovi
+    ddl = conn.execute(text(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'inventory_movements'"
+    )).scalar()
+    if ddl is None or "CHECK" in ddl.upper():
+        return
+    table = models.InventoryMovement.__table__
+    metadata = MetaData()
+    models.Ingredient.__table__.to_metadata(metadata)  # destinazione della foreign key
+    rebuilt = table.to_metadata(metadata, name="_inventory_movements_new")
+    conn.execute(CreateTable(rebuilt))
+    columns = ", ".join(c.name for c in table.columns)
+    conn.execute(text(f"INSERT INTO {rebuilt.name} ({columns}) SELECT {columns} FROM {table.name}"))
+    conn.execute(text(f"DROP TABLE {table.name}"))
+    conn.execute(text(f"ALTER TABLE {rebuilt.name} RENAME TO {table.name}"))
+    _create_indexes(conn, table)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "schema iniziale", _initial_schema),
+    Migration(2, "indici analitici su ordini, ricette e magazzino", _analytical_indexes),
+    Migration(3, "rollup vendite orari e giornalieri", _sales_rollups),
+    Migration(4, "movement_type come enum e giacenze per ingrediente", _movement_type_enum),
+    Migration(5, "tenant degli utenti", _users_tenant),
+    Migration(6, "semilavorati nelle ricette", _recipe_components),
+    Migration(7, "storico dei costi ingrediente", _ingredient_cost_history),
+    Migration(8, "indici di ricerca trigram su ingredienti e prodotti", _name_search),
+    Migration(9, "coda degli import CSV in background", _import_jobs),
+    Migration(10, "token revocati", _revoked_tokens),
+    Migration(11, "vincolo CHECK su movement_type nei database esistenti", _movement_type_check),
+]
+
+
+def current_version(conn: Connection) -> int:
+    if not inspect(conn).has_table(models.SchemaMigration.__tablename__):
+        return 0
+    version = models.SchemaMigration.__table__.c.version
+    return conn.execute(select(func.coalesce(func.max(version), 0))).scalar()
+
+
+def upgrade(engine: Engine, target: Optional[int] = None) -> List[Migration]:
+    """Applica le migrazioni pendenti fino a target (default: l'ultima). Restituisce quelle applicate."""
+    with engine.begin() as conn:
+        Base.metadata.create_all(bind=conn)
+        version = current_version(conn)
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= version or (target is not None and migration.version > target):
+            continue
+        with engine.begin() as conn:
+            migration.apply(conn)
+            conn.execute(
+                models.SchemaMigration.__table__.insert().values(
+                    version=migration.version,
+                    description=migration.description,
+                    applied_at=datetime.utcnow(),
+                )
+            )
+        applied.append(migration)
+    return applied
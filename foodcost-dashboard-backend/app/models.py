@@ -1,7 +1,10 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+import enum
+
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Index, Enum, UniqueConstraint, Boolean, JSON
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from sqlalchemy import func
+from .core import config
 from .database import Base
 
 
@@ -10,8 +13,18 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
+    # ristorante dell'utente: i suoi dati stanno nel database di quel tenant
+    tenant = Column(String, nullable=False, index=True, default=config.DEFAULT_TENANT,
+                    server_default=config.DEFAULT_TENANT)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+class RevokedToken(Base):
+    """Token revocati con /auth/logout, fino alla loro scadenza (vedi core.auth)."""
+    __tablename__ = "revoked_tokens"
+    token_hash = Column(String, primary_key=True)  # sha256 del JWT
+    user_id = Column(Integer, index=True)
+    expires_at = Column(DateTime, index=True)
+
 class Ingredient(Base):
     __tablename__ = "ingredients"
 
@@ -30,9 +43,19 @@ class Recipe(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     product_id = Column(Integer, ForeignKey("products.id"))
+    # una riga usa un ingrediente oppure un altro prodotto come semilavorato
     ingredient_id = Column(Integer, ForeignKey("ingredients.id"))
+    component_product_id = Column(Integer, ForeignKey("products.id"))
     quantity = Column(Float)
 
+    __table_args__ = (
+        Index("ix_recipes_product_ingredient", "product_id", "ingredient_id"),
+        # indice inverso ingrediente -> prodotti, usato per aggiornare il food cost
+        Index("ix_recipes_ingredient_product", "ingredient_id", "product_id"),
+        # indice inverso semilavorato -> prodotti, per risalire agli antenati nel DAG
+        Index("ix_recipes_component_product", "component_product_id", "product_id"),
+    )
+
 class Order(Base):
     __tablename__ = "orders"
 
@@ -43,18 +66,154 @@ class Order(Base):
     rider_id = Column(Integer, ForeignKey("riders.id"))
     price = Column(Float)
 
+    __table_args__ = (
+        Index("ix_orders_timestamp", "timestamp"),
+        Index("ix_orders_product_timestamp", "product_id", "timestamp"),
+        Index("ix_orders_rider_timestamp", "rider_id", "timestamp"),
+    )
+
+class MovementType(str, enum.Enum):
+    CARICO = "carico"
+    SCARICO = "scarico"
+
 class InventoryMovement(Base):
     __tablename__ = "inventory_movements"
 
     id = Column(Integer, primary_key=True, index=True)
     ingredient_id = Column(Integer, ForeignKey("ingredients.id"))
     quantity = Column(Float)
-    movement_type = Column(String)  # "carico" / "scarico"
+    movement_type = Column(Enum(
+        MovementType,
+        name="movement_type",
+        native_enum=False,
+        create_constraint=True,
+        length=16,
+        values_callable=lambda e: [m.value for m in e],
+    ))
     timestamp = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_inventory_movements_timestamp", "timestamp"),
+        Index("ix_inventory_movements_ingredient_timestamp", "ingredient_id", "timestamp"),
+    )
+
 class Rider(Base):
     __tablename__ = "riders"
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True)
     delivery_time = Column(Float)  # tempo medio consegna
+
+class ProductFoodCost(Base):
+    """Food cost materializzato per prodotto, mantenuto da app.food_cost."""
+    __tablename__ = "product_food_cost"
+
+    product_id = Column(Integer, primary_key=True)
+    food_cost = Column(Float, nullable=False, default=0)
+
+class SchemaMigration(Base):
+    """Versioni di schema applicate da app.migrations."""
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True)
+    description = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+class _SalesRollup:
+    """Colonne comuni dei rollup vendite, mantenuti da app.rollups."""
+    bucket = Column(DateTime, primary_key=True)
+    product_id = Column(Integer, primary_key=True)  # 0 = nessun prodotto
+    rider_id = Column(Integer, primary_key=True)    # 0 = nessun rider
+    order_count = Column(Integer, nullable=False, default=0)
+    quantity = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0)
+
+class SalesRollupHourly(_SalesRollup, Base):
+    __tablename__ = "sales_rollup_hourly"
+
+class SalesRollupDaily(_SalesRollup, Base):
+    __tablename__ = "sales_rollup_daily"
+
+class IngredientStock(Base):
+    """Giacenza corrente per ingrediente, mantenuta da app.stock."""
+    __tablename__ = "ingredient_stock"
+
+    ingredient_id = Column(Integer, primary_key=True)
+    quantity = Column(Float, nullable=False, default=0)
+    last_movement_at = Column(DateTime)
+    movements_since_snapshot = Column(Integer, nullable=False, default=0)
+
+class StockSnapshot(Base):
+    """Giacenza di un ingrediente a un certo istante (movimenti con timestamp <= taken_at)."""
+    __tablename__ = "stock_snapshots"
+
+    id = Column(Integer, primary_key=True)
+    ingredient_id = Column(Integer, nullable=False)
+    taken_at = Column(DateTime, nullable=False)
+    quantity = Column(Float, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("ingredient_id", "taken_at", name="uq_stock_snapshots_ingredient_taken_at"),
+    )
+
+class IngredientCostHistory(Base):
+    """
+    Versioni del costo unitario di un ingrediente (append-only, vedi app.cost_history):
+    ogni versione vale da valid_from fino al valid_from della successiva.
+    """
+    __tablename__ = "ingredient_cost_history"
+
+    id = Column(Integer, primary_key=True)
+    ingredient_id = Column(Integer, nullable=False)
+    unit_cost = Column(Float)  # NULL: ingrediente eliminato
+    valid_from = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_ingredient_cost_history_ingredient_valid_from", "ingredient_id", "valid_from"),
+        Index("ix_ingredient_cost_history_valid_from", "valid_from"),
+    )
+
+class JobStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+class ImportJob(Base):
+    """
+    Import CSV in background (vedi app.jobs): è la coda dei job e il loro
+    checkpoint, aggiornato nella stessa transazione delle righe importate.
+    """
+    __tablename__ = "import_jobs"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    status = Column(Enum(
+        JobStatus,
+        name="job_status",
+        native_enum=False,
+        create_constraint=True,
+        length=16,
+        values_callable=lambda e: [m.value for m in e],
+    ), nullable=False, default=JobStatus.QUEUED)
+    filename = Column(String)
+    path = Column(String, nullable=False)  # file caricato, relativo a IMPORT_JOB_DIR/<tenant>
+    total_bytes = Column(Integer, nullable=False, default=0)
+    bytes_done = Column(Integer, nullable=False, default=0)
+    rows_done = Column(Integer, nullable=False, default=0)  # righe del CSV già elaborate (checkpoint)
+    inserted = Column(Integer, nullable=False, default=0)
+    updated = Column(Integer, nullable=False, default=0)
+    rejected = Column(Integer, nullable=False, default=0)
+    errors = Column(JSON, nullable=False, default=list)  # [{line, error}], al più MAX_REPORTED_ERRORS
+    error = Column(String)  # motivo del fallimento dell'intero job
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_import_jobs_status_heartbeat", "status", "heartbeat_at"),
+    )
@@ -0,0 +1,79 @@
+"""
+Paginazione keyset (a cursore) per gli endpoint di lista.
+
+Invece di OFFSET, che obbliga il database a scorrere e scartare tutte le righe
+delle pagine precedenti, ogni pagina riparte dalla chiave dell'ultima riga
+restituita: WHERE (timestamp, id) > (:ts, :id) ORDER BY timestamp, id LIMIT n,
+che su un indice costa come la prima pagina.
+
+Il cursore è opaco per il client: la chiave dell'ultima riga serializzata in
+JSON e codificata base64 url-safe.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import DateTime, bindparam, tuple_
+from sqlalchemy.orm import Query
+
+
+def encode_cursor(values: Sequence) -> str:
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _matches(column, value) -> bool:
+    """Il valore JSON ha il tipo Python della colonna (gli interi valgono anche per i float)."""
+    try:
+        expected = column.type.python_type
+    except NotImplementedError:
+        return not isinstance(value, (list, dict))
+    if expected is float:
+        expected = (int, float)
+    return isinstance(value, expected) and not isinstance(value, bool)
+
+
+def decode_cursor(cursor: str, columns: Sequence) -> list:
+    """Decodifica il cursore per le colonne chiave; ValueError se non valido."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as exc:
+        raise ValueError("cursore non valido") from exc
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError("cursore non valido")
+    decoded = []
+    for column, value in zip(columns, values):
+        if isinstance(column.type, DateTime) and value is not None:
+            try:
+                value = datetime.fromisoformat(value)
+            except (ValueError, TypeError) as exc:
+                raise ValueError("cursore non valido") from exc
+        elif value is not None and not _matches(column, value):
+            raise ValueError("cursore non valido")
+        decoded.append(value)
+    return decoded
+
+
+def keyset_page(query: Query, columns: Sequence, cursor: Optional[str], limit: int) -> Tuple[List, Optional[str]]:
+    """
+    Restituisce (righe, next_cursor) ordinando per columns (l'ultima deve essere
+    la chiave primaria). next_cursor è None sull'ultima pagina.
+    """
+    if limit < 1:
+        raise ValueError("limit deve essere almeno 1")
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        keys = [bindparam(None, v, type_=c.type) for c, v in zip(columns, values)]
+        if len(columns) == 1:
+            query = query.filter(columns[0] > keys[0])
+        else:
+            query = query.filter(tuple_(*columns) > tuple_(*keys))
+    rows = query.order_by(*columns).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor([getattr(last, c.key) for c in columns])
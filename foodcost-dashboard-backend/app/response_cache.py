@@ -0,0 +1,140 @@
+"""
+Cache delle risposte degli endpoint dashboard, invalidata per versione di tabella.
+
+Ogni tabella ha un contatore di versione in memoria, incrementato al commit di
+qualsiasi sessione che l'abbia modificata: gli oggetti ORM scritti sono letti
+in after_flush, gli INSERT/UPDATE/DELETE eseguiti con session.execute (bulk,
+import, tabelle materializzate) in do_orm_execute. Così tutte le scritture di
+crud, bulk e importers aggiornano le versioni senza codice dedicato, e un
+rollback le lascia invariate.
+
+Con più tenant (un database per ristorante) le versioni sono per coppia
+(tenant, tabella): il tenant della sessione arriva da session.info, quello
+della richiesta da request.state.tenant (impostato da auth.get_tenant).
+
+Una risposta in cache è identificata da tenant + endpoint + query string e
+vale finché non cambia la versione delle tabelle da cui dipende. L'ETag è derivato dalle
+sole versioni: una richiesta con If-None-Match ancora valido riceve 304 senza
+lavoro sul database né serializzazione. La cache è un LRU limitato a
+RESPONSE_CACHE_SIZE risposte (core.cache.TTLCache, senza scadenza).
+
+I contatori sono del singolo processo: con più worker ogni processo vede
+solo le proprie scritture, quindi va usato con un solo worker o con scritture
+che passano dallo stesso processo (come nel deploy SQLite attuale).
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Sequence
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .core import config
+from .core.cache import TTLCache
+
+cache = TTLCache(maxsize=config.RESPONSE_CACHE_SIZE)
+not_modified = 0
+
+# cambia a ogni avvio: gli ETag di un processo precedente non sono mai validi
+_EPOCH = os.urandom(8).hex()
+_versions: Dict[tuple, int] = defaultdict(int)
+_lock = threading.Lock()
+
+
+# -----------------
+# VERSIONI DELLE TABELLE
+# -----------------
+def bump(tables: Iterable[str], tenant: str = config.DEFAULT_TENANT) -> None:
+    with _lock:
+        for table in tables:
+            _versions[(tenant, table)] += 1
+
+
+def versions(tables: Sequence[str], tenant: str = config.DEFAULT_TENANT) -> tuple:
+    with _lock:
+        return tuple(_versions[(tenant, t)] for t in tables)
+
+
+def _pending(session: Session) -> set:
+    return session.info.setdefault("written_tables", set())
+
+
+def _tenant(session: Session) -> str:
+    return session.info.get("tenant", config.DEFAULT_TENANT)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flush(session, flush_context):
+    pending = _pending(session)
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(obj, "__tablename__", None)
+        if table:
+            pending.add(table)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_execute(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        table = getattr(state.statement, "table", None)
+        if table is not None and getattr(table, "name", None):
+            _pending(state.session).add(table.name)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_on_commit(session):
+    tables = session.info.pop("written_tables", None)
+    if tables:
+        bump(tables, _tenant(session))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("written_tables", None)
+
+
+# -----------------
+# RISPOSTE
+# -----------------
+def _etag(key: tuple, current: tuple) -> str:
+    digest = hashlib.blake2b(repr((_EPOCH, key, current)).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def _matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+async def respond(request: Request, tables: Sequence[str], compute: Callable[[], Awaitable[Any]]) -> Response:
+    """
+    Risposta JSON per l'endpoint corrente, dalla cache se le tabelle indicate
+    non sono cambiate; altrimenti chiama compute() e salva il risultato.
+    """
+    global not_modified
+    tenant = getattr(request.state, "tenant", config.DEFAULT_TENANT)
+    key = (tenant, request.url.path, tuple(sorted(request.query_params.multi_items())))
+    etag = _etag(key, versions(tables, tenant))
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _matches(request, etag):
+        not_modified += 1
+        return Response(status_code=304, headers=headers)
+
+    # l'ETag cambia con le versioni: le voci superate non vengono più lette ed escono per LRU
+    body = cache.get(etag)
+    if body is None:
+        data = await compute()
+        body = json.dumps(jsonable_encoder(data), separators=(",", ":")).encode("utf-8")
+        cache.set(etag, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def stats() -> dict:
+    return dict(cache.stats(), not_modified=not_modified)
@@ -0,0 +1,345 @@
+"""
+Rollup delle vendite per fascia oraria e giornaliera.
+
+Le tabelle sales_rollup_hourly e sales_rollup_daily contengono, per ogni
+bucket temporale, prodotto e rider, numero di ordini, pezzi venduti e
+incasso. Vengono aggiornate in modo incrementale dalle funzioni di scrittura
+degli ordini in crud (e quindi anche dagli import CSV), così le serie
+temporali della dashboard non devono più scandire la tabella orders: la
+leggono solo per le frazioni d'ora agli estremi di un intervallo non
+allineato all'ora, così le letture rispettano sempre [date_from, date_to).
+
+Ordini senza rider (o senza prodotto) sono registrati con id 0, perché la
+chiave primaria composta non può contenere NULL.
+
+Come per food_cost, le funzioni di aggiornamento non fanno commit: lavorano
+nella transazione di chi le chiama. rebuild() usa solo statement Core, quindi
+accetta sia una Session sia una Connection (usata dalle migrazioni).
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+
+from sqlalchemy import DateTime, Integer, func, literal, select, type_coerce
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from . import cost_history, models
+
+HOURLY = models.SalesRollupHourly.__table__
+DAILY = models.SalesRollupDaily.__table__
+ORDERS = models.Order.__table__
+
+# stesso formato con cui SQLAlchemy salva i DateTime su SQLite
+_BUCKET_FORMATS = {
+    HOURLY: "%Y-%m-%d %H:00:00.000000",
+    DAILY: "%Y-%m-%d 00:00:00.000000",
+}
+
+GRANULARITIES = ("hour", "day", "week")
+
+
+def floor_hour(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def floor_day(ts: datetime) -> datetime:
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def floor_week(ts: datetime) -> datetime:
+    """Lunedì della settimana di ts."""
+    return floor_day(ts) - timedelta(days=ts.weekday())
+
+
+def _ceil(ts: datetime, floor, step: timedelta) -> datetime:
+    start = floor(ts)
+    return start if start == ts else start + step
+
+
+_FLOORS = {HOURLY: floor_hour, DAILY: floor_day}
+
+
+# -----------------
+# AGGIORNAMENTO INCREMENTALE
+# -----------------
+def _deltas(orders: Iterable[dict], floor, sign: int) -> dict:
+    totals = defaultdict(lambda: [0, 0, 0.0])
+    for o in orders:
+        if o.get("timestamp") is None:
+            continue
+        key = (floor(o["timestamp"]), o.get("product_id") or 0, o.get("rider_id") or 0)
+        row = totals[key]
+        row[0] += sign
+        row[1] += sign * (o.get("quantity") or 0)
+        row[2] += sign * (o.get("price") or 0.0)
+    return totals
+
+
+def _upsert(db: Session, table, deltas: dict) -> None:
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.bucket, table.c.product_id, table.c.rider_id],
+        set_={
+            "order_count": table.c.order_count + stmt.excluded.order_count,
+            "quantity": table.c.quantity + stmt.excluded.quantity,
+            "revenue": table.c.revenue + stmt.excluded.revenue,
+        },
+    )
+    db.execute(stmt, [
+        {"bucket": b, "product_id": p, "rider_id": r, "order_count": c, "quantity": q, "revenue": rev}
+        for (b, p, r), (c, q, rev) in deltas.items()
+    ])
+
+
+def apply_orders(db: Session, orders: List[dict], sign: int = 1) -> None:
+    """
+    Somma (sign=1) o sottrae (sign=-1) gli ordini ai rollup. orders sono dict
+    con timestamp, product_id, rider_id, quantity e price.
+    """
+    for table, floor in _FLOORS.items():
+        deltas = _deltas(orders, floor, sign)
+        if not deltas:
+            continue
+        _upsert(db, table, deltas)
+        if sign < 0:
+            buckets = {b for b, _, _ in deltas}
+            db.execute(table.delete().where(table.c.bucket.in_(buckets), table.c.order_count <= 0))
+
+
+def order_values(order: models.Order) -> dict:
+    return {
+        "timestamp": order.timestamp,
+        "product_id": order.product_id,
+        "rider_id": order.rider_id,
+        "quantity": order.quantity,
+        "price": order.price,
+    }
+
+
+# -----------------
+# RICOSTRUZIONE
+# -----------------
+def rebuild(db, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None) -> int:
+    """
+    Ricalcola i rollup dagli ordini (non fa commit). Con date_from/date_to
+    ricostruisce solo i giorni interessati (backfill), altrimenti tutto.
+    Restituisce il numero di righe giornaliere scritte.
+    """
+    lo = floor_day(date_from) if date_from else None
+    hi = _ceil(date_to, floor_day, timedelta(days=1)) if date_to else None
+    Order = models.Order.__table__
+    written = 0
+    for table, fmt in _BUCKET_FORMATS.items():
+        delete = table.delete()
+        query = _source_query(fmt)
+        if lo is not None:
+            delete = delete.where(table.c.bucket >= lo)
+            query = query.where(Order.c.timestamp >= lo)
+        if hi is not None:
+            delete = delete.where(table.c.bucket < hi)
+            query = query.where(Order.c.timestamp < hi)
+        db.execute(delete)
+        written = db.execute(table.insert().from_select(
+            ["bucket", "product_id", "rider_id", "order_count", "quantity", "revenue"], query
+        )).rowcount
+    return written
+
+
+def _source_query(fmt: str):
+    """Righe (bucket, product_id, rider_id, ordini, pezzi, incasso) calcolate dagli ordini."""
+    Order = models.Order.__table__
+    keys = (
+        func.strftime(fmt, Order.c.timestamp),
+        func.coalesce(Order.c.product_id, 0),
+        func.coalesce(Order.c.rider_id, 0),
+    )
+    return (
+        select(
+            *keys,
+            func.count(),
+            func.coalesce(func.sum(Order.c.quantity), 0),
+            func.coalesce(func.sum(Order.c.price), 0.0),
+        )
+        .where(Order.c.timestamp.isnot(None))
+        .group_by(*keys)
+    )
+
+
+def check_consistency(db: Session, tolerance: float = 1e-6) -> List[dict]:
+    """Confronta i rollup orari e giornalieri con un ricalcolo dagli ordini."""
+    mismatches = []
+    for table, fmt in _BUCKET_FORMATS.items():
+        expected = {(b, p, r): (c, q, rev) for b, p, r, c, q, rev in db.execute(_source_query(fmt))}
+        stored = {
+            (b.strftime(fmt), p, r): (c, q, rev)
+            for b, p, r, c, q, rev in db.execute(select(
+                table.c.bucket, table.c.product_id, table.c.rider_id,
+                table.c.order_count, table.c.quantity, table.c.revenue,
+            ))
+        }
+        for key in sorted(expected.keys() | stored.keys()):
+            exp, got = expected.get(key), stored.get(key)
+            if exp is None or got is None or exp[:2] != got[:2] or abs(exp[2] - got[2]) > tolerance:
+                mismatches.append({"table": table.name, "key": key, "stored": got, "expected": exp})
+    return mismatches
+
+
+# -----------------
+# LETTURE DASHBOARD
+# -----------------
+def _rollup_segments(granularity: str, lo: Optional[datetime], hi: Optional[datetime]):
+    """Segmenti dei rollup per un intervallo con estremi allineati all'ora."""
+    if granularity == "hour":
+        return [(HOURLY, lo, hi)]
+    day_lo = _ceil(lo, floor_day, timedelta(days=1)) if lo else None
+    day_hi = floor_day(hi) if hi else None
+    if day_lo is not None and day_hi is not None and day_lo >= day_hi:
+        return [(HOURLY, lo, hi)]
+    segments = []
+    if lo is not None and lo < day_lo:
+        segments.append((HOURLY, lo, day_lo))
+    segments.append((DAILY, day_lo, day_hi))
+    if hi is not None and day_hi < hi:
+        segments.append((HOURLY, day_hi, hi))
+    return segments
+
+
+def plan_segments(granularity: str, date_from: Optional[datetime], date_to: Optional[datetime]):
+    """
+    Sceglie da dove leggere l'intervallo [date_from, date_to): la tabella
+    giornaliera per i giorni interi, quella oraria per le ore intere degli
+    spezzoni iniziale e finale (o per tutto, se la granularità è oraria) e
+    la tabella orders (range scan sull'indice del timestamp) per le frazioni
+    d'ora agli estremi non allineati. Restituisce una lista (tabella, da, a).
+    """
+    lo, hi = date_from, date_to
+    if lo is not None and hi is not None and lo >= hi:
+        return []
+    head = _ceil(lo, floor_hour, timedelta(hours=1)) if lo is not None else None
+    tail = floor_hour(hi) if hi is not None else None
+    if head is not None and tail is not None and head > tail:
+        # estremi nella stessa ora
+        return [(ORDERS, lo, hi)]
+    segments = []
+    if lo is not None and lo < head:
+        segments.append((ORDERS, lo, head))
+    if head is None or tail is None or head < tail:
+        segments.extend(_rollup_segments(granularity, head, tail))
+    if hi is not None and tail < hi:
+        segments.append((ORDERS, tail, hi))
+    return segments
+
+
+def _source(table, lo: Optional[datetime], hi: Optional[datetime]):
+    """
+    Righe nel formato dei rollup (bucket, product_id, rider_id, order_count,
+    quantity, revenue) del segmento [lo, hi): dalla tabella di rollup oppure,
+    per le frazioni d'ora, un ordine per riga dalla tabella orders.
+    """
+    if table is ORDERS:
+        column = ORDERS.c.timestamp
+        query = select(
+            type_coerce(func.strftime(_BUCKET_FORMATS[HOURLY], column), DateTime).label("bucket"),
+            func.coalesce(ORDERS.c.product_id, 0).label("product_id"),
+            func.coalesce(ORDERS.c.rider_id, 0).label("rider_id"),
+            literal(1, Integer).label("order_count"),
+            func.coalesce(ORDERS.c.quantity, 0).label("quantity"),
+            func.coalesce(ORDERS.c.price, 0.0).label("revenue"),
+        ).where(column.isnot(None))
+    else:
+        column = table.c.bucket
+        query = select(table)
+    if lo is not None:
+        query = query.where(column >= lo)
+    if hi is not None:
+        query = query.where(column < hi)
+    return query.subquery()
+
+
+def get_sales_timeseries(
+    db: Session,
+    granularity: str = "day",
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    product_id: Optional[int] = None,
+    rider_id: Optional[int] = None,
+    cost_basis: str = "sale",
+) -> List[dict]:
+    """
+    Serie temporale per bucket e prodotto: ordini, pezzi, incasso e food cost.
+    Con cost_basis="sale" il food cost è quello dei costi ingrediente in
+    vigore al momento della vendita (cost_history.food_costs_at_sale, come il
+    margine lordo); con "current" è pezzi x food cost attuale del prodotto,
+    da product_food_cost.
+    """
+    bucket_floor = {"hour": floor_hour, "day": floor_day, "week": floor_week}[granularity]
+    pieces = []  # (da, a, prodotto, ordini, pezzi, incasso) per bucket dei rollup o frazione d'ora
+    for table, lo, hi in plan_segments(granularity, date_from, date_to):
+        step = timedelta(hours=1) if table is HOURLY else timedelta(days=1)
+        source = _source(table, lo, hi)
+        query = (
+            select(
+                source.c.bucket,
+                source.c.product_id,
+                func.sum(source.c.order_count),
+                func.sum(source.c.quantity),
+                func.sum(source.c.revenue),
+            )
+            .group_by(source.c.bucket, source.c.product_id)
+        )
+        if product_id is not None:
+            query = query.where(source.c.product_id == product_id)
+        if rider_id is not None:
+            query = query.where(source.c.rider_id == rider_id)
+        for bucket, pid, count, qty, revenue in db.execute(query):
+            # una frazione d'ora sta dentro una sola ora: il pezzo è il segmento stesso
+            start, end = (lo, hi) if table is ORDERS else (bucket, bucket + step)
+            pieces.append((start, end, pid, count, qty, revenue))
+
+    if cost_basis == "sale":
+        costs = cost_history.food_costs_at_sale(
+            db, [(start, end, pid, qty) for start, end, pid, _, qty, _ in pieces], product_id, rider_id
+        )
+    else:
+        unit_costs = dict(db.query(models.ProductFoodCost.product_id, models.ProductFoodCost.food_cost))
+        costs = [qty * unit_costs.get(pid, 0.0) for _, _, pid, _, qty, _ in pieces]
+
+    totals = defaultdict(lambda: [0, 0, 0.0, 0.0])
+    for (start, _, pid, count, qty, revenue), cost in zip(pieces, costs):
+        row = totals[(bucket_floor(start), pid)]
+        row[0] += count
+        row[1] += qty
+        row[2] += revenue
+        row[3] += cost
+    return [
+        {
+            "bucket": bucket,
+            "product_id": pid or None,
+            "order_count": count,
+            "quantity": qty,
+            "revenue": revenue,
+            "food_cost": cost,
+        }
+        for (bucket, pid), (count, qty, revenue, cost) in sorted(totals.items())
+    ]
+
+
+def get_product_quantities(
+    db: Session,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+) -> List[tuple]:
+    """Righe (product_id, pezzi venduti) in [date_from, date_to), sommate dai rollup."""
+    totals = defaultdict(int)
+    for table, lo, hi in plan_segments("day", date_from, date_to):
+        source = _source(table, lo, hi)
+        query = (
+            select(source.c.product_id, func.sum(source.c.quantity))
+            .where(source.c.product_id != 0)
+            .group_by(source.c.product_id)
+        )
+        for pid, qty in db.execute(query):
+            totals[pid] += qty
+    return sorted(totals.items())
@@ -1,8 +1,10 @@
-from pydantic import BaseModel, EmailStr, Field , validator 
+from pydantic import BaseModel, EmailStr, Field , validator, root_validator
 import re
 from typing import Optional, List
 from datetime import datetime
 
+from .models import JobStatus, MovementType
+
 class RegisterRequest(BaseModel):
     email: EmailStr
     password: str = Field(
@@ -10,6 +12,13 @@ class RegisterRequest(BaseModel):
         min_length=8,
         description="Minimo 8 caratteri, con almeno una maiuscola, una minuscola, un numero e un carattere speciale"
     )
+    tenant: Optional[str] = Field(None, description="Ristorante (tenant) dell'utente; default: DEFAULT_TENANT")
+
+    @validator('tenant')
+    def tenant_name(cls, v):
+        if v is not None and not re.match(r'^[a-z0-9][a-z0-9_-]{0,62}$', v):
+            raise ValueError("Il tenant può contenere solo minuscole, cifre, '-' e '_' (max 63 caratteri)")
+        return v
 
     @validator('password')
     def password_complexity(cls, v):
@@ -24,9 +33,14 @@ class TokenResponse(BaseModel):
     access_token: str
     token_type: str = "bearer"
 
+class StreamTicket(BaseModel):
+    ticket: str
+    expires_in: int  # secondi
+
 class UserInDB(BaseModel):
     id: int
     email: EmailStr
+    tenant: str
     class Config:
         orm_mode = True
 
@@ -45,6 +59,21 @@ class Ingredient(IngredientBase):
     class Config:
         orm_mode = True
 
+class IngredientCostVersion(BaseModel):
+    unit_cost: Optional[float] = None  # None: ingrediente eliminato
+    valid_from: datetime
+    valid_to: Optional[datetime] = None  # None: versione in vigore
+
+class IngredientSearchHit(BaseModel):
+    id: int
+    name: str
+    unit_cost: Optional[float] = None
+    score: float
+
+class IngredientPage(BaseModel):
+    items: List[Ingredient]
+    next_cursor: Optional[str] = None
+
 # -----------------
 # Product
 # -----------------
@@ -59,22 +88,42 @@ class Product(ProductBase):
     class Config:
         orm_mode = True
 
+class ProductSearchHit(BaseModel):
+    id: int
+    name: str
+    food_cost: float
+    score: float
+
+class ProductPage(BaseModel):
+    items: List[Product]
+    next_cursor: Optional[str] = None
+
 # -----------------
 # Recipe
 # -----------------
 class RecipeBase(BaseModel):
     product_id: int
-    ingredient_id: int
+    # esattamente uno tra ingrediente e semilavorato (un altro prodotto)
+    ingredient_id: Optional[int] = None
+    component_product_id: Optional[int] = None
     quantity: float
 
 class RecipeCreate(RecipeBase):
-    pass
+    @root_validator(skip_on_failure=True)
+    def one_component(cls, values):
+        if (values.get('ingredient_id') is None) == (values.get('component_product_id') is None):
+            raise ValueError('Indicare ingredient_id oppure component_product_id (uno solo)')
+        return values
 
 class Recipe(RecipeBase):
     id: int
     class Config:
         orm_mode = True
 
+class RecipePage(BaseModel):
+    items: List[Recipe]
+    next_cursor: Optional[str] = None
+
 # -----------------
 # Order
 # -----------------
@@ -93,15 +142,23 @@ class Order(OrderBase):
     class Config:
         orm_mode = True
 
+class OrderPage(BaseModel):
+    items: List[Order]
+    next_cursor: Optional[str] = None
+
 # -----------------
 # InventoryMovement
 # -----------------
 class InventoryMovementBase(BaseModel):
     ingredient_id: int
     quantity: float
-    movement_type: str
+    movement_type: MovementType
     timestamp: Optional[datetime] = None
 
+    @validator('movement_type', pre=True)
+    def normalize_movement_type(cls, v):
+        return v.strip().lower() if isinstance(v, str) else v
+
 class InventoryMovementCreate(InventoryMovementBase):
     pass
 
@@ -110,6 +167,14 @@ class InventoryMovement(InventoryMovementBase):
     class Config:
         orm_mode = True
 
+class InventoryMovementPage(BaseModel):
+    items: List[InventoryMovement]
+    next_cursor: Optional[str] = None
+
+class IngredientStock(BaseModel):
+    ingredient_id: int
+    quantity: float
+
 # -----------------
 # Rider
 # -----------------
@@ -125,6 +190,10 @@ class Rider(RiderBase):
     class Config:
         orm_mode = True
 
+class RiderPage(BaseModel):
+    items: List[Rider]
+    next_cursor: Optional[str] = None
+
 # -----------------
 # Dashboard DTOs
 # -----------------
@@ -141,3 +210,90 @@ class ProductMargin(BaseModel):
     margin: float
     class Config:
         orm_mode = True
+
+class RiderPerformance(BaseModel):
+    rider_id: int
+    name: str
+    avg_time: float
+    deliveries: int
+    total_revenue: float
+    items_delivered: int
+    orders_per_day: float
+
+class SalesPoint(BaseModel):
+    bucket: datetime
+    product_id: Optional[int] = None
+    order_count: int
+    quantity: int
+    revenue: float
+    food_cost: float
+
+class ConsumptionVariance(BaseModel):
+    ingredient_id: int
+    name: Optional[str] = None
+    theoretical: float
+    actual: float
+    variance: float
+    variance_pct: Optional[float] = None
+    cost_impact: float
+
+# -----------------
+# Creazione in blocco
+# -----------------
+class BulkItemError(BaseModel):
+    index: Optional[int] = None  # None = errore dell'intero blocco
+    error: str
+
+class BulkResult(BaseModel):
+    mode: str
+    inserted: int
+    ids: List[Optional[int]]
+    errors: List[BulkItemError] = []
+
+# -----------------
+# Import CSV
+# -----------------
+class ImportRowError(BaseModel):
+    line: int
+    error: str
+
+class ImportSummary(BaseModel):
+    total_rows: int
+    inserted: int
+    rejected: int
+    errors: List[ImportRowError]
+    elapsed_seconds: float
+
+class UpsertSummary(BaseModel):
+    total_rows: int
+    inserted: int
+    updated: int
+    unchanged: int
+    rejected: int
+    errors: List[ImportRowError]
+    elapsed_seconds: float
+
+# -----------------
+# Import in background
+# -----------------
+class ImportJob(BaseModel):
+    id: int
+    kind: str
+    status: JobStatus
+    filename: Optional[str] = None
+    total_bytes: int
+    bytes_done: int
+    progress: float  # 0..1, stimato sui byte letti
+    rows_done: int
+    inserted: int
+    updated: int
+    rejected: int
+    errors: List[ImportRowError]
+    error: Optional[str] = None
+    cancel_requested: bool
+    attempts: int
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    elapsed_seconds: Optional[float] = None
+    rows_per_second: Optional[float] = None
@@ -0,0 +1,310 @@
+"""
+Ricerca per nome su ingredienti e prodotti.
+
+Su SQLite i nomi sono indicizzati in tabelle virtuali FTS5 con tokenizer
+trigram (ingredients_fts, products_fts), create dalla migrazione 8 come
+tabelle "external content": l'indice contiene solo i trigrammi, il testo
+resta nella tabella originale. La sincronizzazione è fatta da trigger
+AFTER INSERT/UPDATE/DELETE sulle tabelle originali invece che dalle funzioni
+di crud, perché i nomi arrivano anche da insert Core (bulk, import, upsert dei
+costi, generatore di dati) che non passano dagli oggetti ORM.
+
+Una ricerca combina:
+- sottostringa/prefisso: ogni parola di almeno 3 caratteri deve comparire
+  nel nome (frase trigram in AND, risolta sull'indice, niente scansione);
+  le parole più corte filtrano i candidati, e una ricerca con sole parole
+  corte usa un LIKE per prefisso
+- tolleranza ai refusi: se i risultati esatti non bastano, i trigrammi più
+  rari delle parole (frequenze dalla tabella fts5vocab, fino a
+  FUZZY_MAX_POSTINGS righe in tutto: un trigramma presente in ogni nome non
+  aiuta e costa una scansione) recuperano in OR i candidati migliori per bm25
+  (al massimo FUZZY_CANDIDATES), rivalutati con la similarità trigram per
+  parola (come word_similarity di pg_trgm) e tenuti sopra FUZZY_THRESHOLD
+- rilevanza: nome uguale > nome che inizia con la ricerca > parola che
+  inizia con la ricerca > sottostringa > similarità, poi nomi più corti
+
+Senza FTS5 trigram (altri database, SQLite < 3.34) la ricerca usa un ILIKE
+sulla tabella, senza tolleranza ai refusi.
+"""
+
+import re
+from functools import lru_cache
+from typing import Iterable, List, Optional, Sequence
+
+from sqlalchemy import Integer, bindparam, column, func, inspect, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from . import models
+
+# tabella virtuale -> tabella indicizzata
+INDEXES = {
+    "ingredients_fts": "ingredients",
+    "products_fts": "products",
+}
+_FTS_TABLE = {models.Ingredient: "ingredients_fts", models.Product: "products_fts"}
+
+FUZZY_CANDIDATES = 200
+FUZZY_MAX_POSTINGS = 5000
+FUZZY_THRESHOLD = 0.3
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+# -----------------
+# SCHEMA
+# -----------------
+def fts5_trigram_available(conn: Connection) -> bool:
+    if conn.dialect.name != "sqlite":
+        return False
+    try:
+        conn.exec_driver_sql("CREATE VIRTUAL TABLE temp._trigram_probe USING fts5(x, tokenize='trigram')")
+        conn.exec_driver_sql("DROP TABLE temp._trigram_probe")
+        return True
+    except Exception:
+        return False
+
+
+def create_indexes(conn: Connection) -> bool:
+    """Crea tabelle FTS e trigger se mancano e le popola; False se FTS5 trigram non è disponibile."""
+    if not fts5_trigram_available(conn):
+        return False
+    for fts, table in INDEXES.items():
+        conn.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} "
+            f"USING fts5(name, content='{table}', content_rowid='id', tokenize='trigram')"
+        )
+        conn.exec_driver_sql(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts}_vocab USING fts5vocab({fts}, 'row')")
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END"
+        )
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); END"
+        )
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF id, name ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); "
+            f"INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END"
+        )
+    rebuild(conn)
+    return True
+
+
+def rebuild(conn) -> int:
+    """Ricostruisce gli indici dalle tabelle (non fa commit). Restituisce quanti indici."""
+    count = 0
+    for fts in _existing_indexes(conn):
+        conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+        count += 1
+    return count
+
+
+def check_consistency(conn) -> List[str]:
+    """Indici FTS non allineati alla tabella (integrity-check di FTS5)."""
+    problems = []
+    for fts in _existing_indexes(conn):
+        try:
+            conn.execute(text(f"INSERT INTO {fts}({fts}, rank) VALUES ('integrity-check', 1)"))
+        except Exception as exc:
+            problems.append(f"{fts}: {exc}")
+    return problems
+
+
+def _existing_indexes(conn) -> List[str]:
+    bind = conn.connection() if isinstance(conn, Session) else conn
+    if bind.dialect.name != "sqlite":
+        return []
+    tables = set(inspect(bind).get_table_names())
+    return [fts for fts in INDEXES if fts in tables]
+
+
+# -----------------
+# RICERCA
+# -----------------
+def normalize(term: str) -> str:
+    return " ".join(_WORD.findall(term.lower()))
+
+
+def _phrase(word: str) -> str:
+    return '"' + word.replace('"', '""') + '"'
+
+
+@lru_cache(maxsize=8192)
+def _trigrams(word: str) -> frozenset:
+    padded = f"  {word} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def word_similarity(query_words: Sequence[str], name: str) -> float:
+    """Media, sulle parole cercate, della miglior similarità trigram con una parola del nome."""
+    name_words = [_trigrams(w) for w in _WORD.findall(name.lower())]
+    if not query_words or not name_words:
+        return 0.0
+    total = 0.0
+    for word in query_words:
+        grams = _trigrams(word)
+        total += max(len(grams & other) / len(grams | other) for other in name_words)
+    return total / len(query_words)
+
+
+def _score(term: str, words: Sequence[str], name: str, similarity: Optional[float] = None) -> float:
+    normalized = normalize(name)
+    if normalized == term:
+        return 4.0
+    if normalized.startswith(term):
+        return 3.0
+    contains_all = all(w in normalized for w in words)
+    if contains_all and any(w.startswith(words[0]) for w in normalized.split()):
+        return 2.0
+    if contains_all:
+        return 1.0
+    return word_similarity(words, name) if similarity is None else similarity
+
+
+def _has_index(db: Session, fts: str) -> bool:
+    if db.get_bind().dialect.name != "sqlite":
+        return False
+    return db.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": fts}
+    ).first() is not None
+
+
+def _match_ids(fts: str, expression: str, limit: Optional[int] = None):
+    """rowid che soddisfano la query FTS5 (con limit: i migliori per bm25)."""
+    query = f"SELECT rowid FROM {fts} WHERE {fts} MATCH :q"
+    if limit is not None:
+        query += f" ORDER BY rank LIMIT {int(limit)}"
+    return text(query).bindparams(q=expression).columns(column("rowid", Integer))
+
+
+def _rare_trigrams(db: Session, fts: str, words: Sequence[str]) -> List[str]:
+    """Trigrammi delle parole presenti nell'indice, dai più rari, fino a FUZZY_MAX_POSTINGS righe."""
+    grams = {w[i:i + 3] for w in words for i in range(len(w) - 2)}
+    if not grams:
+        return []
+    counts = db.execute(
+        text(f"SELECT term, doc FROM {fts}_vocab WHERE term IN :terms").bindparams(bindparam("terms", expanding=True)),
+        {"terms": sorted(grams)},
+    ).all()
+    chosen, postings = [], 0
+    for term, docs in sorted(counts, key=lambda c: (c[1], c[0])):
+        if chosen and postings + docs > FUZZY_MAX_POSTINGS:
+            break
+        chosen.append(term)
+        postings += docs
+    return chosen
+
+
+def name_filter(db: Session, model, term: str, indexed: Optional[bool] = None) -> list:
+    """Condizioni "il nome contiene tutte le parole di term", sull'indice trigram se c'è."""
+    words = normalize(term).split()
+    long_words = [w for w in words if len(w) >= 3]
+    fts = _FTS_TABLE[model]
+    if indexed is None:
+        indexed = _has_index(db, fts)
+    conditions = [model.name.ilike(f"%{w}%") for w in words if len(w) < 3]
+    if long_words and indexed:
+        expression = " AND ".join(_phrase(w) for w in long_words)
+        conditions.append(model.id.in_(_match_ids(fts, expression)))
+    else:
+        conditions += [model.name.ilike(f"%{w}%") for w in long_words]
+    return conditions
+
+
+def search(
+    db: Session,
+    model,
+    term: str,
+    columns: Iterable = (),
+    filters: Iterable = (),
+    join=None,
+    limit: int = 20,
+    fuzzy: bool = True,
+) -> List[tuple]:
+    """
+    Righe (id, name, *columns, score) dei record di model il cui nome
+    corrisponde a term, ordinate per rilevanza. join: (tabella, condizione)
+    in outer join per le colonne/filtri extra.
+    """
+    term = normalize(term)
+    words = term.split()
+    if not words:
+        return []
+    columns, filters = list(columns), list(filters)
+    fts = _FTS_TABLE[model]
+    indexed = _has_index(db, fts)
+    base = select(model.id, model.name, *columns)
+    if join is not None:
+        base = base.outerjoin(*join)
+    base = base.where(model.name.isnot(None), *filters)
+
+    if all(len(w) < 3 for w in words):
+        # troppo corta per i trigrammi: prefisso del nome o di una sua parola
+        exact = base.where(model.name.ilike(f"{term}%") | model.name.ilike(f"% {term}%"))
+    else:
+        exact = base.where(*name_filter(db, model, term, indexed))
+    # i candidati in eccesso servono al ranking: i migliori non sono per forza i primi trovati
+    rows = {row[0]: row for row in db.execute(exact.order_by(func.length(model.name)).limit(limit * 5))}
+
+    long_words = [w for w in words if len(w) >= 3]
+    grams = _rare_trigrams(db, fts, long_words) if fuzzy and len(rows) < limit and indexed else []
+    similarities = {}
+    if grams:
+        candidates = _match_ids(fts, " OR ".join(_phrase(g) for g in grams), FUZZY_CANDIDATES)
+        for row in db.execute(base.where(model.id.in_(candidates))):
+            if row[0] in rows:
+                continue
+            similarity = word_similarity(words, row[1])
+            if similarity >= FUZZY_THRESHOLD:
+                rows[row[0]] = row
+                similarities[row[0]] = similarity
+
+    scored = sorted(
+        ((_score(term, words, row[1], similarities.get(row[0])), row) for row in rows.values()),
+        key=lambda item: (-item[0], len(item[1][1]), item[1][1]),
+    )
+    return [(*row, round(score, 3)) for score, row in scored[:limit]]
+
+
+def search_ingredients(
+    db: Session,
+    term: str,
+    cost_min: Optional[float] = None,
+    cost_max: Optional[float] = None,
+    limit: int = 20,
+    fuzzy: bool = True,
+) -> List[tuple]:
+    """Righe (id, name, unit_cost, score)."""
+    filters = []
+    if cost_min is not None:
+        filters.append(models.Ingredient.unit_cost >= cost_min)
+    if cost_max is not None:
+        filters.append(models.Ingredient.unit_cost <= cost_max)
+    return search(
+        db, models.Ingredient, term, columns=[models.Ingredient.unit_cost],
+        filters=filters, limit=limit, fuzzy=fuzzy,
+    )
+
+
+def search_products(
+    db: Session,
+    term: str,
+    food_cost_min: Optional[float] = None,
+    food_cost_max: Optional[float] = None,
+    limit: int = 20,
+    fuzzy: bool = True,
+) -> List[tuple]:
+    """Righe (id, name, food_cost, score), con il food cost della tabella materializzata."""
+    cost = func.coalesce(models.ProductFoodCost.food_cost, 0.0)
+    filters = []
+    if food_cost_min is not None:
+        filters.append(cost >= food_cost_min)
+    if food_cost_max is not None:
+        filters.append(cost <= food_cost_max)
+    return search(
+        db, models.Product, term, columns=[cost.label("food_cost")], filters=filters,
+        join=(models.ProductFoodCost, models.ProductFoodCost.product_id == models.Product.id),
+        limit=limit, fuzzy=fuzzy,
+    )
@@ -0,0 +1,279 @@
+"""
+Giacenze di magazzino per ingrediente.
+
+ingredient_stock contiene il saldo corrente di ogni ingrediente (carichi meno
+scarichi), aggiornato dalle funzioni di scrittura dei movimenti in crud.
+Ogni STOCK_SNAPSHOT_EVERY movimenti di un ingrediente viene salvato in
+stock_snapshots il saldo a quell'istante: la giacenza "as of" un timestamp
+si ottiene dallo snapshot precedente più vicino sommando i soli movimenti
+successivi, con una scansione limitata sull'indice (ingredient_id, timestamp).
+
+Un movimento retrodatato (o eliminato) corregge anche gli snapshot presi
+dopo il suo timestamp, così restano sempre coerenti con lo storico.
+
+Come per food_cost, le funzioni non fanno commit; rebuild() usa solo
+statement Core e accetta anche una Connection (usata dalle migrazioni).
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import and_, bindparam, case, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from . import models
+from .core import config
+from .utils import chunks
+
+STOCK = models.IngredientStock.__table__
+SNAPSHOTS = models.StockSnapshot.__table__
+MOVEMENTS = models.InventoryMovement.__table__
+
+
+
+def signed_quantity(movement_type, quantity) -> float:
+    """Effetto del movimento sulla giacenza: + per i carichi, - per gli scarichi."""
+    if movement_type == models.MovementType.CARICO:
+        return quantity or 0.0
+    if movement_type == models.MovementType.SCARICO:
+        return -(quantity or 0.0)
+    return 0.0
+
+
+def _delta_expr():
+    return case(
+        (MOVEMENTS.c.movement_type == models.MovementType.CARICO, MOVEMENTS.c.quantity),
+        (MOVEMENTS.c.movement_type == models.MovementType.SCARICO, -MOVEMENTS.c.quantity),
+        else_=0.0,
+    )
+
+
+def movement_values(movement: models.InventoryMovement) -> dict:
+    return {
+        "ingredient_id": movement.ingredient_id,
+        "quantity": movement.quantity,
+        "movement_type": movement.movement_type,
+        "timestamp": movement.timestamp,
+    }
+
+
+# -----------------
+# AGGIORNAMENTO INCREMENTALE
+# -----------------
+def apply_movements(db: Session, movements: List[dict], sign: int = 1) -> None:
+    """
+    Somma (sign=1) o sottrae (sign=-1, per le eliminazioni) i movimenti alla
+    giacenza corrente e agli snapshot successivi; salva nuovi snapshot quando
+    un ingrediente raggiunge STOCK_SNAPSHOT_EVERY movimenti dall'ultimo.
+    """
+    totals = defaultdict(lambda: [0.0, 0, None])
+    for m in movements:
+        if m.get("ingredient_id") is None:
+            continue
+        row = totals[m["ingredient_id"]]
+        row[0] += sign * signed_quantity(m.get("movement_type"), m.get("quantity"))
+        row[1] += 1 if sign > 0 else 0
+        ts = m.get("timestamp")
+        if ts is not None and (row[2] is None or ts > row[2]):
+            row[2] = ts
+    if not totals:
+        return
+
+    stmt = sqlite_insert(STOCK)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[STOCK.c.ingredient_id],
+        set_={
+            "quantity": STOCK.c.quantity + stmt.excluded.quantity,
+            "movements_since_snapshot": STOCK.c.movements_since_snapshot + stmt.excluded.movements_since_snapshot,
+            "last_movement_at": func.max(
+                func.coalesce(STOCK.c.last_movement_at, stmt.excluded.last_movement_at),
+                func.coalesce(stmt.excluded.last_movement_at, STOCK.c.last_movement_at),
+            ),
+        },
+    )
+    db.execute(stmt, [
+        {"ingredient_id": ing, "quantity": delta, "movements_since_snapshot": count, "last_movement_at": last}
+        for ing, (delta, count, last) in totals.items()
+    ])
+
+    _adjust_snapshots(db, movements, sign)
+    _take_due_snapshots(db, list(totals))
+
+
+def _adjust_snapshots(db: Session, movements: List[dict], sign: int) -> None:
+    """Corregge gli snapshot presi dopo (o allo stesso istante di) movimenti retrodatati."""
+    latest = {}
+    for chunk in chunks({m["ingredient_id"] for m in movements if m.get("ingredient_id") is not None}):
+        latest.update(db.execute(
+            select(SNAPSHOTS.c.ingredient_id, func.max(SNAPSHOTS.c.taken_at))
+            .where(SNAPSHOTS.c.ingredient_id.in_(chunk))
+            .group_by(SNAPSHOTS.c.ingredient_id)
+        ).all())
+    backdated = [
+        {
+            "ing": m["ingredient_id"],
+            "ts": m["timestamp"],
+            "delta": sign * signed_quantity(m.get("movement_type"), m.get("quantity")),
+        }
+        for m in movements
+        if m.get("timestamp") is not None and m["ingredient_id"] in latest and m["timestamp"] <= latest[m["ingredient_id"]]
+    ]
+    if backdated:
+        db.execute(
+            update(SNAPSHOTS)
+            .where(SNAPSHOTS.c.ingredient_id == bindparam("ing"), SNAPSHOTS.c.taken_at >= bindparam("ts"))
+            .values(quantity=SNAPSHOTS.c.quantity + bindparam("delta"))
+            .execution_options(synchronize_session=False),
+            backdated,
+        )
+
+
+def _take_due_snapshots(db: Session, ingredient_ids: List[int]) -> None:
+    for chunk in chunks(ingredient_ids):
+        due = and_(
+            STOCK.c.ingredient_id.in_(chunk),
+            STOCK.c.movements_since_snapshot >= config.STOCK_SNAPSHOT_EVERY,
+            STOCK.c.last_movement_at.isnot(None),
+        )
+        _snapshot(db, due)
+
+
+def _snapshot(db, condition) -> int:
+    """Salva il saldo corrente come snapshot all'ultimo movimento, per gli ingredienti che soddisfano condition."""
+    stmt = sqlite_insert(SNAPSHOTS).from_select(
+        ["ingredient_id", "taken_at", "quantity"],
+        select(STOCK.c.ingredient_id, STOCK.c.last_movement_at, STOCK.c.quantity).where(condition),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SNAPSHOTS.c.ingredient_id, SNAPSHOTS.c.taken_at],
+        set_={"quantity": stmt.excluded.quantity},
+    )
+    written = db.execute(stmt).rowcount
+    db.execute(update(STOCK).where(condition).values(movements_since_snapshot=0))
+    return written
+
+
+def take_snapshots(db) -> int:
+    """Snapshot immediato di tutti gli ingredienti con movimenti (es. a fine giornata)."""
+    return _snapshot(db, STOCK.c.last_movement_at.isnot(None))
+
+
+# -----------------
+# RICOSTRUZIONE
+# -----------------
+def rebuild(db) -> int:
+    """
+    Ricalcola giacenze e snapshot dallo storico dei movimenti (non fa commit).
+    Restituisce il numero di ingredienti con giacenza.
+    """
+    db.execute(SNAPSHOTS.delete())
+    db.execute(STOCK.delete())
+    snapshots, balances = [], {}
+    current, balance, count, last = None, 0.0, 0, None
+
+    def close():
+        if current is not None:
+            balances[current] = {
+                "ingredient_id": current,
+                "quantity": balance,
+                "last_movement_at": last,
+                "movements_since_snapshot": count,
+            }
+
+    rows = db.execute(
+        select(MOVEMENTS.c.ingredient_id, MOVEMENTS.c.timestamp, _delta_expr())
+        .where(MOVEMENTS.c.ingredient_id.isnot(None))
+        .order_by(MOVEMENTS.c.ingredient_id, MOVEMENTS.c.timestamp, MOVEMENTS.c.id)
+        .execution_options(yield_per=10000)
+    )
+    for ing, ts, delta in rows:
+        if ing != current:
+            close()
+            current, balance, count, last = ing, 0.0, 0, None
+        balance += delta or 0.0
+        count += 1
+        if ts is not None:
+            last = ts
+        if count >= config.STOCK_SNAPSHOT_EVERY and last is not None:
+            snapshots.append({"ingredient_id": ing, "taken_at": last, "quantity": balance})
+            count = 0
+    close()
+
+    # più movimenti con lo stesso timestamp: vale l'ultimo saldo
+    snapshots = list({(s["ingredient_id"], s["taken_at"]): s for s in snapshots}.values())
+    if balances:
+        db.execute(STOCK.insert(), list(balances.values()))
+    if snapshots:
+        db.execute(SNAPSHOTS.insert(), snapshots)
+    return len(balances)
+
+
+def check_consistency(db: Session, tolerance: float = 1e-6) -> List[dict]:
+    """Confronta le giacenze correnti con la somma completa dei movimenti."""
+    expected = dict(db.execute(
+        select(MOVEMENTS.c.ingredient_id, func.sum(_delta_expr()))
+        .where(MOVEMENTS.c.ingredient_id.isnot(None))
+        .group_by(MOVEMENTS.c.ingredient_id)
+    ).all())
+    stored = dict(db.execute(select(STOCK.c.ingredient_id, STOCK.c.quantity)).all())
+    mismatches = []
+    for ing in sorted(expected.keys() | stored.keys()):
+        exp, got = expected.get(ing) or 0.0, stored.get(ing) or 0.0
+        if abs(exp - got) > tolerance:
+            mismatches.append({"ingredient_id": ing, "stored": got, "expected": exp})
+    return mismatches
+
+
+# -----------------
+# LETTURE
+# -----------------
+def get_stock(db: Session, as_of: Optional[datetime] = None, ingredient_id: Optional[int] = None):
+    """
+    Righe (ingredient_id, quantità): giacenza corrente, oppure all'istante
+    as_of (movimenti con timestamp <= as_of) partendo dall'ultimo snapshot utile.
+    """
+    if as_of is None:
+        query = select(STOCK.c.ingredient_id, STOCK.c.quantity).order_by(STOCK.c.ingredient_id)
+        if ingredient_id is not None:
+            query = query.where(STOCK.c.ingredient_id == ingredient_id)
+        return db.execute(query).all()
+
+    # per ogni ingrediente: ultimo snapshot <= as_of, poi somma dei soli movimenti
+    # successivi con una ricerca per intervallo sull'indice (ingredient_id, timestamp)
+    latest = (
+        select(
+            STOCK.c.ingredient_id,
+            select(func.max(SNAPSHOTS.c.taken_at))
+            .where(SNAPSHOTS.c.ingredient_id == STOCK.c.ingredient_id, SNAPSHOTS.c.taken_at <= as_of)
+            .scalar_subquery()
+            .label("taken_at"),
+        )
+    )
+    if ingredient_id is not None:
+        latest = latest.where(STOCK.c.ingredient_id == ingredient_id)
+    latest = latest.subquery()
+
+    snapshot_quantity = (
+        select(SNAPSHOTS.c.quantity)
+        .where(SNAPSHOTS.c.ingredient_id == latest.c.ingredient_id, SNAPSHOTS.c.taken_at == latest.c.taken_at)
+        .scalar_subquery()
+    )
+    movements_after = (
+        select(func.sum(_delta_expr()))
+        .where(
+            MOVEMENTS.c.ingredient_id == latest.c.ingredient_id,
+            MOVEMENTS.c.timestamp > func.coalesce(latest.c.taken_at, datetime.min),
+            MOVEMENTS.c.timestamp <= as_of,
+        )
+        .scalar_subquery()
+    )
+    query = (
+        select(
+            latest.c.ingredient_id,
+            func.coalesce(snapshot_quantity, 0.0) + func.coalesce(movements_after, 0.0),
+        )
+        .order_by(latest.c.ingredient_id)
+    )
+    return db.execute(query).all()
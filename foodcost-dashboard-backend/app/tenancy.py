@@ -0,0 +1,258 @@
+"""
+Multi-tenant: un database per ristorante (tenant).
+
+Il tenant di una richiesta arriva dal claim "tenant" del JWT (vedi
+core.auth.get_tenant); le dependency di sessione in main.py aprono la
+sessione sul database di quel tenant. Ogni tenant ha un proprio file, quindi
+l'import pesante di una cucina blocca solo le scritture della stessa cucina.
+
+Il tenant di default usa gli engine di database.py (DATABASE_URL, ed
+eventualmente DATABASE_READ_URL per le letture), che ospitano anche gli
+utenti di tutti i tenant. Gli altri tenant usano TENANT_DATABASE_URL con
+{tenant} sostituito dal nome.
+
+Gli engine (sync e async, con i loro pool) sono tenuti in un LRU di al
+massimo TENANT_ENGINE_CACHE_SIZE tenant: il primo accesso a un tenant crea
+gli engine e applica le migrazioni pendenti (create_all compreso, quindi un
+tenant nuovo parte con lo schema completo); i tenant fermi da più di
+TENANT_ENGINE_IDLE_SECONDS, o i meno usati oltre il limite, vengono chiusi.
+Chiudere un engine non interrompe le connessioni in uso: dispose() chiude
+solo quelle libere nel pool, le altre vengono chiuse quando la sessione che
+le usa termina. Gli engine async si chiudono con await, quindi vengono
+raccolti e chiusi alla prima dependency async successiva.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+
+from . import database, food_cost, metrics, migrations, models
+from .core import config
+
+TENANT_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,62}$")
+
+
+def validate_tenant(tenant: str) -> str:
+    """Il nome finisce in un path/URL: solo minuscole, cifre, '-' e '_'."""
+    if not isinstance(tenant, str) or not TENANT_PATTERN.match(tenant):
+        raise ValueError("tenant non valido: usare minuscole, cifre, '-' e '_' (max 63 caratteri)")
+    return tenant
+
+
+def tenant_url(tenant: str) -> str:
+    if tenant == config.DEFAULT_TENANT:
+        return database.DATABASE_URL
+    return config.TENANT_DATABASE_URL.format(tenant=validate_tenant(tenant))
+
+
+def ensure_sqlite_dir(url: str) -> None:
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:"):
+        directory = os.path.dirname(os.path.abspath(url.database))
+        os.makedirs(directory, exist_ok=True)
+
+
+class Shard:
+    """Engine e session factory di un tenant."""
+
+    def __init__(self, tenant, engine, read_engine, async_engine, async_read_engine, pinned=False):
+        self.tenant = tenant
+        self.engine = engine
+        self.read_engine = read_engine
+        self.async_engine = async_engine
+        self.async_read_engine = async_read_engine
+        # pinned: mai chiuso (tenant di default, engine di database.py)
+        self.pinned = pinned
+        # il tenant nelle info della sessione serve a response_cache per le versioni delle tabelle
+        info = {"tenant": tenant}
+        self.session = sessionmaker(autocommit=False, autoflush=False, bind=engine, info=info)
+        self.read_session = (
+            self.session if read_engine is engine
+            else sessionmaker(autocommit=False, autoflush=False, bind=read_engine, info=info)
+        )
+        self.async_session = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False, info=info)
+        self.async_read_session = (
+            self.async_session if async_read_engine is async_engine
+            else async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False, info=info)
+        )
+        self.last_used = time.monotonic()
+
+
+def _open_shard(tenant: str) -> Shard:
+    url = tenant_url(tenant)
+    ensure_sqlite_dir(url)
+    engine = database.make_engine(url)
+    async_engine = database.make_async_engine(url)
+    metrics.instrument(engine, async_engine)
+    try:
+        migrations.upgrade(engine)
+        with Session(engine) as db:
+            food_cost.ensure_built(db)
+    except Exception:
+        engine.dispose()
+        raise
+    return Shard(tenant, engine, engine, async_engine, async_engine)
+
+
+class ShardRegistry:
+    """LRU thread-safe tenant -> Shard, con apertura pigra e chiusura per inattività."""
+
+    def __init__(self, maxsize: int, idle_seconds: float):
+        self.maxsize = maxsize
+        self.idle_seconds = idle_seconds
+        self._shards: "OrderedDict[str, Shard]" = OrderedDict()
+        self._lock = threading.Lock()
+        # un lock per tenant: due richieste concorrenti non migrano lo stesso file due volte
+        self._open_locks: Dict[str, threading.Lock] = {}
+        self._retired: List[Shard] = []
+        self.opened = 0
+        self.evicted = 0
+
+    def add(self, shard: Shard) -> None:
+        with self._lock:
+            self._shards[shard.tenant] = shard
+
+    def peek(self, tenant: str) -> Optional[Shard]:
+        """Lo shard se già aperto (senza I/O: usabile dall'event loop), altrimenti None."""
+        with self._lock:
+            shard = self._shards.get(tenant)
+            if shard is not None:
+                self._shards.move_to_end(tenant)
+                shard.last_used = time.monotonic()
+            return shard
+
+    def get(self, tenant: str) -> Shard:
+        """Lo shard del tenant, aprendolo e migrandolo se serve (I/O bloccante)."""
+        shard = self.peek(tenant)
+        if shard is None:
+            with self._lock:
+                open_lock = self._open_locks.setdefault(tenant, threading.Lock())
+            with open_lock:
+                shard = self.peek(tenant)
+                if shard is None:
+                    shard = _open_shard(tenant)
+                    with self._lock:
+                        self._shards[tenant] = shard
+                        self.opened += 1
+        self.evict()
+        return shard
+
+    def evict(self) -> int:
+        """Chiude i tenant inattivi e quelli oltre maxsize (dal meno usato); restituisce quanti."""
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            for tenant, shard in list(self._shards.items()):
+                if shard.pinned:
+                    continue
+                over = len(self._shards) > self.maxsize
+                if not over and now - shard.last_used <= self.idle_seconds:
+                    break  # ordine LRU: i successivi sono più recenti
+                del self._shards[tenant]
+                evicted.append(shard)
+            self.evicted += len(evicted)
+            self._retired.extend(evicted)
+        for shard in evicted:
+            shard.engine.dispose()
+        return len(evicted)
+
+    async def dispose_retired(self) -> None:
+        """Chiude gli engine async dei tenant rimossi dall'LRU."""
+        if not self._retired:
+            return
+        with self._lock:
+            retired, self._retired = self._retired, []
+        for shard in retired:
+            await shard.async_engine.dispose()
+
+    def tenants(self) -> List[str]:
+        with self._lock:
+            return list(self._shards)
+
+    @contextmanager
+    def borrow_engine(self, tenant: str) -> Iterator[Engine]:
+        """
+        Engine di lettura del tenant senza toccare l'LRU: quello aperto se c'è,
+        altrimenti uno temporaneo chiuso all'uscita. Per i report
+        che passano su tutti i tenant senza scalzare quelli attivi.
+        """
+        with self._lock:
+            shard = self._shards.get(tenant)
+            open_lock = self._open_locks.setdefault(tenant, threading.Lock())
+        if shard is not None:
+            yield shard.read_engine
+            return
+        url = tenant_url(tenant)
+        ensure_sqlite_dir(url)
+        engine = database.make_engine(url)
+        try:
+            with open_lock:
+                migrations.upgrade(engine)
+            yield engine
+        finally:
+            engine.dispose()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "open": len(self._shards),
+                "maxsize": self.maxsize,
+                "idle_seconds": self.idle_seconds,
+                "opened": self.opened,
+                "evicted": self.evicted,
+                "tenants": list(self._shards),
+            }
+
+
+registry = ShardRegistry(config.TENANT_ENGINE_CACHE_SIZE, config.TENANT_ENGINE_IDLE_SECONDS)
+registry.add(Shard(
+    config.DEFAULT_TENANT,
+    database.engine, database.read_engine, database.async_engine, database.async_read_engine,
+    pinned=True,
+))
+
+
+# -----------------
+# REPORT ADMIN SU TUTTI I TENANT
+# -----------------
+def known_tenants(control_db: Session) -> List[str]:
+    """Tenant con almeno un utente, più quelli aperti e quello di default."""
+    tenants = set(control_db.execute(select(models.User.tenant).distinct()).scalars())
+    tenants.update(registry.tenants())
+    tenants.add(config.DEFAULT_TENANT)
+    return sorted(t for t in tenants if TENANT_PATTERN.match(t))
+
+
+def tenant_summary(tenant: str, date_from=None, date_to=None) -> dict:
+    """Ordini, incasso e anagrafiche di un tenant, con una query per tabella."""
+    order = models.Order
+    query = select(
+        func.count(order.id), func.coalesce(func.sum(order.price), 0.0),
+        func.min(order.timestamp), func.max(order.timestamp),
+    )
+    if date_from is not None:
+        query = query.where(order.timestamp >= date_from)
+    if date_to is not None:
+        query = query.where(order.timestamp < date_to)
+    with registry.borrow_engine(tenant) as engine, Session(engine) as db:
+        orders, revenue, first, last = db.execute(query).one()
+        count = lambda model: db.execute(select(func.count()).select_from(model)).scalar()  # noqa: E731
+        return {
+            "tenant": tenant,
+            "orders": orders,
+            "revenue": float(revenue),
+            "first_order_at": first,
+            "last_order_at": last,
+            "products": count(models.Product),
+            "ingredients": count(models.Ingredient),
+            "riders": count(models.Rider),
+        }
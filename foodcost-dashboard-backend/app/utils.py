@@ -0,0 +1,37 @@
+"""
+Helper condivisi tra scritture materializzate, bulk e import.
+
+- IN_CHUNK / chunks(): valori a blocchi per le clausole IN, entro il limite
+  di parametri per statement di SQLite
+- csv_rows(): lettura in streaming di un upload CSV
+- format_validation_error(): errori di validazione Pydantic su una riga
+"""
+
+import codecs
+import csv
+from typing import BinaryIO, Iterable, Iterator, List
+
+from pydantic import ValidationError
+
+# Numero massimo di valori per singola clausola IN
+IN_CHUNK = 500
+
+
+def chunks(values: Iterable) -> Iterator[List]:
+    """Valori ordinati a blocchi di al più IN_CHUNK."""
+    values = sorted(values)
+    for i in range(0, len(values), IN_CHUNK):
+        yield values[i:i + IN_CHUNK]
+
+
+def csv_rows(fileobj: BinaryIO) -> csv.DictReader:
+    """DictReader che decodifica l'upload in streaming, senza caricarlo tutto in memoria."""
+    return csv.DictReader(codecs.getreader("utf-8")(fileobj))
+
+
+def format_validation_error(exc: ValidationError) -> str:
+    """Errori di validazione come "campo: messaggio; ..."."""
+    return "; ".join(
+        f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" if err.get("loc") else err["msg"]
+        for err in exc.errors()
+    )
@@ -0,0 +1,144 @@
+"""
+Scostamento tra consumo teorico e consumo reale degli ingredienti.
+
+Il consumo teorico di un periodo è il prodotto tra i pezzi venduti per
+prodotto (dai rollup vendite) e la matrice ricette prodotto x ingrediente;
+il consumo reale è la somma degli scarichi di magazzino nello stesso
+periodo. Tutto è caricato con poche query aggregate in array NumPy e
+calcolato in forma vettoriale: la matrice ricette è tenuta in formato COO
+(righe, colonne, valori) e il prodotto vettore x matrice è un np.bincount
+pesato sulle colonne, senza cicli Python su ordini o movimenti.
+
+I semilavorati (righe ricetta con component_product_id) sono esplosi prima:
+la domanda di ogni prodotto (venduto) viene propagata ai suoi componenti in
+ordine topologico, dai piatti verso impasti e salse, e il consumo teorico
+degli ingredienti si calcola poi sulla domanda totale di ogni prodotto.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from . import food_cost, models, rollups
+
+
+def _index(keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Posizione di ogni valore nell'array ordinato keys (i valori devono esserci)."""
+    return np.searchsorted(keys, values)
+
+
+def _columns(rows, dtypes) -> List[np.ndarray]:
+    if not rows:
+        return [np.empty(0, dtype=d) for d in dtypes]
+    return [np.asarray(col, dtype=d) for col, d in zip(zip(*rows), dtypes)]
+
+
+def _scarichi(db: Session, lo: Optional[datetime], hi: Optional[datetime]):
+    m = models.InventoryMovement
+    query = (
+        select(m.ingredient_id, func.sum(m.quantity))
+        .where(m.movement_type == models.MovementType.SCARICO, m.ingredient_id.isnot(None))
+        .group_by(m.ingredient_id)
+    )
+    if lo is not None:
+        query = query.where(m.timestamp >= lo)
+    if hi is not None:
+        query = query.where(m.timestamp < hi)
+    return db.execute(query).all()
+
+
+def _explode_components(db: Session, products: np.ndarray, quantities: np.ndarray):
+    """Domanda per prodotto comprensiva dei semilavorati usati dai prodotti venduti."""
+    edges = food_cost.component_edges(db)
+    if not edges:
+        return products, quantities
+    components = defaultdict(list)
+    for product, component, quantity in edges:
+        components[product].append((component, quantity))
+    demand = defaultdict(float, zip(products.tolist(), quantities.tolist()))
+    nodes = {p for p, _, _ in edges} | {c for _, c, _ in edges}
+    # topological_order mette i componenti prima: al contrario si va dai piatti ai semilavorati
+    for product in reversed(food_cost.topological_order(nodes, ((p, c) for p, c, _ in edges))):
+        if demand.get(product):
+            for component, quantity in components[product]:
+                demand[component] += demand[product] * quantity
+    ordered = sorted(demand)
+    return np.asarray(ordered, dtype=np.int64), np.asarray([demand[p] for p in ordered], dtype=np.float64)
+
+
+def get_consumption_variance(
+    db: Session,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+) -> List[dict]:
+    """
+    Per ogni ingrediente consumato (in teoria o in pratica) nell'intervallo
+    [date_from, date_to): consumo teorico, reale,
+    scostamento assoluto e percentuale e impatto economico al costo attuale.
+    Ordinato per impatto economico decrescente.
+    """
+
+    ing_ids, names, unit_costs = _columns(
+        db.execute(
+            select(models.Ingredient.id, models.Ingredient.name, models.Ingredient.unit_cost)
+            .order_by(models.Ingredient.id)
+        ).all(),
+        (np.int64, object, np.float64),
+    )
+    unit_costs = np.nan_to_num(unit_costs)
+    n = len(ing_ids)
+
+    sold_products, sold_qty = _columns(rollups.get_product_quantities(db, date_from, date_to), (np.int64, np.float64))
+    sold_products, sold_qty = _explode_components(db, sold_products, sold_qty)
+    r_products, r_ingredients, r_qty = _columns(
+        db.execute(
+            select(models.Recipe.product_id, models.Recipe.ingredient_id, models.Recipe.quantity)
+            .where(models.Recipe.product_id.isnot(None), models.Recipe.ingredient_id.isnot(None))
+        ).all(),
+        (np.int64, np.int64, np.float64),
+    )
+    r_qty = np.nan_to_num(r_qty)
+
+    # vettore venduto allineato alle righe ricetta; prodotti senza vendite -> 0
+    sold_per_line = np.zeros(len(r_products))
+    if len(sold_products):
+        pos = np.minimum(_index(sold_products, r_products), len(sold_products) - 1)
+        hit = sold_products[pos] == r_products
+        sold_per_line[hit] = sold_qty[pos[hit]]
+
+    # ricette che puntano a ingredienti eliminati non hanno una colonna
+    known = np.isin(r_ingredients, ing_ids)
+    theoretical = np.bincount(
+        _index(ing_ids, r_ingredients[known]),
+        weights=sold_per_line[known] * r_qty[known],
+        minlength=n,
+    )
+
+    actual = np.zeros(n)
+    act_ids, act_qty = _columns(_scarichi(db, date_from, date_to), (np.int64, np.float64))
+    known = np.isin(act_ids, ing_ids)
+    actual[_index(ing_ids, act_ids[known])] = np.nan_to_num(act_qty[known])
+
+    variance = actual - theoretical
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variance_pct = np.where(theoretical != 0, variance / theoretical * 100, np.nan)
+    cost_impact = variance * unit_costs
+
+    rows = np.flatnonzero((theoretical != 0) | (actual != 0))
+    rows = rows[np.argsort(-cost_impact[rows], kind="stable")]
+    return [
+        {
+            "ingredient_id": int(ing_ids[i]),
+            "name": names[i],
+            "theoretical": float(theoretical[i]),
+            "actual": float(actual[i]),
+            "variance": float(variance[i]),
+            "variance_pct": None if np.isnan(variance_pct[i]) else float(variance_pct[i]),
+            "cost_impact": float(cost_impact[i]),
+        }
+        for i in rows
+    ]
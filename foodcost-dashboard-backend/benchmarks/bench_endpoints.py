@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Benchmark degli endpoint: CRUD, import, dashboard ed export.
+
+Genera un database sintetico con datagen.py (o usa uno esistente), avvia
+l'app in-process (httpx + ASGITransport, un solo event loop come uvicorn con
+un worker) e per ogni scenario esegue N richieste con la concorrenza
+indicata, misurando throughput e latenze p50/p95/p99/max. Gli scenari di
+sola lettura girano prima di quelli di scrittura, così le letture vedono
+sempre lo stesso dataset. Gli endpoint dashboard sono misurati due volte:
+"cached" (stessa URL, risposta dalla cache) e "uncached" (un parametro
+diverso a ogni richiesta, quindi sempre calcolati).
+
+Il risultato (con commit git, data e dimensioni del dataset) si può salvare
+in JSON e confrontare con quello di un altro commit:
+    python benchmarks/bench_endpoints.py --scale small --json before.json
+    python benchmarks/bench_endpoints.py --scale small --json after.json --compare before.json
+    python benchmarks/bench_endpoints.py --compare before.json --max-regression 20   # exit 1 se p95 peggiora >20%
+
+Esegui dalla cartella del backend.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import datagen  # noqa: E402
+from import_latency import summarize  # noqa: E402
+
+# nome -> (metodo, path, factory(i, ctx) -> kwargs per client.request, gruppo)
+SCENARIOS = {}
+
+
+def scenario(name, method, path, group):
+    def register(factory):
+        SCENARIOS[name] = (method, path, factory, group)
+        return factory
+    return register
+
+
+# -----------------
+# LETTURE
+# -----------------
+@scenario("ingredients.list", "GET", "/ingredients/", "read")
+def _ingredients_list(i, ctx):
+    return {"params": {"limit": 100}}
+
+
+@scenario("products.list", "GET", "/products/", "read")
+def _products_list(i, ctx):
+    return {"params": {"limit": 100}}
+
+
+@scenario("orders.list.offset", "GET", "/orders/", "read")
+def _orders_offset(i, ctx):
+    return {"params": {"skip": (i * 100) % max(ctx["orders"] - 100, 1), "limit": 100}}
+
+
+@scenario("orders.list.keyset", "GET", "/orders/", "read")
+def _orders_keyset(i, ctx):
+    return {"params": {"cursor": "", "limit": 100}}
+
+
+@scenario("orders.list.10k", "GET", "/orders/", "read")
+def _orders_10k(i, ctx):
+    return {"params": {"cursor": "", "limit": 10000}}
+
+
+@scenario("orders.list.10k.columnar", "GET", "/orders/", "read")
+def _orders_10k_columnar(i, ctx):
+    return {"params": {"cursor": "", "limit": 10000, "layout": "columnar"}}
+
+
+@scenario("inventory.list.10k", "GET", "/inventory/", "read")
+def _inventory_10k(i, ctx):
+    return {"params": {"skip": 0, "limit": 10000}}
+
+
+@scenario("orders.get", "GET", "/orders/{id}", "read")
+def _orders_get(i, ctx):
+    ids = ctx["order_ids"]
+    return {"path": f"/orders/{ids[i % len(ids)]}"}
+
+
+@scenario("orders.export.csv", "GET", "/orders/export", "read")
+def _orders_export(i, ctx):
+    return {"params": {"date_from": ctx["mid"], "date_to": ctx["to"]}}
+
+
+@scenario("ingredients.search", "GET", "/ingredients/search", "read")
+def _ingredients_search(i, ctx):
+    name = ctx["ingredients"][i % len(ctx["ingredients"])]["name"]
+    return {"params": {"q": name[-6:]}}
+
+
+@scenario("ingredients.search.typo", "GET", "/ingredients/search", "read")
+def _ingredients_search_typo(i, ctx):
+    name = ctx["ingredients"][i % len(ctx["ingredients"])]["name"]
+    return {"params": {"q": name[:4] + name[5:]}}  # una lettera in meno
+
+
+@scenario("products.search", "GET", "/products/search", "read")
+def _products_search(i, ctx):
+    return {"params": {"q": f"prodotto {i % 10}", "food_cost_min": 0.5}}
+
+
+@scenario("inventory.stock.as_of", "GET", "/inventory/stock", "read")
+def _stock_as_of(i, ctx):
+    return {"params": {"as_of": ctx["mid"]}}
+
+
+# -----------------
+# DASHBOARD (cached / uncached)
+# -----------------
+DASHBOARD = {
+    "products.food_cost": ("/products/food-cost/", lambda ctx: {}),
+    "products.food_cost.as_of": ("/products/food-cost/", lambda ctx: {"as_of": ctx["mid"]}),
+    "products.margine_lordo": ("/products/margine-lordo/", lambda ctx: {}),
+    "products.margine_lordo.current": ("/products/margine-lordo/", lambda ctx: {"cost_basis": "current"}),
+    "riders.performance": ("/riders/performance/", lambda ctx: {}),
+    "dashboard.sales_timeseries.day": (
+        "/dashboard/sales-timeseries", lambda ctx: {"granularity": "day", "date_from": ctx["from"], "date_to": ctx["to"]}
+    ),
+    "dashboard.sales_timeseries.hour": (
+        "/dashboard/sales-timeseries", lambda ctx: {"granularity": "hour", "date_from": ctx["mid"], "date_to": ctx["to"]}
+    ),
+    "dashboard.consumption_variance": (
+        "/dashboard/consumption-variance", lambda ctx: {"date_from": ctx["from"], "date_to": ctx["to"]}
+    ),
+}
+
+
+def _dashboard_factory(params, bust):
+    def factory(i, ctx):
+        query = params(ctx)
+        if bust:
+            query = dict(query, _=f"{ctx['run']}-{i}")  # la query string fa parte della chiave di cache
+        return {"params": query}
+    return factory
+
+
+for _name, (_path, _params) in DASHBOARD.items():
+    SCENARIOS[f"{_name}.uncached"] = ("GET", _path, _dashboard_factory(_params, True), "dashboard")
+    SCENARIOS[f"{_name}.cached"] = ("GET", _path, _dashboard_factory(_params, False), "dashboard")
+
+
+# -----------------
+# SCRITTURE E IMPORT
+# -----------------
+def _order(i, ctx):
+    return {
+        "product_id": ctx["product_ids"][i % len(ctx["product_ids"])],
+        "quantity": 1 + i % 3,
+        "price": 12.5,
+        "rider_id": ctx["rider_ids"][i % len(ctx["rider_ids"])] if ctx["rider_ids"] else None,
+        "timestamp": ctx["to"],
+    }
+
+
+@scenario("orders.create", "POST", "/orders/", "write")
+def _orders_create(i, ctx):
+    return {"json": _order(i, ctx)}
+
+
+@scenario("orders.bulk.100", "POST", "/orders/bulk", "write")
+def _orders_bulk(i, ctx):
+    return {"json": [_order(i * 100 + k, ctx) for k in range(100)]}
+
+
+@scenario("inventory.create", "POST", "/inventory/", "write")
+def _inventory_create(i, ctx):
+    ids = ctx["ingredient_ids"]
+    return {"json": {"ingredient_id": ids[i % len(ids)], "quantity": 1.0, "movement_type": "carico", "timestamp": ctx["to"]}}
+
+
+@scenario("orders.import_csv.stream.1000", "POST", "/orders/import-csv/stream/", "import")
+def _orders_import(i, ctx):
+    lines = ["product_id,quantity,price,rider_id,timestamp"]
+    for k in range(1000):
+        order = _order(i * 1000 + k, ctx)
+        lines.append(f"{order['product_id']},{order['quantity']},{order['price']},{order['rider_id'] or ''},{order['timestamp']}")
+    return {"files": {"file": ("orders.csv", ("\n".join(lines) + "\n").encode(), "text/csv")}}
+
+
+@scenario("ingredients.import_costs.upsert", "POST", "/ingredients/import-costs-csv/upsert/", "import")
+def _costs_import(i, ctx):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["id", "name", "unit_cost"])
+    writer.writerows(
+        [ing["id"], ing["name"], f"{(ing['unit_cost'] or 1.0) * (1 + (i % 5) / 100):.2f}"] for ing in ctx["ingredients"]
+    )
+    return {"files": {"file": ("costs.csv", buffer.getvalue().encode(), "text/csv")}}
+
+
+GROUP_ORDER = ("read", "dashboard", "write", "import")
+# gli import sono lenti: ne bastano poche iterazioni
+GROUP_REQUESTS = {"import": 0.1}
+
+
+# -----------------
+# ESECUZIONE
+# -----------------
+async def run_scenario(client, name, ctx, requests, concurrency):
+    method, path, factory, _ = SCENARIOS[name]
+    latencies, errors = [], 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            kwargs = factory(i, ctx)
+            url = kwargs.pop("path", path)
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+                if errors == 1:
+                    print(f"  {name}: HTTP {response.status_code} {response.text[:200]}", file=sys.stderr)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return dict(summarize(latencies), errors=errors, throughput_rps=round(len(latencies) / elapsed, 1))
+
+
+async def _context(client, dataset):
+    def check(response):
+        response.raise_for_status()
+        return response.json()
+
+    async def fetch_all(path):
+        rows, cursor = [], ""
+        while cursor is not None:
+            page = check(await client.get(path, params={"cursor": cursor, "limit": 10000}))
+            rows.extend(page["items"])
+            cursor = page["next_cursor"]
+        return rows
+
+    ingredients = await fetch_all("/ingredients/")
+    products = await fetch_all("/products/")
+    riders = await fetch_all("/riders/")
+    orders = check(await client.get("/orders/", params={"cursor": "", "limit": 1000}))["items"]
+    start, end = datetime.fromisoformat(dataset["from"]), datetime.fromisoformat(dataset["to"])
+    return {
+        "run": uuid.uuid4().hex[:8],
+        "ingredients": ingredients,
+        "ingredient_ids": [i["id"] for i in ingredients],
+        "product_ids": [p["id"] for p in products],
+        "rider_ids": [r["id"] for r in riders],
+        "order_ids": [o["id"] for o in orders],
+        "orders": dataset["orders"],
+        "from": start.isoformat(),
+        "mid": (start + (end - start) / 2).replace(microsecond=0).isoformat(),
+        "to": end.isoformat(),
+    }
+
+
+async def run(args, dataset, selected):
+    import httpx
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        response = await client.post(
+            "/auth/register", json={"email": f"bench-{uuid.uuid4().hex[:8]}@example.com", "password": "Bench#Passw0rd"}
+        )
+        response.raise_for_status()
+        client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+        ctx = await _context(client, dataset)
+
+        results = {}
+        for name in selected:
+            method, path, factory, group = SCENARIOS[name]
+            requests = max(int(args.requests * GROUP_REQUESTS.get(group, 1)), 1)
+            if group in ("read", "dashboard"):
+                # una richiesta a vuoto: import pigri, statement compilati e (per "cached") la cache piena
+                kwargs = factory(0, ctx)
+                await client.request(method, kwargs.pop("path", path), **kwargs)
+            results[name] = await run_scenario(client, name, ctx, requests, args.concurrency)
+            r = results[name]
+            print(
+                f"  {name:42s} {r['throughput_rps']:9.1f} req/s  p50 {r['p50_ms']:8.2f}  "
+                f"p95 {r['p95_ms']:8.2f}  p99 {r['p99_ms']:8.2f} ms",
+                file=sys.stderr,
+            )
+    return results
+
+
+# -----------------
+# CONFRONTO
+# -----------------
+def compare(old: dict, new: dict, max_regression=None) -> bool:
+    """Stampa le variazioni per endpoint; False se un p95 peggiora oltre max_regression (%)."""
+    ok = True
+    print(f"\nconfronto con {old['meta'].get('commit', '?')[:10]} ({old['meta'].get('timestamp', '?')})")
+    print(f"  {'endpoint':42s} {'p95 prima':>10s} {'p95 ora':>10s} {'Δp95':>8s} {'Δreq/s':>8s}")
+    for name, now in new["endpoints"].items():
+        before = old["endpoints"].get(name)
+        if before is None:
+            print(f"  {name:42s} {'-':>10s} {now['p95_ms']:10.2f}   (nuovo)")
+            continue
+        delta = (now["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+        tput = (now["throughput_rps"] - before["throughput_rps"]) / before["throughput_rps"] * 100 \
+            if before["throughput_rps"] else 0.0
+        flag = ""
+        if max_regression is not None and delta > max_regression:
+            ok = False
+            flag = "  REGRESSIONE"
+        print(f"  {name:42s} {before['p95_ms']:10.2f} {now['p95_ms']:10.2f} {delta:+7.1f}% {tput:+7.1f}%{flag}")
+    return ok
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=BENCH_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", help="URL SQLAlchemy (default: database temporaneo)")
+    parser.add_argument("--no-generate", action="store_true", help="usa il database così com'è, senza generare dati")
+    datagen.add_arguments(parser)
+    parser.add_argument("--requests", type=int, default=200, help="richieste per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--only", help="solo gli scenari il cui nome contiene questa stringa")
+    parser.add_argument("--list", action="store_true", help="elenca gli scenari ed esce")
+    parser.add_argument("--json", help="salva il risultato in questo file")
+    parser.add_argument("--compare", help="JSON di un'esecuzione precedente da confrontare")
+    parser.add_argument("--max-regression", type=float, help="con --compare: exit 1 se un p95 peggiora oltre questa %%")
+    args = parser.parse_args()
+
+    selected = [
+        name for group in GROUP_ORDER for name, spec in SCENARIOS.items()
+        if spec[3] == group and (not args.only or args.only in name)
+    ]
+    if args.list:
+        print("\n".join(selected))
+        return
+
+    if args.database:
+        os.environ["DATABASE_URL"] = args.database
+    else:
+        workdir = tempfile.mkdtemp(prefix="datadash-bench-")
+        os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    os.environ.pop("DATABASE_READ_URL", None)
+
+    from app import migrations
+    from app.database import engine
+
+    scale = datagen.scale_from_args(args)
+    if args.no_generate:
+        migrations.upgrade(engine)
+        dataset = _describe(engine)
+    else:
+        print(f"generazione dati ({args.scale})...", file=sys.stderr)
+        dataset = datagen.generate(engine, **scale)
+        print(json.dumps(dataset), file=sys.stderr)
+
+    endpoints = asyncio.run(run(args, dataset, selected))
+    result = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "scale": None if args.no_generate else dict(scale, name=args.scale),
+        },
+        "dataset": dataset,
+        "endpoints": endpoints,
+    }
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(result, fh, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
+
+    if args.compare:
+        with open(args.compare) as fh:
+            old = json.load(fh)
+        if not compare(old, result, args.max_regression):
+            sys.exit(1)
+
+
+def _describe(engine) -> dict:
+    """Dimensioni e intervallo temporale di un database già popolato."""
+    from sqlalchemy import func, select
+
+    from app import models
+
+    with engine.connect() as conn:
+        first, last, orders = conn.execute(
+            select(func.min(models.Order.timestamp), func.max(models.Order.timestamp), func.count(models.Order.id))
+        ).one()
+        count = lambda model: conn.execute(select(func.count()).select_from(model)).scalar()  # noqa: E731
+        now = datetime.utcnow()
+        return {
+            "ingredients": count(models.Ingredient),
+            "products": count(models.Product),
+            "riders": count(models.Rider),
+            "orders": orders,
+            "inventory_movements": count(models.InventoryMovement),
+            "from": (first or now).isoformat(),
+            "to": (last or now).isoformat(),
+        }
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark login: logins/sec a diversi costi bcrypt.
+
+Per ogni costo (BCRYPT_ROUNDS) avvia un processo separato con l'app in-process
+(httpx + ASGITransport) su un database temporaneo, registra un utente e
+lancia login concorrenti su /auth/login. Durante i login misura anche la
+latenza di GET /products/, per verificare che bcrypt non blocchi gli altri
+endpoint.
+
+Esegui dalla cartella del backend:
+    python benchmarks/bench_login.py --rounds 10 11 12 --logins 100 --concurrency 20
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+EMAIL = "bench@example.com"
+PASSWORD = "Bench#Passw0rd"
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+async def measure(logins, concurrency):
+    import httpx
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        response = await client.post("/auth/register", json={"email": EMAIL, "password": PASSWORD})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        login_latencies, other_latencies = [], []
+        remaining = iter(range(logins))
+        done = asyncio.Event()
+
+        async def login_worker():
+            for _ in remaining:
+                started = time.perf_counter()
+                r = await client.post("/auth/login", data={"username": EMAIL, "password": PASSWORD})
+                r.raise_for_status()
+                login_latencies.append(time.perf_counter() - started)
+
+        async def other_worker():
+            while not done.is_set():
+                started = time.perf_counter()
+                (await client.get("/products/", headers=headers)).raise_for_status()
+                other_latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(0.01)
+
+        other = asyncio.create_task(other_worker())
+        started = time.perf_counter()
+        await asyncio.gather(*(login_worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await other
+
+    ms = lambda values, p: round(percentile(values, p) * 1000, 1)
+    return {
+        "logins": logins,
+        "logins_per_sec": round(logins / elapsed, 2),
+        "login_p50_ms": ms(login_latencies, 50),
+        "login_p99_ms": ms(login_latencies, 99),
+        "other_endpoint_p99_ms": ms(other_latencies, 99) if other_latencies else None,
+    }
+
+
+def run_worker(args):
+    workdir = tempfile.mkdtemp(prefix="datadash-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    os.environ.pop("DATABASE_READ_URL", None)
+    result = asyncio.run(measure(args.logins, args.concurrency))
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12])
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--hash-concurrency", type=int, default=None,
+                        help="PASSWORD_HASH_CONCURRENCY (default: quello di config)")
+    parser.add_argument("--json", help="salva i risultati in questo file")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return run_worker(args)
+
+    results = []
+    for rounds in args.rounds:
+        env = dict(os.environ, BCRYPT_ROUNDS=str(rounds))
+        if args.hash_concurrency:
+            env["PASSWORD_HASH_CONCURRENCY"] = str(args.hash_concurrency)
+        out = subprocess.run(
+            [sys.executable, __file__, "--worker", "--logins", str(args.logins),
+             "--concurrency", str(args.concurrency)],
+            env=env, cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        )
+        result = dict(bcrypt_rounds=rounds, **json.loads(out.stdout.strip().splitlines()[-1]))
+        results.append(result)
+        print(json.dumps(result))
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Benchmark serializzazione delle liste grandi: righe/sec prima e dopo app.listing.
+
+Sullo stesso database (generato con datagen.py o esistente) e con l'app
+in-process (httpx + ASGITransport) misura pagine da --limit righe di ordini e
+movimenti di magazzino con:
+- orm: il percorso precedente, ricostruito su una route di benchmark
+  (oggetti ORM + response_model con orm_mode, validazione Pydantic e json)
+- rows: gli endpoint attuali (tuple di colonne + orjson)
+- columnar: gli endpoint attuali con layout=columnar
+sia con OFFSET sia con cursore keyset. Per ogni caso riporta la mediana di
+--repeat richieste, le righe/sec e i byte della risposta; prima della misura
+controlla che orm e rows restituiscano lo stesso JSON.
+
+Esegui dalla cartella del backend:
+    python benchmarks/bench_serialization.py --scale small --limit 10000 --repeat 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from typing import Optional, Union
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import datagen  # noqa: E402
+
+LIST_ENDPOINTS = {
+    "orders": "/orders/",
+    "inventory": "/inventory/",
+}
+
+
+def add_legacy_routes(app):
+    """Le liste come erano prima di app.listing: oggetti ORM validati dal response_model."""
+    from fastapi import Depends
+
+    from app import crud, models, schemas
+    from app.main import get_db, keyset_page
+
+    @app.get("/_bench/orm/orders", response_model=Union[list[schemas.Order], schemas.OrderPage])
+    def orm_orders(skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db=Depends(get_db)):
+        if cursor is not None:
+            return keyset_page(db, models.Order, cursor, limit)
+        return crud.get_orders(db, skip=skip, limit=limit)
+
+    @app.get(
+        "/_bench/orm/inventory",
+        response_model=Union[list[schemas.InventoryMovement], schemas.InventoryMovementPage],
+    )
+    def orm_inventory(skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db=Depends(get_db)):
+        if cursor is not None:
+            return keyset_page(db, models.InventoryMovement, cursor, limit)
+        return crud.get_inventory_movements(db, skip=skip, limit=limit)
+
+
+async def measure(client, path, params, repeat):
+    timings, size, rows = [], 0, 0
+    for _ in range(repeat + 1):  # la prima è di riscaldamento
+        started = time.perf_counter()
+        response = await client.get(path, params=params)
+        timings.append(time.perf_counter() - started)
+        response.raise_for_status()
+        size = len(response.content)
+        data = response.json()
+        data = data["items"] if "next_cursor" in data else data
+        rows = len(next(iter(data.values()))) if isinstance(data, dict) else len(data)
+    median = statistics.median(timings[1:])
+    return {
+        "rows": rows,
+        "median_ms": round(median * 1000, 2),
+        "rows_per_sec": round(rows / median, 1) if median else None,
+        "bytes": size,
+    }
+
+
+async def run(args):
+    import httpx
+
+    from app.main import app
+
+    add_legacy_routes(app)
+    transport = httpx.ASGITransport(app=app)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        response = await client.post(
+            "/auth/register", json={"email": f"bench-{uuid.uuid4().hex[:8]}@example.com", "password": "Bench#Passw0rd"}
+        )
+        response.raise_for_status()
+        client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+        for entity, path in LIST_ENDPOINTS.items():
+            for paging, base in (("offset", {"skip": 0}), ("keyset", {"cursor": ""})):
+                params = dict(base, limit=args.limit)
+                orm = await client.get(f"/_bench/orm/{entity}", params=params)
+                fast = await client.get(path, params=params)
+                if orm.content != fast.content:
+                    raise SystemExit(f"{entity} {paging}: il JSON di rows è diverso da quello di orm")
+                cases = {
+                    "orm": (f"/_bench/orm/{entity}", params),
+                    "rows": (path, params),
+                    "columnar": (path, dict(params, layout="columnar")),
+                }
+                base_rate = None
+                for case, (case_path, case_params) in cases.items():
+                    name = f"{entity}.{paging}.{case}"
+                    r = results[name] = await measure(client, case_path, case_params, args.repeat)
+                    base_rate = base_rate or r["rows_per_sec"]
+                    r["speedup"] = round(r["rows_per_sec"] / base_rate, 2) if base_rate else None
+                    print(
+                        f"  {name:28s} {r['rows']:7d} righe  {r['median_ms']:9.2f} ms  "
+                        f"{r['rows_per_sec']:12.1f} righe/s  x{r['speedup']:<5} {r['bytes']:10d} byte",
+                        file=sys.stderr,
+                    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", help="URL SQLAlchemy (default: database temporaneo)")
+    parser.add_argument("--no-generate", action="store_true", help="usa il database così com'è, senza generare dati")
+    datagen.add_arguments(parser)
+    parser.add_argument("--limit", type=int, default=10000, help="righe per pagina")
+    parser.add_argument("--repeat", type=int, default=20, help="richieste misurate per caso")
+    parser.add_argument("--json", help="salva il risultato in questo file")
+    args = parser.parse_args()
+
+    if args.database:
+        os.environ["DATABASE_URL"] = args.database
+    else:
+        workdir = tempfile.mkdtemp(prefix="datadash-bench-")
+        os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    os.environ.pop("DATABASE_READ_URL", None)
+    # le route del benchmark misurano la serializzazione, non le metriche per richiesta
+    os.environ.setdefault("METRICS_ENABLED", "false")
+
+    from app import migrations
+    from app.database import engine
+
+    if args.no_generate:
+        migrations.upgrade(engine)
+    else:
+        print(f"generazione dati ({args.scale})...", file=sys.stderr)
+        print(json.dumps(datagen.generate(engine, **datagen.scale_from_args(args))), file=sys.stderr)
+
+    results = asyncio.run(run(args))
+    output = {"limit": args.limit, "repeat": args.repeat, "results": results}
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(output, fh, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+
+
+if __name__ == "__main__":
+    main()
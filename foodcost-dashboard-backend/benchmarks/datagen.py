@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Generatore di dati sintetici per benchmark e prove di carico.
+
+Riempie un database (nuovo o esistente, lo schema viene migrato) con:
+- N ingredienti con costi unitari realistici
+- prodotti con ricette da 3 a ~12 ingredienti (fan-out lognormale)
+- rider con tempi medi di consegna
+- mesi di ordini con stagionalità giornaliera (picchi a pranzo e cena),
+  settimanale (weekend più carico) e un leggero trend di crescita
+- movimenti di magazzino: carichi periodici per ingrediente e scarichi
+  giornalieri pari al consumo teorico delle ricette più uno spreco casuale
+
+Gli insert sono executemany Core a blocchi; food cost, rollup vendite e
+giacenze vengono ricostruiti alla fine con le rispettive funzioni rebuild
+(e i costi generati diventano la prima versione dello storico costi).
+
+Esegui dalla cartella del backend:
+    python benchmarks/datagen.py --scale small --database sqlite:///./bench.db
+    python benchmarks/datagen.py --products 300 --months 12 --orders-per-day 3000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+SCALES = {
+    "tiny": dict(ingredients=30, products=20, riders=5, months=1, orders_per_day=100),
+    "small": dict(ingredients=120, products=60, riders=15, months=3, orders_per_day=600),
+    "medium": dict(ingredients=400, products=200, riders=40, months=6, orders_per_day=2500),
+    "large": dict(ingredients=1000, products=500, riders=100, months=12, orders_per_day=8000),
+}
+
+# quota degli ordini giornalieri per ora: pranzo 12-14, cena 19-22
+HOURLY_WEIGHTS = np.array([
+    0, 0, 0, 0, 0, 0, 0, 0.2, 0.4, 0.6, 1.0, 2.5,
+    5.0, 5.5, 3.0, 1.0, 0.8, 1.2, 2.5, 5.0, 6.0, 5.0, 2.5, 0.8,
+])
+HOURLY_WEIGHTS = HOURLY_WEIGHTS / HOURLY_WEIGHTS.sum()
+# lunedì ... domenica
+WEEKDAY_FACTORS = np.array([0.8, 0.85, 0.9, 0.95, 1.2, 1.4, 1.1])
+
+BATCH = 5000
+
+
+def _insert(conn, table, rows):
+    for i in range(0, len(rows), BATCH):
+        conn.execute(table.insert(), rows[i:i + BATCH])
+
+
+def generate(
+    engine,
+    ingredients: int,
+    products: int,
+    riders: int,
+    months: int,
+    orders_per_day: int,
+    start: datetime = None,
+    restock_every_days: int = 3,
+    waste: float = 0.05,
+    seed: int = 42,
+) -> dict:
+    """Popola il database dell'engine; restituisce i conteggi generati."""
+    from app import cost_history, food_cost, migrations, models, rollups, stock
+    from sqlalchemy import func, select
+    from sqlalchemy.orm import Session
+
+    rng = np.random.default_rng(seed)
+    started = time.perf_counter()
+    migrations.upgrade(engine)
+    days = max(int(months * 30.4), 1)
+    start = start or (datetime.utcnow() - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    with engine.begin() as conn:
+        existing = conn.execute(select(func.count()).select_from(models.Ingredient.__table__)).scalar()
+        run = f"{seed}-{existing}"  # nomi univoci se si rilancia sullo stesso database
+
+        # ingredienti: costi lognormali (pochi ingredienti molto cari)
+        unit_costs = np.round(rng.lognormal(mean=1.0, sigma=0.9, size=ingredients), 2)
+        ing_ids = conn.execute(
+            models.Ingredient.__table__.insert().returning(models.Ingredient.__table__.c.id, sort_by_parameter_order=True),
+            [{"name": f"ingrediente-{run}-{i}", "unit_cost": float(c)} for i, c in enumerate(unit_costs)],
+        ).scalars().all()
+        ing_ids = np.array(ing_ids)
+
+        prod_ids = np.array(conn.execute(
+            models.Product.__table__.insert().returning(models.Product.__table__.c.id, sort_by_parameter_order=True),
+            [{"name": f"prodotto-{run}-{i}"} for i in range(products)],
+        ).scalars().all())
+
+        # ricette: 3..~12 ingredienti per prodotto, popolarità degli ingredienti zipf-like
+        popularity = 1.0 / np.arange(1, ingredients + 1) ** 0.8
+        popularity /= popularity.sum()
+        recipe_rows = []
+        recipe_matrix = np.zeros((products, ingredients))
+        for p in range(products):
+            fan_out = int(np.clip(round(rng.lognormal(mean=1.7, sigma=0.35)), 3, min(ingredients, 15)))
+            chosen = rng.choice(ingredients, size=fan_out, replace=False, p=popularity)
+            quantities = np.round(rng.uniform(0.01, 0.3, size=fan_out), 3)
+            recipe_matrix[p, chosen] = quantities
+            recipe_rows.extend(
+                {"product_id": int(prod_ids[p]), "ingredient_id": int(ing_ids[i]), "quantity": float(q)}
+                for i, q in zip(chosen, quantities)
+            )
+        _insert(conn, models.Recipe.__table__, recipe_rows)
+
+        rider_ids = np.array(conn.execute(
+            models.Rider.__table__.insert().returning(models.Rider.__table__.c.id, sort_by_parameter_order=True),
+            [{"name": f"rider-{run}-{i}", "delivery_time": float(np.round(rng.uniform(12, 40), 1))} for i in range(riders)],
+        ).scalars().all())
+
+        # prezzi: food cost x ricarico 2.5-4
+        prices = np.maximum(recipe_matrix @ unit_costs * rng.uniform(2.5, 4.0, size=products), 3.0)
+        product_weights = rng.dirichlet(np.full(products, 0.7))
+
+        order_count = movement_count = 0
+        for day in range(days):
+            date = start + timedelta(days=day)
+            trend = 1.0 + 0.2 * day / days
+            n = rng.poisson(orders_per_day * WEEKDAY_FACTORS[date.weekday()] * trend)
+            if n == 0:
+                continue
+            hours = rng.choice(24, size=n, p=HOURLY_WEIGHTS)
+            seconds = hours * 3600 + rng.integers(0, 3600, size=n)
+            prod_idx = rng.choice(products, size=n, p=product_weights)
+            qty = rng.integers(1, 4, size=n)
+            with_rider = rng.random(n) < 0.7
+            rider_idx = rng.integers(0, max(riders, 1), size=n)
+            order_rows = [
+                {
+                    "timestamp": date + timedelta(seconds=int(s)),
+                    "product_id": int(prod_ids[p]),
+                    "quantity": int(q),
+                    "rider_id": int(rider_ids[r]) if w and riders else None,
+                    "price": float(round(prices[p] * q, 2)),
+                }
+                for s, p, q, w, r in zip(seconds, prod_idx, qty, with_rider, rider_idx)
+            ]
+            _insert(conn, models.Order.__table__, order_rows)
+            order_count += n
+
+            # scarichi di fine giornata = consumo teorico + spreco; carichi periodici
+            sold = np.bincount(prod_idx, weights=qty, minlength=products)
+            used = sold @ recipe_matrix * (1 + rng.normal(waste, waste / 2, size=ingredients).clip(0))
+            closing = date + timedelta(hours=23, minutes=30)
+            movement_rows = [
+                {"ingredient_id": int(ing_ids[i]), "quantity": float(round(u, 3)),
+                 "movement_type": models.MovementType.SCARICO, "timestamp": closing}
+                for i, u in enumerate(used) if u > 0
+            ]
+            if day % restock_every_days == 0:
+                expected = (orders_per_day * trend * restock_every_days) * (product_weights * 2) @ recipe_matrix
+                opening = date + timedelta(hours=8)
+                movement_rows.extend(
+                    {"ingredient_id": int(ing_ids[i]), "quantity": float(round(e * 1.1, 3)),
+                     "movement_type": models.MovementType.CARICO, "timestamp": opening}
+                    for i, e in enumerate(expected) if e > 0
+                )
+            _insert(conn, models.InventoryMovement.__table__, movement_rows)
+            movement_count += len(movement_rows)
+
+    with Session(engine) as db:
+        cost_history.backfill(db.connection())
+        food_cost.rebuild(db)
+        rollups.rebuild(db)
+        stock.rebuild(db)
+        db.commit()
+
+    return {
+        "ingredients": ingredients,
+        "products": products,
+        "recipes": len(recipe_rows),
+        "riders": riders,
+        "days": days,
+        "orders": order_count,
+        "inventory_movements": movement_count,
+        "from": start.isoformat(),
+        "to": (start + timedelta(days=days)).isoformat(),
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small",
+                        help="preset di dimensioni (i singoli parametri lo sovrascrivono)")
+    parser.add_argument("--ingredients", type=int)
+    parser.add_argument("--products", type=int)
+    parser.add_argument("--riders", type=int)
+    parser.add_argument("--months", type=float)
+    parser.add_argument("--orders-per-day", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+
+
+def scale_from_args(args) -> dict:
+    scale = dict(SCALES[args.scale])
+    for key in scale:
+        value = getattr(args, key)
+        if value is not None:
+            scale[key] = value
+    scale["months"] = max(scale["months"], 1 / 30.4)
+    return dict(scale, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", help="URL SQLAlchemy (default: DATABASE_URL di config)")
+    add_arguments(parser)
+    args = parser.parse_args()
+    if args.database:
+        os.environ["DATABASE_URL"] = args.database
+        os.environ.pop("DATABASE_READ_URL", None)
+
+    from app.database import engine
+
+    result = generate(engine, **scale_from_args(args))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
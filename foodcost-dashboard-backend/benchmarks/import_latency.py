@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Load test: latenza di GET /orders/ mentre è in corso un grosso import CSV.
+
+L'app gira in-process (httpx + ASGITransport, un solo event loop come uvicorn
+con un worker) su un database temporaneo. Lo script misura la latenza di
+GET /orders/ a riposo e poi durante l'import, e stampa p50/p95/p99/max:
+se l'import blocca l'event loop, il p99 durante l'import sale fino alla
+durata dell'import stesso.
+
+Esegui dalla cartella del backend:
+    python benchmarks/import_latency.py --rows 20000 --endpoint /orders/import-csv/
+    python benchmarks/import_latency.py --rows 200000 --endpoint /orders/import-csv/stream/
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def summarize(latencies):
+    ms = [v * 1000 for v in latencies]
+    return {
+        "requests": len(ms),
+        "p50_ms": round(percentile(ms, 50), 2),
+        "p95_ms": round(percentile(ms, 95), 2),
+        "p99_ms": round(percentile(ms, 99), 2),
+        "max_ms": round(max(ms), 2),
+    }
+
+
+def build_csv(rows, seed=42):
+    rnd = random.Random(seed)
+    lines = ["product_id,quantity,price,rider_id,timestamp"]
+    for i in range(rows):
+        lines.append(
+            f"{rnd.randint(1, 50)},{rnd.randint(1, 4)},{rnd.uniform(5, 40):.2f},"
+            f"{rnd.randint(1, 10)},2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}T12:00:00"
+        )
+    return ("\n".join(lines) + "\n").encode()
+
+
+async def probe(client, stop, concurrency, interval):
+    """GET /orders/ in parallelo finché stop non è impostato; restituisce le latenze."""
+    latencies = []
+
+    async def worker():
+        while not stop.is_set():
+            started = time.perf_counter()
+            response = await client.get("/orders/", params={"limit": 50})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(interval)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+async def run(args):
+    import httpx
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        response = await client.post("/auth/register", json={"email": "bench@example.com", "password": "Bench#Passw0rd"})
+        response.raise_for_status()
+        client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+        for i in range(200):
+            await client.post("/orders/", json={"product_id": i % 50 + 1, "quantity": 1, "price": 10.0})
+
+        stop = asyncio.Event()
+        asyncio.get_running_loop().call_later(args.idle_seconds, stop.set)
+        idle = await probe(client, stop, args.concurrency, args.interval)
+
+        payload = build_csv(args.rows)
+        stop = asyncio.Event()
+
+        async def do_import():
+            started = time.perf_counter()
+            response = await client.post(args.endpoint, files={"file": ("orders.csv", payload, "text/csv")})
+            elapsed = time.perf_counter() - started
+            stop.set()
+            response.raise_for_status()
+            return elapsed
+
+        import_task = asyncio.create_task(do_import())
+        busy = await probe(client, stop, args.concurrency, args.interval)
+        import_seconds = await import_task
+
+    return {
+        "endpoint": args.endpoint,
+        "rows": args.rows,
+        "import_seconds": round(import_seconds, 2),
+        "idle": summarize(idle),
+        "during_import": summarize(busy),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--endpoint", default="/orders/import-csv/")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--interval", type=float, default=0.01, help="pausa tra richieste per worker (s)")
+    parser.add_argument("--idle-seconds", type=float, default=2.0)
+    parser.add_argument("--json", help="salva il risultato in questo file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="datadash-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    os.environ.pop("DATABASE_READ_URL", None)
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(result, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Comandi di manutenzione del database.
+Esegui con il venv attivo:
+    python manage.py migrate [--to VERSIONE]
+    python manage.py db-version
+    python manage.py explain
+    python manage.py rebuild-food-cost
+    python manage.py check-food-cost
+    python manage.py rebuild-rollups [--from DATA] [--to DATA]
+    python manage.py check-rollups
+    python manage.py rebuild-stock
+    python manage.py check-stock
+    python manage.py snapshot-stock
+    python manage.py rebuild-search
+    python manage.py check-search
+    python manage.py migrate-tenants
+
+Con --tenant NOME (prima del comando) si opera sul database di quel tenant:
+    python manage.py --tenant pizzeria-centro check-stock
+"""
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from app.core import config
+from app.database import SessionLocal, engine, make_engine
+from app import cost_history, crud, food_cost, migrations, models, pagination, rollups, search, stock, tenancy
+
+
+def migrate(args):
+    """Applica le migrazioni di schema pendenti."""
+    applied = migrations.upgrade(engine, target=args.to)
+    for m in applied:
+        print(f"Applicata migrazione {m.version}: {m.description}")
+    if not applied:
+        print("Nessuna migrazione da applicare.")
+
+
+def db_version(args):
+    """Mostra la versione di schema del database."""
+    with engine.connect() as conn:
+        version = migrations.current_version(conn)
+    latest = migrations.MIGRATIONS[-1].version
+    print(f"Versione schema: {version} (ultima disponibile: {latest})")
+
+
+def explain(args):
+    """Stampa il query plan SQLite delle query usate dagli endpoint principali."""
+    until = datetime.utcnow()
+    since = until - timedelta(days=args.days)
+    checks = [
+        ("/products/food-cost/", lambda db: food_cost.get_food_costs(db)),
+        ("/products/margine-lordo/", lambda db: food_cost.get_product_margins(db)),
+        ("/products/margine-lordo/?date_from=... (costi al momento della vendita)",
+         lambda db: cost_history.get_product_margins(db, date_from=since, date_to=until)),
+        ("/products/food-cost/?as_of=... (costi ingrediente in vigore)",
+         lambda db: cost_history.costs_as_of(db, since)),
+        ("/ingredients/search?q=... (indice trigram)",
+         lambda db: search.search_ingredients(db, "farina")),
+        ("/riders/performance/ (periodo)",
+         lambda db: crud.get_rider_performance(db, date_from=since, date_to=until)),
+        ("ordini filtrati per prodotto e periodo",
+         lambda db: crud.get_orders_filtered(db, date_from=since, date_to=until, product_id=args.id)),
+        ("ordini filtrati per rider e periodo",
+         lambda db: crud.get_orders_filtered(db, date_from=since, date_to=until, rider_id=args.id)),
+        ("/orders/?cursor=... (keyset su timestamp, id)",
+         lambda db: crud.get_keyset_page(db, models.Order, pagination.encode_cursor([since, 0]))),
+        ("/inventory/?cursor=... (keyset su timestamp, id)",
+         lambda db: crud.get_keyset_page(db, models.InventoryMovement, pagination.encode_cursor([since, 0]))),
+        ("/dashboard/sales-timeseries (rollup orari + giornalieri)",
+         lambda db: rollups.get_sales_timeseries(db, "day", since + timedelta(hours=5), until)),
+        ("/inventory/stock?as_of=... (snapshot + movimenti successivi)",
+         lambda db: stock.get_stock(db, as_of=since)),
+        ("aggiornamento food cost (prodotti che usano un ingrediente)",
+         lambda db: food_cost.products_using_ingredients(db, [args.id])),
+    ]
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    with SessionLocal() as db:
+        conn = db.connection()
+        for title, run in checks:
+            statements.clear()
+            event.listen(engine, "before_cursor_execute", capture)
+            try:
+                run(db)
+            finally:
+                event.remove(engine, "before_cursor_execute", capture)
+            print(f"== {title}")
+            for statement, parameters in statements:
+                print(" ".join(statement.split()))
+                for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters):
+                    print(f"    {row[-1]}")
+            print()
+
+
+def rebuild_food_cost(args):
+    """Ricalcola da zero la tabella product_food_cost."""
+    with SessionLocal() as db:
+        count = food_cost.rebuild(db)
+        db.commit()
+    print(f"Food cost ricalcolato per {count} prodotti.")
+
+
+def check_food_cost(args):
+    """Confronta product_food_cost con un ricalcolo da zero."""
+    with SessionLocal() as db:
+        mismatches = food_cost.check_consistency(db, tolerance=args.tolerance)
+    for m in mismatches:
+        print(f"product_id={m['product_id']}\t stored={m['stored']}\t expected={m['expected']}")
+    if mismatches:
+        print(f"{len(mismatches)} prodotti non allineati: esegui rebuild-food-cost.")
+        return 1
+    print("Food cost consistente.")
+    return 0
+
+
+def rebuild_rollups(args):
+    """Ricalcola dagli ordini i rollup vendite (tutti o solo i giorni indicati)."""
+    with SessionLocal() as db:
+        count = rollups.rebuild(db, date_from=args.date_from, date_to=args.date_to)
+        db.commit()
+    print(f"Rollup vendite ricalcolati: {count} righe giornaliere.")
+
+
+def check_rollups(args):
+    """Confronta i rollup vendite con un ricalcolo dagli ordini."""
+    with SessionLocal() as db:
+        mismatches = rollups.check_consistency(db)
+    for m in mismatches:
+        print(f"{m['table']} {m['key']}\t stored={m['stored']}\t expected={m['expected']}")
+    if mismatches:
+        print(f"{len(mismatches)} righe non allineate: esegui rebuild-rollups.")
+        return 1
+    print("Rollup vendite consistenti.")
+    return 0
+
+
+def rebuild_stock(args):
+    """Ricalcola giacenze e snapshot di magazzino dallo storico dei movimenti."""
+    with SessionLocal() as db:
+        count = stock.rebuild(db)
+        db.commit()
+    print(f"Giacenze ricalcolate per {count} ingredienti.")
+
+
+def check_stock(args):
+    """Confronta le giacenze correnti con la somma dei movimenti."""
+    with SessionLocal() as db:
+        mismatches = stock.check_consistency(db, tolerance=args.tolerance)
+    for m in mismatches:
+        print(f"ingredient_id={m['ingredient_id']}\t stored={m['stored']}\t expected={m['expected']}")
+    if mismatches:
+        print(f"{len(mismatches)} ingredienti non allineati: esegui rebuild-stock.")
+        return 1
+    print("Giacenze consistenti.")
+    return 0
+
+
+def snapshot_stock(args):
+    """Salva subito uno snapshot della giacenza di ogni ingrediente (es. da cron a fine giornata)."""
+    with SessionLocal() as db:
+        count = stock.take_snapshots(db)
+        db.commit()
+    print(f"Snapshot salvati per {count} ingredienti.")
+
+
+def rebuild_search(args):
+    """Ricostruisce gli indici di ricerca sui nomi di ingredienti e prodotti."""
+    with SessionLocal() as db:
+        count = search.rebuild(db)
+        db.commit()
+    if not count:
+        print("Indici di ricerca assenti (FTS5 trigram non disponibile): la ricerca usa LIKE.")
+        return
+    print(f"Ricostruiti {count} indici di ricerca.")
+
+
+def check_search(args):
+    """Verifica che gli indici di ricerca siano allineati alle tabelle."""
+    with SessionLocal() as db:
+        problems = search.check_consistency(db)
+    for problem in problems:
+        print(problem)
+    if problems:
+        print(f"{len(problems)} indici non allineati: esegui rebuild-search.")
+        return 1
+    print("Indici di ricerca consistenti.")
+    return 0
+
+
+def migrate_tenants(args):
+    """Applica le migrazioni pendenti ai database di tutti i tenant con utenti."""
+    with SessionLocal() as db:
+        tenants = tenancy.known_tenants(db)
+    for tenant in tenants:
+        tenant_engine = engine if tenant == config.DEFAULT_TENANT else make_engine(tenancy.tenant_url(tenant))
+        applied = migrations.upgrade(tenant_engine)
+        versions = ", ".join(str(m.version) for m in applied) or "nessuna"
+        print(f"{tenant}: migrazioni applicate: {versions}")
+        if tenant_engine is not engine:
+            tenant_engine.dispose()
+
+
+def main(argv=None):
+    global engine, SessionLocal
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenant", default=None, help="tenant su cui operare (default: database principale)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("migrate", help=migrate.__doc__)
+    p.add_argument("--to", type=int, default=None, help="versione di destinazione")
+    p.set_defaults(func=migrate)
+    sub.add_parser("db-version", help=db_version.__doc__).set_defaults(func=db_version)
+    p = sub.add_parser("explain", help=explain.__doc__)
+    p.add_argument("--days", type=int, default=30, help="ampiezza del periodo filtrato")
+    p.add_argument("--id", type=int, default=1, help="id prodotto/rider/ingrediente di esempio")
+    p.set_defaults(func=explain)
+    sub.add_parser("rebuild-food-cost", help=rebuild_food_cost.__doc__).set_defaults(func=rebuild_food_cost)
+    p = sub.add_parser("check-food-cost", help=check_food_cost.__doc__)
+    p.add_argument("--tolerance", type=float, default=1e-6)
+    p.set_defaults(func=check_food_cost)
+    p = sub.add_parser("rebuild-rollups", help=rebuild_rollups.__doc__)
+    p.add_argument("--from", dest="date_from", type=datetime.fromisoformat, default=None,
+                   help="primo giorno da ricalcolare (ISO 8601)")
+    p.add_argument("--to", dest="date_to", type=datetime.fromisoformat, default=None,
+                   help="ultimo istante da ricalcolare (ISO 8601)")
+    p.set_defaults(func=rebuild_rollups)
+    sub.add_parser("check-rollups", help=check_rollups.__doc__).set_defaults(func=check_rollups)
+    sub.add_parser("rebuild-stock", help=rebuild_stock.__doc__).set_defaults(func=rebuild_stock)
+    p = sub.add_parser("check-stock", help=check_stock.__doc__)
+    p.add_argument("--tolerance", type=float, default=1e-6)
+    p.set_defaults(func=check_stock)
+    sub.add_parser("snapshot-stock", help=snapshot_stock.__doc__).set_defaults(func=snapshot_stock)
+    sub.add_parser("rebuild-search", help=rebuild_search.__doc__).set_defaults(func=rebuild_search)
+    sub.add_parser("check-search", help=check_search.__doc__).set_defaults(func=check_search)
+    sub.add_parser("migrate-tenants", help=migrate_tenants.__doc__).set_defaults(func=migrate_tenants)
+
+    args = parser.parse_args(argv)
+    if args.tenant and args.tenant != config.DEFAULT_TENANT:
+        tenancy.ensure_sqlite_dir(tenancy.tenant_url(args.tenant))
+        engine = make_engine(tenancy.tenant_url(args.tenant))
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    if args.func not in (migrate, db_version):
+        migrations.upgrade(engine)
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
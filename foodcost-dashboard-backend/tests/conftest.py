@@ -0,0 +1,27 @@
+import os
+import sys
+
+# configurazione di test, prima di importare app (config legge l'ambiente all'import)
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("AUTH_REQUIRED", "false")
+os.environ.setdefault("STOCK_SNAPSHOT_EVERY", "3")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app import migrations
+from app.database import make_engine
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Sessione su un database SQLite nuovo, con tutte le migrazioni applicate."""
+    engine = make_engine(f"sqlite:///{tmp_path / 'foodcost.db'}")
+    migrations.upgrade(engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
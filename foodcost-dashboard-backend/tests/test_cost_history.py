@@ -0,0 +1,183 @@
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import cost_history, crud, models, rollups, schemas
+
+DAY = datetime(2026, 10, 1)
+FLOORS = {"hour": rollups.floor_hour, "day": rollups.floor_day, "week": rollups.floor_week}
+
+
+@pytest.fixture
+def menu(db):
+    """
+    Ingredienti a (1.0) e b (2.0); impasto = 2a, pizza = impasto + b (semilavorato),
+    bibita = b; due rider.
+    """
+    a = crud.create_ingredient(db, schemas.IngredientCreate(name="a", unit_cost=1.0)).id
+    b = crud.create_ingredient(db, schemas.IngredientCreate(name="b", unit_cost=2.0)).id
+    impasto, pizza, bibita = (
+        crud.create_product(db, schemas.ProductCreate(name=name)).id for name in ("impasto", "pizza", "bibita")
+    )
+    crud.create_recipe(db, schemas.RecipeCreate(product_id=impasto, ingredient_id=a, quantity=2))
+    crud.create_recipe(db, schemas.RecipeCreate(product_id=pizza, component_product_id=impasto, quantity=1))
+    crud.create_recipe(db, schemas.RecipeCreate(product_id=pizza, ingredient_id=b, quantity=1))
+    crud.create_recipe(db, schemas.RecipeCreate(product_id=bibita, ingredient_id=b, quantity=1))
+    r1, r2 = (crud.create_rider(db, schemas.RiderCreate(name=name, delivery_time=20)).id for name in ("r1", "r2"))
+    return dict(a=a, b=b, impasto=impasto, pizza=pizza, bibita=bibita, r1=r1, r2=r2)
+
+
+def _order(db, product_id, at, quantity=1, rider_id=None):
+    crud.create_order(db, schemas.OrderCreate(
+        product_id=product_id, quantity=quantity, price=10.0 * quantity, rider_id=rider_id, timestamp=at,
+    ))
+
+
+def _change_cost(db, ingredient_id, unit_cost, at):
+    db.add(models.IngredientCostHistory(ingredient_id=ingredient_id, unit_cost=unit_cost, valid_from=at))
+    db.commit()
+
+
+def _food_costs(db, granularity, date_from=None, date_to=None, product_id=None, rider_id=None):
+    rows = rollups.get_sales_timeseries(db, granularity, date_from, date_to, product_id, rider_id)
+    return {(row["bucket"], row["product_id"]): row["food_cost"] for row in rows}
+
+
+def _brute_force(db, granularity, date_from=None, date_to=None, product_id=None, rider_id=None):
+    """Food cost per (bucket, prodotto) ricalcolato ordine per ordine ai costi del momento di vendita."""
+    expected = defaultdict(float)
+    for order in db.query(models.Order):
+        if date_from is not None and order.timestamp < date_from:
+            continue
+        if date_to is not None and order.timestamp >= date_to:
+            continue
+        if product_id is not None and order.product_id != product_id:
+            continue
+        if rider_id is not None and order.rider_id != rider_id:
+            continue
+        unit = dict(cost_history.food_costs_as_of(db, order.timestamp)).get(order.product_id, 0.0)
+        expected[(FLOORS[granularity](order.timestamp), order.product_id)] += order.quantity * unit
+    return dict(expected)
+
+
+def _assert_close(got, expected):
+    assert got.keys() == expected.keys()
+    for key in expected:
+        assert got[key] == pytest.approx(expected[key]), key
+
+
+def test_cost_change_inside_hour_bucket(db, menu):
+    _order(db, menu["pizza"], DAY.replace(hour=12, minute=10))
+    _order(db, menu["pizza"], DAY.replace(hour=12, minute=50))
+    _change_cost(db, menu["a"], 3.0, DAY.replace(hour=12, minute=30))
+
+    # 12:10 -> 2*1 + 2 = 4; 12:50 -> 2*3 + 2 = 8
+    for granularity in FLOORS:
+        bucket = FLOORS[granularity](DAY.replace(hour=12))
+        assert _food_costs(db, granularity) == {(bucket, menu["pizza"]): pytest.approx(12.0)}
+    assert cost_history.get_product_margins(db) == [(menu["pizza"], 20.0, 2, pytest.approx(6.0))]
+
+
+def test_cost_change_inside_day_bucket(db, menu):
+    for hour in (10, 18):
+        _order(db, menu["pizza"], DAY.replace(hour=hour))
+        _order(db, menu["bibita"], DAY.replace(hour=hour), quantity=2)
+    _change_cost(db, menu["b"], 5.0, DAY.replace(hour=15))
+
+    # pizza: 4 + 7; bibita: 2 x 2 + 2 x 5
+    expected = {(DAY, menu["pizza"]): 11.0, (DAY, menu["bibita"]): 14.0}
+    _assert_close(_food_costs(db, "day", DAY, DAY + timedelta(days=1)), expected)
+    _assert_close(_food_costs(db, "day"), expected)
+    _assert_close(_food_costs(db, "hour"), _brute_force(db, "hour"))
+
+
+def test_sub_recipe_change_recomputes_ancestors(db, menu):
+    _change_cost(db, menu["a"], 3.0, DAY.replace(hour=9))
+    for product in ("impasto", "pizza", "bibita"):
+        _order(db, menu[product], DAY.replace(hour=12))
+        _order(db, menu[product], DAY.replace(hour=8))
+
+    # il cambio di a tocca impasto e, attraverso il semilavorato, pizza; non bibita
+    got = _food_costs(db, "day")
+    assert got[(DAY, menu["impasto"])] == pytest.approx(2.0 + 6.0)
+    assert got[(DAY, menu["pizza"])] == pytest.approx(4.0 + 8.0)
+    assert got[(DAY, menu["bibita"])] == pytest.approx(2.0 + 2.0)
+    margins = {pid: cost for pid, _, _, cost in cost_history.get_product_margins(db)}
+    assert margins == {
+        menu["impasto"]: pytest.approx(4.0), menu["pizza"]: pytest.approx(6.0), menu["bibita"]: pytest.approx(2.0),
+    }
+
+
+def test_filters_on_split_buckets(db, menu):
+    _order(db, menu["pizza"], DAY.replace(hour=12, minute=10), rider_id=menu["r1"])
+    _order(db, menu["pizza"], DAY.replace(hour=12, minute=50), rider_id=menu["r2"])
+    _order(db, menu["bibita"], DAY.replace(hour=12, minute=50), rider_id=menu["r1"])
+    _change_cost(db, menu["a"], 3.0, DAY.replace(hour=12, minute=30))
+    _change_cost(db, menu["b"], 4.0, DAY.replace(hour=12, minute=40))
+
+    hour = DAY.replace(hour=12)
+    assert _food_costs(db, "hour", rider_id=menu["r1"]) == {
+        (hour, menu["pizza"]): pytest.approx(4.0), (hour, menu["bibita"]): pytest.approx(4.0),
+    }
+    assert _food_costs(db, "hour", rider_id=menu["r2"]) == {(hour, menu["pizza"]): pytest.approx(10.0)}
+    assert _food_costs(db, "day", product_id=menu["pizza"]) == {(DAY, menu["pizza"]): pytest.approx(14.0)}
+    assert _food_costs(db, "day", product_id=menu["pizza"], rider_id=menu["r1"]) == {
+        (DAY, menu["pizza"]): pytest.approx(4.0),
+    }
+
+
+def test_partial_hour_bounds(db, menu):
+    for minute in (5, 25, 45):
+        _order(db, menu["bibita"], DAY.replace(hour=12, minute=minute))
+    _change_cost(db, menu["b"], 4.0, DAY.replace(hour=12, minute=30))
+
+    hour = DAY.replace(hour=12)
+    got = rollups.get_sales_timeseries(db, "hour", DAY.replace(hour=12, minute=20), DAY.replace(hour=12, minute=50))
+    assert [(row["bucket"], row["order_count"], row["food_cost"]) for row in got] == [(hour, 2, pytest.approx(6.0))]
+    assert dict(rollups.get_product_quantities(db, DAY.replace(hour=12, minute=20), DAY.replace(hour=12, minute=30))) == {
+        menu["bibita"]: 1,
+    }
+
+
+@pytest.mark.parametrize("granularity", sorted(FLOORS))
+def test_matches_per_order_recompute(db, menu, granularity):
+    rnd = random.Random(granularity)
+    products = [menu["impasto"], menu["pizza"], menu["bibita"]]
+    start = DAY - timedelta(days=10)
+    crud.bulk_create_orders(db, [
+        schemas.OrderCreate(
+            product_id=rnd.choice(products),
+            rider_id=rnd.choice([menu["r1"], menu["r2"], None]),
+            quantity=rnd.randint(1, 4),
+            price=5.0,
+            timestamp=start + timedelta(minutes=rnd.randrange(60 * 24 * 20)),
+        )
+        for _ in range(150)
+    ])
+    for _ in range(15):
+        at = start + timedelta(minutes=rnd.randrange(60 * 24 * 20), seconds=rnd.randrange(60))
+        _change_cost(db, rnd.choice([menu["a"], menu["b"]]), round(rnd.uniform(0.5, 5.0), 2), at)
+
+    ranges = [
+        (None, None),
+        (DAY, DAY + timedelta(days=3)),
+        (DAY + timedelta(hours=2, minutes=17), DAY + timedelta(days=4, hours=5, minutes=3)),
+        (DAY + timedelta(minutes=10), DAY + timedelta(minutes=40)),
+        (None, DAY + timedelta(hours=7, minutes=30)),
+        (DAY - timedelta(days=3, minutes=1), None),
+    ]
+    filters = [(None, None), (menu["pizza"], None), (None, menu["r2"])]
+    for date_from, date_to in ranges:
+        for product_id, rider_id in filters:
+            _assert_close(
+                _food_costs(db, granularity, date_from, date_to, product_id, rider_id),
+                _brute_force(db, granularity, date_from, date_to, product_id, rider_id),
+            )
+        # il margine lordo usa lo stesso costo al momento di vendita
+        totals = defaultdict(float)
+        for (_, pid), cost in _brute_force(db, granularity, date_from, date_to).items():
+            totals[pid] += cost
+        for pid, _, quantity, cost in cost_history.get_product_margins(db, date_from, date_to):
+            assert quantity * cost == pytest.approx(totals[pid])
@@ -0,0 +1,49 @@
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from app import crud, models, rollups, schemas
+
+
+def _orders(db, count, seed=0):
+    rnd = random.Random(seed)
+    product = crud.create_product(db, schemas.ProductCreate(name="pizza")).id
+    rider = crud.create_rider(db, schemas.RiderCreate(name="r1", delivery_time=20)).id
+    start = datetime(2026, 10, 1)
+    return [
+        schemas.OrderCreate(
+            product_id=product,
+            rider_id=rnd.choice([rider, None]),
+            quantity=rnd.randint(1, 3),
+            price=rnd.uniform(5, 15),
+            timestamp=start + timedelta(minutes=rnd.randrange(60 * 24 * 10)),
+        )
+        for _ in range(count)
+    ]
+
+
+def test_rollups_follow_order_writes(db):
+    orders = _orders(db, 60)
+    for order in orders[:10]:
+        crud.create_order(db, order)
+    crud.bulk_create_orders(db, orders[10:])
+    assert rollups.check_consistency(db) == []
+
+    for order in db.query(models.Order).order_by(models.Order.id).limit(20).all():
+        crud.delete_order(db, order.id)
+    assert rollups.check_consistency(db) == []
+
+
+def test_check_consistency_detects_drift_and_rebuild_fixes_it(db):
+    crud.bulk_create_orders(db, _orders(db, 30))
+    db.execute(update(rollups.HOURLY).values(quantity=rollups.HOURLY.c.quantity + 1))
+    db.execute(rollups.DAILY.delete())
+    db.commit()
+
+    mismatches = rollups.check_consistency(db)
+    assert {m["table"] for m in mismatches} == {rollups.HOURLY.name, rollups.DAILY.name}
+
+    rollups.rebuild(db)
+    db.commit()
+    assert rollups.check_consistency(db) == []
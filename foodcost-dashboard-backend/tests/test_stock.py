@@ -0,0 +1,57 @@
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, update
+
+from app import crud, models, schemas, stock
+
+
+def _brute_force(db, as_of):
+    """Giacenza all'istante as_of sommando tutti i movimenti con timestamp <= as_of."""
+    totals = {}
+    for movement in db.query(models.InventoryMovement):
+        totals.setdefault(movement.ingredient_id, 0.0)
+        if movement.timestamp <= as_of:
+            totals[movement.ingredient_id] += stock.signed_quantity(movement.movement_type, movement.quantity)
+    return totals
+
+
+def test_snapshots_match_full_recompute(db):
+    rnd = random.Random(0)
+    ingredients = [
+        crud.create_ingredient(db, schemas.IngredientCreate(name=f"i{n}", unit_cost=1.0)).id for n in range(3)
+    ]
+    start = datetime(2026, 10, 1)
+    for _ in range(60):
+        crud.create_inventory_movement(db, schemas.InventoryMovementCreate(
+            ingredient_id=rnd.choice(ingredients),
+            quantity=rnd.randint(1, 10),
+            movement_type=rnd.choice(["carico", "scarico"]),
+            # anche retrodatati rispetto agli snapshot già presi
+            timestamp=start + timedelta(hours=rnd.randrange(24 * 30)),
+        ))
+    for movement in db.query(models.InventoryMovement).order_by(func.random()).limit(15).all():
+        crud.delete_inventory_movement(db, movement.id)
+
+    assert db.execute(select(func.count()).select_from(stock.SNAPSHOTS)).scalar() > 0
+    assert stock.check_consistency(db) == []
+    for hours in range(-1, 24 * 31, 17):
+        as_of = start + timedelta(hours=hours, minutes=30)
+        assert {ing: qty for ing, qty in stock.get_stock(db, as_of)} == _brute_force(db, as_of)
+    assert dict(stock.get_stock(db, start + timedelta(days=5), ingredients[1])).keys() == {ingredients[1]}
+
+
+def test_check_consistency_detects_drift_and_rebuild_fixes_it(db):
+    ingredient = crud.create_ingredient(db, schemas.IngredientCreate(name="farina", unit_cost=1.0)).id
+    for day in range(1, 8):
+        crud.create_inventory_movement(db, schemas.InventoryMovementCreate(
+            ingredient_id=ingredient, quantity=10, movement_type="carico", timestamp=datetime(2026, 10, day),
+        ))
+    db.execute(update(stock.STOCK).values(quantity=0.0))
+    db.commit()
+    assert stock.check_consistency(db) == [{"ingredient_id": ingredient, "stored": 0.0, "expected": 70.0}]
+
+    stock.rebuild(db)
+    db.commit()
+    assert stock.check_consistency(db) == []
+    assert stock.get_stock(db, datetime(2026, 10, 3, 12)) == [(ingredient, 30.0)]